@@ -1,11 +1,7 @@
 from scipy import exp
-import os
 import SloppyScaling
-reload(SloppyScaling)
-import WindowScalingInfo as WS
-reload(WS)
-import Utils
-reload(Utils)
+import Registry
+
 
 name = 'A00' # This is the name used in the files
 
@@ -20,7 +16,7 @@ Ytheory = "(s*(k/L)**(sigma_k*(1.+zeta)))**(2.-tau) /s * exp(-(Ss*Ixs)**ns+U0)"
 Yscaled = \
         "(1.0*k/L)**((sigma_k)*(tau-2.)*(1.+zeta)) * s**(tau-1.) * A00"
 YscaledTeX = \
-   r'${\cal{A}_{00}} = (k/L)^{\sigma_k (\tau-2) (1+\zeta)} s^{\tau-1} A_{00}$'
+   r'${\mathcal{A}_{00}} = (k/L)^{\sigma_k (\tau-2) (1+\zeta)} s^{\tau-1} A_{00}$'
 
 title = 'A(s,k,W): Area covered by avalanches of size S in window of width W'
 scalingTitle = 'A(s,k,W) scaling function'
@@ -45,51 +41,36 @@ initialParameterValues = (1.18,0.39,0.79,1.6,7.07,-1.81)
 #initialParameterValues_corrections = (0.1,)
 initialParameterValues_corrections = (1.0,1.0,0.5)
 
-if WS.corrections_to_scaling:
-    Ytheory = Ytheory + "*" + Ytheory_corrections
-    parameterNames = parameterNames + "," + parameterNames_corrections
-    initialParameterValues = initialParameterValues + initialParameterValues_corrections
-
-
-# If single independent parameter, must have comma after it -- makes it a tuple
-theory = SloppyScaling.ScalingTheory(Ytheory, parameterNames, \
-                initialParameterValues, WS.independentNames, \
-                scalingX = Xscaled, scalingY = Yscaled, \
-                scalingXTeX = XscaledTeX, \
-                scalingYTeX = YscaledTeX, \
-                title = title, \
-                scalingTitle = scalingTitle, \
-                Xname=Xname, XscaledName=XscaledName, \
-                Yname=Yname, \
-                normalization = WS.normalization)
-
-data = SloppyScaling.Data()
-
-loaded = 0
-for independent in WS.independentValues:
-    L, k, W = independent
-    ext =  "_" + WS.simulType + ".bnd"
-    if os.getlogin() == 'yj':
-        k_string = "_k"
-    else:
-        k_string = "_k="
-    fileName = "".join([WS.dataDirectory,name,"_W=",str(W).rjust(4, str(0)),\
-                        k_string,str(k), "_System_Size=",str(2*L), "x", str(L), ext])
-    success = data.InstallCurve(independent, fileName, \
-        pointSymbol=WS.Symbol[independent], \
-        pointColor=WS.Color[independent], \
-        initialSkip = WS.rows_to_skip)
-    loaded += success
-
-nFiles = len(WS.independentValues)
-if loaded ==  nFiles:
-    print "Loaded %2d/%2d files (%s)" % (loaded, nFiles, name)
-else:
-    print "====================="
-    print "Attention! %2d/%2d files are missing (%s)" %  (nFiles-loaded, nFiles, name)
-    print "====================="
-
-f = __file__
-f = f.split("/")[-1]
-thisModule = f.split('Module.py')[0]
-exec(thisModule + "= SloppyScaling.Model(theory, data, name, WS.sortedValues)")
+# (lower, upper) bounds, enforced by the fits: outside them the theory
+# overflows or is not defined
+parameterBounds = {'sigma_k': (0., None), 'zeta': (0., None), 'ns': (0., None), \
+                   'Ixs': (0., None)}
+
+def MakeTheory(config):
+    """
+    ScalingTheory of A00 for the settings in config (see Registry.py)
+    """
+    Ytheory_ = Ytheory
+    parameterNames_ = parameterNames
+    initialParameterValues_ = initialParameterValues
+    if config.corrections_to_scaling:
+        Ytheory_ = Ytheory + "*" + Ytheory_corrections
+        parameterNames_ = parameterNames + "," + parameterNames_corrections
+        initialParameterValues_ = initialParameterValues + \
+                                  initialParameterValues_corrections
+    # If single independent parameter, must have comma after it -- makes it a tuple
+    return SloppyScaling.ScalingTheory(Ytheory_, parameterNames_, \
+                    initialParameterValues_, config.independentNames, \
+                    scalingX = Xscaled, scalingY = Yscaled, \
+                    scalingXTeX = XscaledTeX, \
+                    scalingYTeX = YscaledTeX, \
+                    title = title, \
+                    scalingTitle = scalingTitle, \
+                    Xname=Xname, XscaledName=XscaledName, \
+                    Yname=Yname, \
+                    normalization = config.normalization, \
+                    parameterBounds = parameterBounds)
+
+# Also makes A00Module.A00 the Model of A00 for WindowScalingInfo, loaded on
+# first use (see Registry.DefaultModel)
+Registry.Register('A00', MakeTheory, name)
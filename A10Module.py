@@ -1,11 +1,6 @@
 from scipy import exp
-import os
 import SloppyScaling
-reload(SloppyScaling)
-import WindowScalingInfo as WS
-reload(WS)
-import Utils
-reload(Utils)
+import Registry
 
 
 name = 'A10' # This is the name used in the files
@@ -20,7 +15,7 @@ Ytheory = "((1.0*k/L)**(sigma_k))**((2.-tau)*(1.+zeta))*s**(1.-tau+1./(1.+zeta))
 Yscaled = \
         "((1.0*k/L)**(sigma_k))**(-(2.-tau)*(1.+zeta)) * s**(-1.+tau-1./(1.+zeta)) * W * A10"
 YscaledTeX = \
-   r'${\cal{A}_{10}} = ((k/L)^{\sigma_k})^{-(2-\tau) (1+\zeta)} s^{-1+\tau-1/(1+\zeta)} W A_{10}$'
+   r'${\mathcal{A}_{10}} = ((k/L)^{\sigma_k})^{-(2-\tau) (1+\zeta)} s^{-1+\tau-1/(1+\zeta)} W A_{10}$'
 
 title = 'A(s,k,W): Area covered by avalanches of size s in window of width win'
 scalingTitle = 'A(s,k,win) scaling function'
@@ -40,52 +35,36 @@ initialParameterValues_corrections = (0.,0.,0.,0.)
 parameterNames = parameterNames.replace(" ","")
 parameterNames_corrections = parameterNames_corrections.replace(" ","")
 
-if WS.corrections_to_scaling:
-    Ytheory = Ytheory + "*" + Ytheory_corrections
-    parameterNames = parameterNames + "," + parameterNames_corrections
-    initialParameterValues = initialParameterValues + initialParameterValues_corrections
-
-
-# If single independent parameter, must have comma after it -- makes it a tuple
-theory = SloppyScaling.ScalingTheory(Ytheory, parameterNames, \
-                initialParameterValues, WS.independentNames, \
-                scalingX = Xscaled, scalingY = Yscaled, \
-                scalingXTeX = XscaledTeX, \
-                scalingYTeX = YscaledTeX, \
-                title = title, \
-                scalingTitle = scalingTitle, \
-                Xname=Xname, XscaledName=XscaledName, \
-                Yname=Yname, \
-                normalization = WS.normalization)
-
-data = SloppyScaling.Data()
-
-loaded = 0
-for independent in WS.independentValues:
-    L, k, W = independent
-    ext =  "_" + WS.simulType + ".bnd"
-    if os.getlogin() == 'yj':
-        k_string = "_k"
-    else:
-        k_string = "_k="
-    fileName = "".join([WS.dataDirectory,name,"_W=",str(W).rjust(4, str(0)),\
-                        k_string,str(k), "_System_Size=",str(2*L), "x", str(L), ext])
-    success = data.InstallCurve(independent, fileName, \
-        pointSymbol=WS.Symbol[independent], \
-        pointColor=WS.Color[independent], \
-        initialSkip = WS.rows_to_skip)
-    loaded += success
-
-nFiles = len(WS.independentValues)
-if loaded ==  nFiles:
-    print "Loaded %2d/%2d files (%s)" % (loaded, nFiles, name)
-else:
-    print "====================="
-    print "Attention! %2d/%2d files are missing (%s)" %  (nFiles-loaded, nFiles, name)
-    print "====================="
-
-
-f = __file__
-f = f.split("/")[-1]
-thisModule = f.split('Module.py')[0]
-exec(thisModule + "= SloppyScaling.Model(theory, data, name, WS.sortedValues)")
+# (lower, upper) bounds, enforced by the fits: outside them the theory
+# overflows or is not defined
+parameterBounds = {'sigma_k': (0., None), 'zeta': (0., None), 'Iy0': (0., None), \
+                   'Iy1': (0., None), 'n': (0., None)}
+
+def MakeTheory(config):
+    """
+    ScalingTheory of A10 for the settings in config (see Registry.py)
+    """
+    Ytheory_ = Ytheory
+    parameterNames_ = parameterNames
+    initialParameterValues_ = initialParameterValues
+    if config.corrections_to_scaling:
+        Ytheory_ = Ytheory + "*" + Ytheory_corrections
+        parameterNames_ = parameterNames + "," + parameterNames_corrections
+        initialParameterValues_ = initialParameterValues + \
+                                  initialParameterValues_corrections
+    # If single independent parameter, must have comma after it -- makes it a tuple
+    return SloppyScaling.ScalingTheory(Ytheory_, parameterNames_, \
+                    initialParameterValues_, config.independentNames, \
+                    scalingX = Xscaled, scalingY = Yscaled, \
+                    scalingXTeX = XscaledTeX, \
+                    scalingYTeX = YscaledTeX, \
+                    title = title, \
+                    scalingTitle = scalingTitle, \
+                    Xname=Xname, XscaledName=XscaledName, \
+                    Yname=Yname, \
+                    normalization = config.normalization, \
+                    parameterBounds = parameterBounds)
+
+# Also makes A10Module.A10 the Model of A10 for WindowScalingInfo, loaded on
+# first use (see Registry.DefaultModel)
+Registry.Register('A10', MakeTheory, name)
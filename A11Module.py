@@ -1,11 +1,6 @@
 from scipy import exp
-import os
 import SloppyScaling
-reload(SloppyScaling)
-import WindowScalingInfo as WS
-reload(WS)
-import Utils
-reload(Utils)
+import Registry
 
 
 name = 'A11' # This is the name used in the files
@@ -23,7 +18,7 @@ Ytheory = 'Ss**((2.-tau)*(1.+zeta)/zeta)/s*exp(-1.0*Ss**nh*Ixh)'
 #Ytheory = Ss+'**((2.-tau)*(1.+zeta)/zeta)/s*exp(-1.0*('+Ss+'-c)**nh*Ixh)'
 Yscaled = 'Ss**((tau-2.)*(1.+zeta)/zeta)*s*A11'       
 YscaledTeX = \
-   r'$(s (k/L)^{\sigma_k \zeta}/W)^{(\tau-2) (1+\zeta)/\zeta} s {\cal{A}_{11}}$'
+   r'$(s (k/L)^{\sigma_k \zeta}/W)^{(\tau-2) (1+\zeta)/\zeta} s {\mathcal{A}_{11}}$'
 
 title = 'A11(s,k,W): Area covered by avalanches of size S in window of width W'
 scalingTitle = 'A11(s,k,W) scaling function'
@@ -56,50 +51,35 @@ initialParameterValues_corrections = (1.0, 0.5, 1.0, 1.0)
 parameterNames = parameterNames.replace(" ","")
 parameterNames_corrections = parameterNames_corrections.replace(" ","")
 
-if WS.corrections_to_scaling:
-    Ytheory = Ytheory + "*" + Ytheory_corrections
-    parameterNames = parameterNames + "," + parameterNames_corrections
-    initialParameterValues = initialParameterValues + initialParameterValues_corrections
- 
-
-theory = SloppyScaling.ScalingTheory(Ytheory, parameterNames, \
-                initialParameterValues, WS.independentNames, \
-                scalingX = Xscaled, scalingY = Yscaled, scalingW = Wscaled,\
-                scalingXTeX = XscaledTeX, \
-                scalingYTeX = YscaledTeX, \
-                title = title, \
-                scalingTitle = scalingTitle, \
-                Xname=Xname, XscaledName=XscaledName, \
-                Yname=Yname, WscaledName = WscaledName, \
-                normalization = WS.normalization)
-
-data = SloppyScaling.Data()
-
-loaded = 0
-for independent in WS.independentValues:
-    L, k, W = independent
-    ext =  "_" + WS.simulType + ".bnd"
-    if os.getlogin() == 'yj':
-        k_string = "_k"
-    else:
-        k_string = "_k="
-    fileName = "".join([WS.dataDirectory,name,"_W=",str(W).rjust(4, str(0)),\
-                        k_string,str(k), "_System_Size=",str(2*L), "x", str(L), ext])
-    success = data.InstallCurve(independent, fileName, \
-        pointSymbol=WS.Symbol[independent], \
-        pointColor=WS.Color[independent], \
-        initialSkip = WS.rows_to_skip)
-    loaded += success
-
-nFiles = len(WS.independentValues)
-if loaded ==  nFiles:
-    print "Loaded %2d/%2d files (%s)" % (loaded, nFiles, name)
-else:
-    print "====================="
-    print "Attention! %2d/%2d files are missing (%s)" %  (nFiles-loaded, nFiles, name)
-    print "====================="
-
-f = __file__
-f = f.split("/")[-1]
-thisModule = f.split('Module.py')[0]
-exec(thisModule + "= SloppyScaling.Model(theory, data, name, WS.sortedValues)")
+# (lower, upper) bounds, enforced by the fits: outside them the theory
+# overflows or is not defined
+parameterBounds = {'sigma_k': (0., None), 'zeta': (0., None), 'Ixh': (0., None), \
+                   'nh': (0., None)}
+
+def MakeTheory(config):
+    """
+    ScalingTheory of A11 for the settings in config (see Registry.py)
+    """
+    Ytheory_ = Ytheory
+    parameterNames_ = parameterNames
+    initialParameterValues_ = initialParameterValues
+    if config.corrections_to_scaling:
+        Ytheory_ = Ytheory + "*" + Ytheory_corrections
+        parameterNames_ = parameterNames + "," + parameterNames_corrections
+        initialParameterValues_ = initialParameterValues + \
+                                  initialParameterValues_corrections
+    return SloppyScaling.ScalingTheory(Ytheory_, parameterNames_, \
+                    initialParameterValues_, config.independentNames, \
+                    scalingX = Xscaled, scalingY = Yscaled, scalingW = Wscaled,\
+                    scalingXTeX = XscaledTeX, \
+                    scalingYTeX = YscaledTeX, \
+                    title = title, \
+                    scalingTitle = scalingTitle, \
+                    Xname=Xname, XscaledName=XscaledName, \
+                    Yname=Yname, WscaledName = WscaledName, \
+                    normalization = config.normalization, \
+                    parameterBounds = parameterBounds)
+
+# Also makes A11Module.A11 the Model of A11 for WindowScalingInfo, loaded on
+# first use (see Registry.DefaultModel)
+Registry.Register('A11', MakeTheory, name)
@@ -0,0 +1,273 @@
+"""
+Benchmarks of fitting throughput on synthetic scaling data sets.
+
+The A00, A11 and Ahk theories are taken from their modules, and data sets
+of increasing size (number of (L,k,W) curves x points per curve) are
+generated from them with fixed seeds. For each size the suite times
+Residual, a finite-difference Jacobian (point by point and batched),
+BestFit, a joint A00+A11 CompositeModel fit (with leastsq, and with
+each of the other optimizer backends of Optimizers.py) and the loading
+of the .bnd files.
+
+Usage:
+    python Benchmarks.py -o results.json
+    python Benchmarks.py -o results.json -b baseline.json
+    python Benchmarks.py --quick --save-baseline baseline.json
+Timings worse than the baseline by more than the tolerance are flagged,
+and the exit status is 1 if any is found.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import optparse
+import scipy
+import Utils
+import SyntheticData
+
+defaultSizes = [(8, 40), (32, 40), (32, 160), (128, 160)]
+quickSizes = [(8, 40), (32, 40)]
+moduleNames = ['A00', 'A11', 'Ahk']
+
+Ls = [1024, 2048, 4096]
+ks = [0.001, 0.005, 0.01, 0.05, 0.1, 1]
+Ws = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+
+def GetTheory(moduleName):
+    """
+    New ScalingTheory of moduleName (see Registry.py)
+    """
+    import Registry
+    return Registry.MakeTheory(moduleName)
+
+def SyntheticIndependentValues(nCurves):
+    """
+    First nCurves (L,k,W) combinations, cycling on W fastest
+    """
+    out = []
+    for L in Ls:
+        for k in ks:
+            for W in Ws:
+                if W <= L:
+                    out.append((L, k, W))
+    if nCurves > len(out):
+        raise ValueError("at most %d synthetic curves" % len(out))
+    return out[:nCurves]
+
+def SyntheticCurve(theory, parameterValues, independent, nPoints, \
+                   noise = 0.05, dynamicRange = 1.e8, randomState = None):
+    """
+    Log-binned curve of SyntheticData.SyntheticCurve with nPoints bins
+    over the range where the theory is within dynamicRange of its
+    maximum; the number of events gives at least 1/noise**2 counts in
+    every bin, so that the relative noise is at most noise
+    """
+    X = 10**scipy.linspace(0., 6., 600)
+    Y = theory.Y(X, parameterValues, independent)
+    good = scipy.isfinite(Y) & (Y > Y[scipy.isfinite(Y)].max()/dynamicRange)
+    decades = scipy.log10(X[good].max())
+    D = decades/(nPoints - 1)
+    X = 10**scipy.linspace(0., decades, nPoints)
+    Y = theory.Y(X, parameterValues, independent)
+    bins = X*(10**(D/2.) - 10**(-D/2.))
+    nEvents = 1./noise**2/(Y*bins).min()
+    return SyntheticData.SyntheticCurve(theory, parameterValues, independent, \
+                                        nEvents, 1./D, decades, randomState)
+
+def SyntheticModel(moduleName, nCurves, nPoints, seed = 0):
+    import SloppyScaling
+    model = SloppyScaling.Model(GetTheory(moduleName), SloppyScaling.Data(), \
+                                moduleName, False)
+    FillSyntheticData(model, nCurves, nPoints, seed=seed)
+    return model
+
+def FillSyntheticData(model, nCurves, nPoints, parameterValues = None, \
+                      seed = 0):
+    """
+    Installs nCurves synthetic curves, generated at parameterValues
+    (the initial values of the theory by default), in model.data
+    """
+    if parameterValues is None:
+        parameterValues = model.theory.initialParameterValues
+    randomState = scipy.random.RandomState(seed)
+    for independent in SyntheticIndependentValues(nCurves):
+        X, Y, errorBar = SyntheticCurve(model.theory, parameterValues, \
+                                        independent, nPoints, \
+                                        randomState=randomState)
+        model.data.InstallArrays(independent, X, Y, errorBar)
+
+def WriteCurves(model, directory):
+    """
+    Writes the curves of model as .bnd files, returning the file names
+    """
+    fileNames = {}
+    for independent in model.data.experiments:
+        fileName = Utils.get_fileName(directory + os.sep, model.name, \
+                                      independent)
+        SyntheticData.WriteBnd(fileName, model.data.X[independent], \
+                               model.data.Y[independent], \
+                               model.data.errorBar[independent])
+        fileNames[independent] = fileName
+    return fileNames
+
+def TimeIt(fn, repeat = 3, minTime = 0.2):
+    """
+    Best time per call of fn() over repeat runs, each of at least minTime
+    """
+    best = None
+    for r in range(repeat):
+        number = 0
+        start = time.time()
+        while True:
+            fn()
+            number += 1
+            elapsed = time.time() - start
+            if elapsed >= minTime:
+                break
+        if best is None or elapsed/number < best:
+            best = elapsed/number
+    return best
+
+def FiniteDifferenceJacobian(model, parameterValues, eps = 1.e-7, \
+                             batch = False):
+    p0 = scipy.array(parameterValues, dtype=float)
+    steps = eps*scipy.maximum(scipy.absolute(p0), 1.)
+    shifted = p0 + scipy.diag(steps)
+    if batch:
+        rows = model.Residual(scipy.vstack((p0, shifted)))
+        r0, rows = rows[0], rows[1:]
+    else:
+        r0 = model.Residual(p0)
+        rows = scipy.array([model.Residual(p) for p in shifted])
+    return scipy.transpose((rows - r0)/steps[:, scipy.newaxis])
+
+def BenchModel(model, results, tag):
+    p = scipy.array(model.theory.initialParameterValues)
+    nPoints = len(model.Residual(p))
+    t = TimeIt(lambda: model.Residual(p))
+    results['residual/' + tag] = {'seconds': t, 'pointsPerSecond': nPoints/t}
+    results['jacobian/' + tag] = \
+        {'seconds': TimeIt(lambda: FiniteDifferenceJacobian(model, p))}
+    results['jacobianBatch/' + tag] = \
+        {'seconds': TimeIt(lambda: FiniteDifferenceJacobian(model, p, \
+                                                            batch=True))}
+    start = time.time()
+    out = model.BestFit(1.05*p)
+    results['bestFit/' + tag] = {'seconds': time.time()-start, \
+                                 'nfev': out[2]['nfev'], \
+                                 'cost': float(out[2]['cost'])}
+
+def BenchLoad(model, results, tag):
+    import SloppyScaling
+    directory = tempfile.mkdtemp()
+    try:
+        fileNames = WriteCurves(model, directory)
+        def load():
+            data = SloppyScaling.Data()
+            for independent in model.data.experiments:
+                data.InstallCurve(independent, fileNames[independent])
+        results['load/' + tag] = {'seconds': TimeIt(load, repeat=1)}
+    finally:
+        shutil.rmtree(directory)
+
+def BenchComposite(nCurves, nPoints, results, tag):
+    import SloppyScaling
+    joint = SloppyScaling.CompositeModel('A00A11')
+    for moduleName in ['A00', 'A11']:
+        joint.InstallModel(moduleName, SloppyScaling.Model( \
+            GetTheory(moduleName), SloppyScaling.Data(), moduleName, False))
+    # Data generated from the shared parameter values of the joint theory
+    p = scipy.array(joint.theory.initialParameterValues)
+    for model in joint.Models.values():
+        FillSyntheticData(model, nCurves, nPoints, p)
+    t = TimeIt(lambda: joint.Residual(p))
+    results['compositeResidual/' + tag] = {'seconds': t}
+    start = time.time()
+    out = joint.BestFit(1.05*p)
+    results['compositeBestFit/' + tag] = {'seconds': time.time()-start, \
+                                          'nfev': out[2]['nfev'], \
+                                          'cost': float(out[2]['cost'])}
+    import Optimizers
+    for method in Optimizers.backendNames:
+        if method == 'leastsq':
+            continue
+        try:
+            out = joint.BestFit(1.05*p, method=method)
+        except ValueError, error:
+            # e.g. non-finite residuals met by least_squares
+            print "%s/%s failed: %s" % (method, tag, error)
+            continue
+        results['compositeFit/' + method + '/' + tag] = \
+            {'seconds': out.seconds, 'nfev': out.nfev, 'cost': out.cost}
+
+def RunSuite(sizes = defaultSizes, modules = moduleNames, verbose = True):
+    results = {}
+    for nCurves, nPoints in sizes:
+        sizeTag = "c%d_p%d" % (nCurves, nPoints)
+        for moduleName in modules:
+            tag = moduleName + "/" + sizeTag
+            model = SyntheticModel(moduleName, nCurves, nPoints)
+            BenchModel(model, results, tag)
+            BenchLoad(model, results, tag)
+            if verbose:
+                print "%-20s residual %.2e s, fit %.3f s" % (tag, \
+                    results['residual/'+tag]['seconds'], \
+                    results['bestFit/'+tag]['seconds'])
+        BenchComposite(nCurves, nPoints, results, sizeTag)
+    return {'python': platform.python_version(), \
+            'scipy': scipy.__version__, \
+            'machine': platform.machine(), \
+            'date': time.strftime("%Y-%m-%d %H:%M:%S"), \
+            'results': results}
+
+def Compare(current, baseline, tolerance = 0.2):
+    """
+    List of (benchmark, baseline seconds, current seconds) slower than the
+    baseline by more than the fraction tolerance
+    """
+    regressions = []
+    for key, value in sorted(current['results'].items()):
+        if key in baseline['results']:
+            old = baseline['results'][key]['seconds']
+            if value['seconds'] > old*(1.+tolerance):
+                regressions.append((key, old, value['seconds']))
+    return regressions
+
+def main(argv):
+    parser = optparse.OptionParser(usage="python Benchmarks.py [options]")
+    parser.add_option("-o", "--output", help="write results as JSON")
+    parser.add_option("-b", "--baseline", help="compare with saved results")
+    parser.add_option("--save-baseline", dest="saveBaseline", \
+                      help="write results as the new baseline")
+    parser.add_option("-t", "--tolerance", type="float", default=0.2, \
+                      help="allowed slowdown fraction (default 0.2)")
+    parser.add_option("-q", "--quick", action="store_true", \
+                      help="only the small data sets")
+    parser.add_option("-m", "--modules", default=",".join(moduleNames))
+    options, args = parser.parse_args(argv)
+    sizes = options.quick and quickSizes or defaultSizes
+    current = RunSuite(sizes, options.modules.split(","))
+    for fileName in [options.output, options.saveBaseline]:
+        if fileName:
+            outfile = open(fileName, 'w')
+            json.dump(current, outfile, indent=1, sort_keys=True)
+            outfile.close()
+    if options.baseline:
+        infile = open(options.baseline)
+        baseline = json.load(infile)
+        infile.close()
+        regressions = Compare(current, baseline, options.tolerance)
+        for key, old, new in regressions:
+            print "REGRESSION %-35s %.3e s -> %.3e s (%+.0f%%)" % \
+                    (key, old, new, 100.*(new/old-1.))
+        if regressions:
+            return 1
+        print "No regressions against %s" % options.baseline
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
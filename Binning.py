@@ -0,0 +1,175 @@
+"""
+Streaming log-binning of raw avalanche event files into curves, in place
+of the external toBinDistributions.py.
+
+An event file is binary, nColumns values of type dtype per event (e.g.
+size and width of each avalanche). It is memory mapped and read in
+chunks of chunkSize events, each added to a LogHistogram, so the memory
+used does not depend on the size of the file. The bins are uniform in
+log10(X) and centered on X = xMin 10^(n/binsPerDecade), as NormLog
+expects; Y is the number of events (or the sum of the weights, e.g. the
+area of the avalanches) per event and per unit X, with Poisson error
+bars. Empty bins are dropped.
+
+Example, sizes in column 0 of files of (size, width) float64 pairs:
+    X, Y, errorBar = Binning.BinEventFile("A11_L1024_k0.01_W16.raw",
+                                          nColumns=2)
+    Binning.BinEventFiles({(1024,0.01,16): "A11_L1024_k0.01_W16.raw"},
+                          data=model.data, nColumns=2)
+or from the shell, one .bnd per event file:
+    python Binning.py events.raw -o out.bnd --columns 2 --column 0
+"""
+
+import os
+import sys
+import optparse
+import scipy
+import SyntheticData
+
+class LogHistogram:
+    """
+    Counts (and sums of weights) of events in log10-spaced bins,
+    extended as larger events arrive
+    """
+    def __init__(self, binsPerDecade = 10, xMin = 1.):
+        self.D = 1./binsPerDecade
+        self.lgXmin = scipy.log10(xMin)
+        self.counts = scipy.zeros(0)
+        self.sumWeights = scipy.zeros(0)
+        self.sumWeights2 = scipy.zeros(0)
+        self.weighted = False
+        self.nEvents = 0
+        self.nDropped = 0
+
+    def Add(self, x, weights = None):
+        """
+        Adds the events x; those below the first bin (or not positive)
+        are only counted in nEvents and nDropped
+        """
+        x = scipy.asarray(x, dtype=float)
+        self.nEvents += len(x)
+        good = x > 0
+        bins = scipy.floor((scipy.log10(x[good]) - self.lgXmin)/self.D + 0.5)
+        keep = bins >= 0
+        bins = bins[keep].astype(int)
+        self.nDropped += len(x) - len(bins)
+        if not len(bins):
+            return
+        nBins = bins.max() + 1
+        if nBins > len(self.counts):
+            grow = nBins - len(self.counts)
+            self.counts = scipy.concatenate((self.counts, scipy.zeros(grow)))
+            self.sumWeights = scipy.concatenate((self.sumWeights, \
+                                                 scipy.zeros(grow)))
+            self.sumWeights2 = scipy.concatenate((self.sumWeights2, \
+                                                  scipy.zeros(grow)))
+        nBins = len(self.counts)
+        self.counts += scipy.bincount(bins, minlength=nBins)
+        if weights is not None:
+            self.weighted = True
+            w = scipy.asarray(weights, dtype=float)[good][keep]
+            self.sumWeights += scipy.bincount(bins, w, minlength=nBins)
+            self.sumWeights2 += scipy.bincount(bins, w*w, minlength=nBins)
+
+    def Curve(self):
+        """
+        X, Y and errorBar of the non-empty bins
+        """
+        n = scipy.nonzero(self.counts)[0]
+        lgX = self.lgXmin + n*self.D
+        X = 10**lgX
+        norm = max(self.nEvents, 1) * \
+               (10**(lgX+self.D/2.) - 10**(lgX-self.D/2.))
+        if self.weighted:
+            return X, self.sumWeights[n]/norm, \
+                   scipy.sqrt(self.sumWeights2[n])/norm
+        return X, self.counts[n]/norm, scipy.sqrt(self.counts[n])/norm
+
+def EventChunks(fileName, dtype = 'float64', nColumns = 1, \
+                chunkSize = 2**20):
+    """
+    Generator over (chunkSize, nColumns) blocks of the events of a
+    binary file, through a memory map; an incomplete last event is ignored
+    """
+    rowSize = scipy.dtype(dtype).itemsize * nColumns
+    nRows = os.path.getsize(fileName) // rowSize
+    for start in range(0, nRows, chunkSize):
+        # One map per chunk, copied and closed, so that the pages of the
+        # file already read do not stay resident
+        events = scipy.memmap(fileName, dtype=dtype, mode='r', \
+                              offset=start*rowSize, \
+                              shape=(min(chunkSize, nRows-start), nColumns))
+        chunk = scipy.array(events)
+        del events
+        yield chunk
+
+def BinEventFile(fileName, column = 0, weightColumn = None, \
+                 dtype = 'float64', nColumns = 1, chunkSize = 2**20, \
+                 binsPerDecade = 10, xMin = 1.):
+    """
+    X, Y, errorBar of the log-binned values in column of fileName,
+    weighted by the values in weightColumn if given
+    """
+    histogram = LogHistogram(binsPerDecade, xMin)
+    for chunk in EventChunks(fileName, dtype, nColumns, chunkSize):
+        weights = None
+        if weightColumn is not None:
+            weights = chunk[:, weightColumn]
+        histogram.Add(chunk[:, column], weights)
+    return histogram.Curve()
+
+def BinEventFiles(eventFiles, data = None, outputDirectory = None, \
+                  name = None, simulType = "NonLinear", k_string = "_k=", \
+                  **options):
+    """
+    Bins the event files of a dictionary {independent: fileName}, e.g.
+    {(L,k,W): fileName}; each curve is installed in data (a Data) and/or
+    written as a .bnd file in outputDirectory, named for name as the
+    modules expect (see Utils.get_fileName). options are passed to
+    BinEventFile. Returns {independent: (X, Y, errorBar)}
+    """
+    import Utils
+    if outputDirectory and not outputDirectory.endswith(os.sep):
+        outputDirectory = outputDirectory + os.sep
+    if outputDirectory and not os.path.isdir(outputDirectory):
+        os.makedirs(outputDirectory)
+    curves = {}
+    for independent in sorted(eventFiles):
+        X, Y, errorBar = BinEventFile(eventFiles[independent], **options)
+        if data is not None:
+            data.InstallArrays(independent, X, Y, errorBar, \
+                               fileName=eventFiles[independent])
+        if outputDirectory is not None:
+            fileName = Utils.get_fileName(outputDirectory, name, \
+                                          independent, simulType, k_string)
+            SyntheticData.WriteBnd(fileName, X, Y, errorBar)
+        curves[independent] = X, Y, errorBar
+    return curves
+
+def main(argv):
+    parser = optparse.OptionParser( \
+        usage="python Binning.py EVENTFILE -o BNDFILE [options]")
+    parser.add_option("-o", "--output", help=".bnd file to write")
+    parser.add_option("-t", "--dtype", default="float64")
+    parser.add_option("-n", "--columns", type="int", default=1, \
+                      help="values per event")
+    parser.add_option("-c", "--column", type="int", default=0)
+    parser.add_option("-w", "--weight-column", dest="weightColumn", \
+                      type="int")
+    parser.add_option("-b", "--bins-per-decade", dest="binsPerDecade", \
+                      type="int", default=10)
+    parser.add_option("--chunk", type="int", default=2**20, \
+                      help="events read at a time")
+    options, args = parser.parse_args(argv)
+    if len(args) != 1 or not options.output:
+        parser.error("an event file and --output are required")
+    X, Y, errorBar = BinEventFile(args[0], options.column, \
+                                  options.weightColumn, options.dtype, \
+                                  options.columns, options.chunk, \
+                                  options.binsPerDecade)
+    SyntheticData.WriteBnd(options.output, X, Y, errorBar)
+    print "%d bins written in %s" % (len(X), options.output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,253 @@
+"""
+Leave-one-out cross-validation of the scaling fits: does the scaling
+form found on some system sizes and windows predict the others?
+
+Each fold holds out one (L,k,W) curve (by='curve') or all the curves of
+one system size (by='L'), refits the Model or CompositeModel on the
+rest, warm started from the fit on all the curves, and evaluates the
+cost of the held-out curves at the refitted parameters. The folds are
+independent fits, run in a process pool (serially if processes == 1).
+
+    cv = CrossValidation.CrossValidate(model, by='L')
+    for fold in cv['folds']:
+        print fold['fold'], fold['heldOutCost'], fold['points']
+    python CrossValidation.py -m A11 -l A11_list -b L -o cv.json
+"""
+
+import sys
+import copy
+import json
+import time
+import optparse
+import multiprocessing
+import scipy
+import Multiresolution
+
+# Model, warm start, folds and fit options of the worker processes;
+# set once by _InitWorker
+_workerState = None
+
+def _InitWorker(state):
+    global _workerState
+    _workerState = state
+
+def _FitFold(n):
+    model, initialParameterValues, folds, fitOptions = _workerState
+    label, heldOut = folds[n]
+    result = FitFold(model, initialParameterValues, heldOut, **fitOptions)
+    result['fold'] = label
+    return result
+
+
+def CurveIds(model):
+    """
+    (model name, independent) of every curve of a CompositeModel, or
+    (None, independent) for a Model
+    """
+    if hasattr(model, 'Models'):
+        return [(name, independent) \
+                for name, m in sorted(model.Models.items()) \
+                for independent in m.data.experiments]
+    return [(None, independent) for independent in model.data.experiments]
+
+def SubModels(model):
+    """
+    {model name: Model} of a CompositeModel, or {None: model}
+    """
+    if hasattr(model, 'Models'):
+        return dict(model.Models)
+    return {None: model}
+
+def CurveLabel(curveId):
+    name, independent = curveId
+    if name is None:
+        return str(independent)
+    return "%s %s" % (name, independent)
+
+def LIndex(model):
+    """
+    Position of L in the independent values of model (first by default)
+    """
+    names = [name.strip() for name in model.theory.independentNames.split(",")]
+    if 'L' in names:
+        return names.index('L')
+    return 0
+
+def Folds(model, by = 'curve'):
+    """
+    List of (label, held-out curve ids): one fold per curve, or per
+    value of L (all the models of a CompositeModel together)
+    """
+    if by not in ('curve', 'L'):
+        raise ValueError("unknown fold kind %r (curve or L)" % (by,))
+    models = SubModels(model)
+    labels = []
+    folds = {}
+    for curveId in CurveIds(model):
+        name, independent = curveId
+        if by == 'curve':
+            label = CurveLabel(curveId)
+        else:
+            label = "L=%s" % (independent[LIndex(models[name])],)
+        if label not in folds:
+            labels.append(label)
+            folds[label] = []
+        folds[label].append(curveId)
+    return [(label, folds[label]) for label in labels]
+
+def SubsetData(data, experiments):
+    """
+    Data sharing the curves of data, restricted to experiments
+    """
+    subset = copy.copy(data)
+    subset.experiments = list(experiments)
+    return subset
+
+def CurveCosts(model, parameterValues, curveIds = None):
+    """
+    {curve id: cost of the curve} at parameterValues, for all the curves
+    or those of curveIds
+    """
+    models = SubModels(model)
+    names = models.keys()
+    datas = []
+    for name in names:
+        data = models[name].data
+        datas.append(SubsetData(data, [independent for independent in \
+                                       data.experiments if curveIds is None \
+                                       or (name, independent) in curveIds]))
+    saved = Multiresolution.SwapData([models[name] for name in names], datas)
+    try:
+        costs = {}
+        for name in names:
+            residuals = models[name].Residual(parameterValues, \
+                                              dictResidual=True)
+            for independent, res in residuals.items():
+                costs[(name, independent)] = float(scipy.dot(res, res))
+    finally:
+        Multiresolution.RestoreData(saved)
+    return costs
+
+def FitFold(model, initialParameterValues, heldOut, **fitOptions):
+    """
+    BestFit (fitOptions) of model without the curves heldOut, from
+    initialParameterValues, and the costs of the held-out curves at the
+    refitted parameters. Returns a dictionary with 'curves',
+    'curveCosts', 'heldOutCost', 'points', 'trainingCost', 'nfev',
+    'seconds' and 'parameters' (or 'error' if there is nothing to fit or
+    the fit cannot start)
+    """
+    models = SubModels(model)
+    names = models.keys()
+    datas = [SubsetData(models[name].data, \
+                        [independent for independent in \
+                         models[name].data.experiments \
+                         if (name, independent) not in heldOut]) \
+             for name in names]
+    result = {'curves': [CurveLabel(curveId) for curveId in heldOut]}
+    if not sum([len(data.experiments) for data in datas]):
+        result['error'] = "no curves left to fit"
+        return result
+    lastFit = model.lastFit
+    start = time.time()
+    saved = Multiresolution.SwapData([models[name] for name in names], datas)
+    try:
+        out = model.BestFit(initialParameterValues, **fitOptions)
+    except ValueError, error:
+        result['error'] = str(error)
+        return result
+    finally:
+        Multiresolution.RestoreData(saved)
+        model.lastFit = lastFit
+    costs = CurveCosts(model, out[0], heldOut)
+    result.update({'curveCosts': dict([(CurveLabel(curveId), cost) \
+                                       for curveId, cost in costs.items()]), \
+                   'heldOutCost': sum(costs.values()), \
+                   'points': sum([len(models[name].FitCurve(independent)[0]) \
+                                  for name, independent in heldOut]), \
+                   'trainingCost': float(out[2]['cost']), \
+                   'nfev': out[2]['nfev'], \
+                   'seconds': time.time() - start, \
+                   'parameters': [float(value) for value in out[0]]})
+    return result
+
+def CrossValidate(model, initialParameterValues = None, by = 'curve', \
+                  processes = None, verbose = False, **fitOptions):
+    """
+    Fits model on all its curves, then every fold of Folds(model, by)
+    warm started from that fit, in parallel over processes workers (all
+    the cpus by default). fitOptions are passed to BestFit. Returns
+    {'by', 'full': {'parameters', 'cost', 'curveCosts'}, 'folds': list
+    of the results of FitFold with their 'fold' label, 'heldOutCost':
+    the sum over the folds}
+    """
+    if initialParameterValues is None:
+        initialParameterValues = model.theory.initialParameterValues
+    full = model.BestFit(initialParameterValues, **fitOptions)
+    folds = Folds(model, by)
+    state = (model, full[0], folds, fitOptions)
+    tasks = range(len(folds))
+    if processes == 1 or len(tasks) < 2:
+        _InitWorker(state)
+        results = map(_FitFold, tasks)
+    else:
+        pool = multiprocessing.Pool(processes, _InitWorker, (state,))
+        try:
+            results = pool.map(_FitFold, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    if verbose:
+        for result in results:
+            if 'error' in result:
+                print "%-24s %s" % (result['fold'], result['error'])
+            else:
+                print "%-24s %6d points held-out cost %-12.6g " \
+                      "training cost %.6g" % (result['fold'], \
+                        result['points'], result['heldOutCost'], \
+                        result['trainingCost'])
+    fullCosts = CurveCosts(model, full[0])
+    return {'by': by, \
+            'full': {'parameters': [float(value) for value in full[0]], \
+                     'cost': float(full[2]['cost']), \
+                     'curveCosts': dict([(CurveLabel(curveId), cost) \
+                                         for curveId, cost in \
+                                         fullCosts.items()])}, \
+            'folds': results, \
+            'heldOutCost': sum([result.get('heldOutCost', 0.) \
+                                for result in results])}
+
+def main(argv):
+    parser = optparse.OptionParser(usage="python CrossValidation.py [options]")
+    parser.add_option("-m", "--module", default="A11")
+    parser.add_option("-l", "--list", \
+                      help="list of (L,k,W) in WindowScalingInfo (WS.independentValues by default)")
+    parser.add_option("-d", "--data", help="data directory (WS.dataDirectory by default)")
+    parser.add_option("-b", "--by", default="curve", help="curve or L")
+    parser.add_option("-j", "--processes", type="int")
+    parser.add_option("-o", "--output", help="write results as JSON")
+    options, args = parser.parse_args(argv)
+    import Utils
+    import Registry
+    import WindowScalingInfo as WS
+    if options.list:
+        independentNames, independentValues = Utils.get_independent( \
+            getattr(WS, options.list), sorting=WS.sortedValues)
+    else:
+        independentNames, independentValues = WS.independentNames, \
+                                               WS.independentValues
+    model = Registry.MakeModel(options.module, WS, independentValues, \
+                               independentNames, options.data)
+    start = time.time()
+    results = CrossValidate(model, by=options.by, \
+                            processes=options.processes, verbose=True)
+    print "%d folds in %.3f s, total held-out cost %g" % \
+            (len(results['folds']), time.time()-start, results['heldOutCost'])
+    if options.output:
+        outfile = open(options.output, 'w')
+        json.dump(results, outfile, indent=1, sort_keys=True)
+        outfile.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
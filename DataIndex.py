@@ -0,0 +1,93 @@
+"""
+Index of the .bnd files of a data directory, to find curves by (L,k,W)
+without building file names and trying to open them.
+
+The directory is listed once, and again only when its mtime changes;
+every file name is parsed with Utils.parse_fileName, whatever the "_k="
+or "_k" spelling. Queries are Python expressions in L, k and W, as the
+theory strings:
+    index = DataIndex.GetIndex(WS.dataDirectory)
+    index.IndependentValues('A11', "L == 1024 and W <= 128")
+    index.FileName('A11', (1024, 0.001, 16))
+"""
+
+import os
+import Utils
+
+# Indexes already built, by absolute directory name
+indexes = {}
+
+def GetIndex(directory):
+    """
+    Index of directory, shared by all the callers
+    """
+    key = os.path.abspath(directory)
+    if key not in indexes:
+        indexes[key] = DataIndex(directory)
+    return indexes[key]
+
+class DataIndex:
+    """
+    files[(name, simulType)][independent] is the file of a curve, for
+    independent = (L,k,W), or (L,k) for the files without "_W="
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.mtime = None
+        self.files = {}
+
+    def Scan(self):
+        """
+        Lists the directory again if it changed since the last scan
+        """
+        mtime = os.stat(self.directory).st_mtime
+        if mtime == self.mtime:
+            return
+        files = {}
+        for fileName in sorted(os.listdir(self.directory)):
+            parsed = Utils.parse_fileName(fileName)
+            if parsed is None:
+                continue
+            name, independent, simulType = parsed
+            curves = files.setdefault((name, simulType), {})
+            # With both spellings of k, the first file name is kept
+            if independent not in curves:
+                curves[independent] = os.path.join(self.directory, fileName)
+        self.files = files
+        self.mtime = mtime
+
+    def Names(self):
+        self.Scan()
+        return sorted(set([name for name, simulType in self.files]))
+
+    def Curves(self, name, simulType = "NonLinear"):
+        self.Scan()
+        return self.files.get((name, simulType), {})
+
+    def FileName(self, name, independent, simulType = "NonLinear"):
+        """
+        File of a curve, or None if there is none
+        """
+        return self.Curves(name, simulType).get(tuple(independent))
+
+    def IndependentValues(self, name, condition = None, \
+                          simulType = "NonLinear"):
+        """
+        Sorted (L,k,W) (or (L,k)) of the curves of name for which the
+        expression condition, in L, k and W, is true; the (L,k) curves
+        have W = None, and do not match a condition in W
+        """
+        if condition is not None:
+            code = compile(condition, "<condition>", "eval")
+            usesW = 'W' in code.co_names
+        out = []
+        for independent in self.Curves(name, simulType):
+            if condition is not None:
+                if len(independent) < 3 and usesW:
+                    continue
+                variables = dict(zip(['L', 'k', 'W'], \
+                                     tuple(independent) + (None,)))
+                if not eval(code, {}, variables):
+                    continue
+            out.append(independent)
+        return sorted(out)
@@ -0,0 +1,273 @@
+"""
+Interactive exploration of the parameter values of a Model, with one
+slider per parameter in theory.parameterNameList.
+
+Unlike Model.PlotFunctions, which clears the figure and draws everything
+again, the artists are created once: moving a slider only updates the
+data arrays of the theory lines (and, for the collapse, of the scaled
+points and error bars). Curves longer than the axes width in pixels are
+decimated once (see Utils.decimate_indices). The points, theory lines
+and error bars are merged into one artist per point type or color, and
+only those that move are 'animated': axes, ticks and legend are kept as
+a bitmap background, and only the moving artists are drawn again and
+blitted, so redraws stay fast with 100+ curves.
+
+Example:
+    explorer = Explorer.CollapseExplorer(jointModule.Models['A11'],
+                                         bestValues)
+    # ... move the sliders, then
+    explorer.parameterValues
+"""
+
+import time
+import scipy
+import Utils
+
+class CollapseExplorer:
+    """
+    Plots the collapse (or the fits, plotCollapse = False) of model with
+    sliders for its parameters. ranges is an optional dictionary
+    {parameterName: (min, max)}; by default values are varied by +/- 50%
+    """
+    def __init__(self, model, parameterValues = None, plotCollapse = True, \
+                 ranges = None, fontSizeLabels = 14, figNum = None):
+        import pylab
+        from matplotlib.widgets import Slider
+        self.model = model
+        self.theory = model.theory
+        self.data = model.data
+        self.plotCollapse = plotCollapse
+        if parameterValues is None:
+            parameterValues = self.theory.initialParameterValues
+        self.parameterValues = scipy.array(parameterValues, dtype=float)
+        self.lastUpdateTime = None
+        names = self.theory.parameterNameList
+        if ranges is None:
+            ranges = {}
+        #
+        self.figure = pylab.figure(figNum, figsize=(8, 6 + 0.3*len(names)))
+        self.figure.clf()
+        bottom = 0.06 + 0.035*len(names)
+        self.axes = self.figure.add_axes([0.12, bottom + 0.08, 0.83, \
+                                          0.88 - bottom])
+        if self.data.linlog == 'log':
+            self.axes.set_xscale('log')
+            self.axes.set_yscale('log')
+        self.sliders = []
+        for n, name in enumerate(names):
+            value = self.parameterValues[n]
+            vMin, vMax = ranges.get(name, (value - 0.5*abs(value or 1.), \
+                                           value + 0.5*abs(value or 1.)))
+            sliderAxes = self.figure.add_axes([0.2, 0.02 + 0.035*n, 0.65, 0.025])
+            slider = Slider(sliderAxes, name, vMin, vMax, valinit=value)
+            slider.on_changed(self.OnSlider)
+            self.sliders.append(slider)
+        #
+        self.curves = sorted(self.data.experiments)
+        if model.sorting:
+            self.curves = self.data.experiments
+        # Points drawn for each curve; decimation uses the unscaled
+        # curves, so it does not change with the parameters
+        nBins = int(self.axes.bbox.width)
+        self.kept = {}
+        for independentValues in self.curves:
+            errorBar = self.data.errorBar[independentValues]
+            self.kept[independentValues] = Utils.decimate_indices( \
+                self.data.X[independentValues], self.data.Y[independentValues], \
+                errorBar, errorBar, nBins, self.data.linlog)
+        # The points of each point type, and the theory lines and the
+        # error bars of each color, are drawn as a single line broken by
+        # NaNs: one artist per curve (or one path per bar) would dominate
+        # the redraw time. The legend shows empty, static proxies
+        for independentValues in self.curves:
+            label = model.getLabel(self.theory.independentNames, \
+                                   independentValues)
+            pointType = self.data.pointType[independentValues]
+            self.axes.plot([], [], linestyle='None', marker=pointType[-1], \
+                           color=pointType[:-1], label=label)
+        arrays = self.CurveArrays()
+        points, theoryLines, errorBars = self.LinesByColor(arrays)
+        self.dataLines = {}
+        for pointType, (x, y) in points.items():
+            self.dataLines[pointType], = self.axes.plot(x, y, \
+                    linestyle='None', marker=pointType[-1], \
+                    color=pointType[:-1])
+        self.theoryLines = {}
+        self.errorBars = {}
+        for color, (x, y) in theoryLines.items():
+            self.theoryLines[color], = self.axes.plot(x, y, color=color)
+        for color, (x, y) in errorBars.items():
+            self.errorBars[color], = self.axes.plot(x, y, color=color)
+        self.axes.legend(loc=(0., 0.), prop={'size': 8})
+        self.animated = self.theoryLines.values()
+        if plotCollapse:
+            self.animated += self.dataLines.values() + self.errorBars.values()
+        for artist in self.animated:
+            artist.set_animated(True)
+        self.background = None
+        self.figure.canvas.mpl_connect('draw_event', self.OnDraw)
+        if plotCollapse:
+            self.axes.set_xlabel(self.theory.scalingXTeX, fontsize=fontSizeLabels)
+            self.axes.set_ylabel(self.theory.scalingYTeX, fontsize=fontSizeLabels)
+            self.axes.set_title(self.theory.scalingTitle)
+        else:
+            self.axes.set_xlabel(self.theory.Xname, fontsize=fontSizeLabels)
+            self.axes.set_ylabel(self.theory.Yname, fontsize=fontSizeLabels)
+            self.axes.set_title(self.theory.title)
+        pylab.show()
+
+    def CurveArrays(self):
+        """
+        X, Y, lower and upper ends of the error bars, and theory of each
+        curve at the current parameter values (scaled for the collapse)
+        """
+        p = self.parameterValues
+        theory = self.theory
+        out = []
+        for independentValues in self.curves:
+            X = self.data.X[independentValues]
+            Y = self.data.Y[independentValues]
+            errorBar = self.data.errorBar[independentValues]
+            Ytheory = theory.Y(X, p, independentValues)
+            keep = self.kept[independentValues]
+            X, Y, errorBar, Ytheory = X[keep], Y[keep], errorBar[keep], Ytheory[keep]
+            if self.plotCollapse:
+                # The scaling of Y is linear: scale the three at once
+                Y, errorBar, Ytheory = theory.ScaleY(X, \
+                        scipy.array([Y, errorBar, Ytheory]), p, independentValues)
+                X = theory.ScaleX(X, p, independentValues)
+            Ydown = Y - errorBar
+            if self.data.linlog == 'log':
+                # Avoid error bars crossing zero on log-log plots
+                Ydown = scipy.where(errorBar < Y, Ydown, 0.5*Y)
+            out.append((X, Y, Ydown, Y + errorBar, Ytheory))
+        return out
+
+    def LinesByColor(self, arrays, onePerPixel = False):
+        """
+        For each point type, the x and y of all the points of that type;
+        for each color, the x and y of a line through all the theory
+        curves of that color, separated by (nan, nan), and of a line
+        through all the error bars: (x, Ydown), (x, Yup), (nan, nan), ...
+        With onePerPixel, the points and error bars drawn on the same
+        pixels as others are left out (see OnePerPixel)
+        """
+        byType = {}
+        byColor = {}
+        for independentValues, curveArrays in zip(self.curves, arrays):
+            pointType = self.data.pointType[independentValues]
+            byType.setdefault(pointType, []).append(curveArrays)
+            byColor.setdefault(pointType[:-1], []).append(curveArrays)
+        points = {}
+        for pointType, curves in byType.items():
+            x = scipy.concatenate([c[0] for c in curves])
+            y = scipy.concatenate([c[1] for c in curves])
+            if onePerPixel:
+                keep = self.OnePerPixel(x, [y])
+                x, y = x[keep], y[keep]
+            points[pointType] = x, y
+        theoryLines = {}
+        errorBars = {}
+        nan = scipy.array([scipy.nan])
+        for color, curves in byColor.items():
+            theoryLines[color] = \
+                scipy.concatenate([c for X, Y, Yd, Yu, Yt in curves \
+                                   for c in (X, nan)]), \
+                scipy.concatenate([c for X, Y, Yd, Yu, Yt in curves \
+                                   for c in (Yt, nan)])
+            X = scipy.concatenate([c[0] for c in curves])
+            Ydown = scipy.concatenate([c[2] for c in curves])
+            Yup = scipy.concatenate([c[3] for c in curves])
+            if onePerPixel:
+                keep = self.OnePerPixel(X, [Ydown, Yup])
+                X, Ydown, Yup = X[keep], Ydown[keep], Yup[keep]
+            x = scipy.empty((len(X), 3))
+            y = scipy.empty((len(X), 3))
+            x[:, 0] = x[:, 1] = X
+            y[:, 0] = Ydown
+            y[:, 1] = Yup
+            x[:, 2] = y[:, 2] = scipy.nan
+            errorBars[color] = x.ravel(), y.ravel()
+        return points, theoryLines, errorBars
+
+    def OnePerPixel(self, x, ys):
+        """
+        Indices of the points (x, y) for all y in ys falling on distinct
+        pixels of the axes, in order: on a collapse most markers and
+        error bars are drawn on top of each other, and drawing them is
+        most of the redraw time
+        """
+        transform = self.axes.transData.transform
+        pixels = [transform(scipy.transpose([x, y])) for y in ys]
+        pixels = scipy.concatenate([pixels[0]] + \
+                                   [p[:, 1:] for p in pixels[1:]], axis=1)
+        good = scipy.nonzero(scipy.isfinite(pixels).all(axis=1))[0]
+        # Up to three pixel coordinates, 21 bits each, in one key
+        pixels = scipy.clip(scipy.around(pixels[good]), -2**20, 2**20-1)
+        keys = scipy.zeros(len(good), dtype='int64')
+        for column in scipy.transpose(pixels.astype('int64') + 2**20):
+            keys = keys*2**21 + column
+        first = scipy.unique(keys, return_index=True)[1]
+        return good[scipy.sort(first)]
+
+    def OnDraw(self, event):
+        """
+        After a full draw: keep the background, then add the moving artists
+        """
+        self.background = self.figure.canvas.copy_from_bbox(self.axes.bbox)
+        for artist in self.animated:
+            self.axes.draw_artist(artist)
+
+    def SetParameters(self, parameterValues):
+        self.parameterValues = scipy.array(parameterValues, dtype=float)
+        self.Update()
+
+    def OnSlider(self, value):
+        self.parameterValues = scipy.array([s.val for s in self.sliders])
+        self.Update()
+
+    def Update(self):
+        """
+        Moves the existing artists to the current parameter values
+        """
+        start = time.time()
+        points, theoryLines, errorBars = \
+                self.LinesByColor(self.CurveArrays(), onePerPixel=True)
+        for color, (x, y) in theoryLines.items():
+            self.theoryLines[color].set_data(x, y)
+        if self.plotCollapse:
+            for pointType, (x, y) in points.items():
+                self.dataLines[pointType].set_data(x, y)
+            for color, (x, y) in errorBars.items():
+                self.errorBars[color].set_data(x, y)
+        canvas = self.figure.canvas
+        if self.background is None:
+            canvas.draw_idle()
+        else:
+            canvas.restore_region(self.background)
+            for artist in self.animated:
+                self.axes.draw_artist(artist)
+            canvas.blit(self.axes.bbox)
+        self.lastUpdateTime = time.time() - start
+
+    def Rescale(self):
+        """
+        Fits the axis limits to the current data
+        """
+        self.axes.relim()
+        self.axes.autoscale_view()
+        self.figure.canvas.draw_idle()
+
+    def SaveFigure(self, fileName):
+        """
+        Animated artists are skipped by savefig, so they are switched
+        back to normal ones while saving
+        """
+        for artist in self.animated:
+            artist.set_animated(False)
+        try:
+            self.figure.savefig(fileName)
+        finally:
+            for artist in self.animated:
+                artist.set_animated(True)
+            self.figure.canvas.draw_idle()
@@ -0,0 +1,201 @@
+"""
+Command line fits, without the interactive setup of jointModule.py:
+
+    python FitRunner.py fit --modules A11,A10 --list A11_list --hold zeta=0.85
+    python -m FitRunner fit -m A11 -l A11_W_1 -o result.json --plot plots/
+
+Only the theory modules named in --modules are imported (see
+Registry.py), and scipy, SloppyScaling and the modules are imported after
+the options are parsed, so that --help and option errors are immediate.
+The curves of --list (a list of WindowScalingInfo, see
+Utils.get_independent), or those of the files in the data directory
+matching --query (see DataIndex.py), are loaded for each module; or the
+settings are read from JSON files given with --config (see RunConfig.py),
+one fit per file. The fit results are written as JSON to --output, or to the
+standard output (the messages of the fit then go to the standard error).
+No figure is made unless --plot DIRECTORY is given (headless rendering,
+see Rendering.py).
+"""
+
+import os
+import sys
+import json
+import time
+import optparse
+
+commands = ['fit']
+
+def ParseHeld(holds):
+    """
+    ['zeta=0.85', ...] -> [('zeta', 0.85), ...]
+    """
+    heldParams = []
+    for hold in holds:
+        pName, pValue = hold.split("=")
+        heldParams.append((pName.strip(), float(pValue)))
+    return heldParams
+
+def LoadModel(moduleName, config, independentNames, independentValues, \
+              dataDirectory):
+    """
+    Model of moduleName with the curves of independentValues;
+    returns the model and the list of missing files
+    """
+    import SloppyScaling
+    import Registry
+    theory = Registry.MakeTheory(moduleName, config)
+    theory.independentNames = independentNames
+    data, missing = Registry.LoadData(moduleName, config, independentValues, \
+                                      dataDirectory)
+    fileName = Registry.GetEntry(moduleName)[1]
+    return SloppyScaling.Model(theory, data, fileName, config.sortedValues), \
+           missing
+
+def RunFit(moduleNames, config, independentNames, independentValues, \
+           dataDirectory, heldParams = None, plotDirectory = None):
+    """
+    Loads the models, fits them jointly (a CompositeModel if more than one)
+    and returns a dictionary of results
+    """
+    import SloppyScaling
+    start = time.time()
+    models = []
+    missing = []
+    for moduleName in moduleNames:
+        model, missingFiles = LoadModel(moduleName, config, independentNames, \
+                                        independentValues, dataDirectory)
+        models.append(model)
+        missing += missingFiles
+    if len(models) == 1:
+        fitModel = models[0]
+        fitModel.theory.HoldFixedParams(heldParams)
+    else:
+        fitModel = SloppyScaling.CompositeModel("".join(moduleNames))
+        for moduleName, model in zip(moduleNames, models):
+            fitModel.InstallModel(moduleName, model)
+        fitModel.HoldFixedParams(heldParams)
+    loadTime = time.time() - start
+    start = time.time()
+    out = fitModel.BestFit(fitModel.theory.initialParameterValues)
+    fitTime = time.time() - start
+    values, covariance = out[0], out[1]
+    parameters = {}
+    for n, name in enumerate(fitModel.theory.parameterNameList):
+        error = None
+        if covariance is not None and covariance[n, n] > 0:
+            error = float(covariance[n, n]**0.5)
+        parameters[name] = {'value': float(values[n]), 'error': error}
+    cost = float(out[2]['cost'])
+    results = {'modules': moduleNames, 'name': fitModel.name, \
+               'held': dict(heldParams or []), 'parameters': parameters, \
+               'cost': cost, 'R_square': 1. - cost/fitModel.SST(values), \
+               'nfev': out[2]['nfev'], 'message': out[3], 'ier': out[4], \
+               'curves': dict([(model.name, len(model.data.experiments)) \
+                               for model in models]), \
+               'missing': missing, \
+               'seconds': {'load': loadTime, 'fit': fitTime}}
+    if plotDirectory is not None:
+        import Rendering
+        results['figures'] = Rendering.RenderModels( \
+            [(model, values, None) for model in models], plotDirectory)
+    return results
+
+def RunConfigFit(config, options, heldParams, independentNames, \
+                 independentValues, plotDirectory):
+    """
+    RunFit for a config (WindowScalingInfo or a RunConfig), with the
+    command line options taking precedence
+    """
+    moduleNames = options.modules and options.modules.split(",") or \
+                  config.moduleNames
+    dataDirectory = options.data or config.dataDirectory
+    if dataDirectory and not dataDirectory.endswith(os.sep):
+        dataDirectory = dataDirectory + os.sep
+    if options.k_string:
+        import RunConfig
+        config = RunConfig.Override(config, k_string=options.k_string)
+    # The last value given for a parameter wins
+    heldParams = dict(heldParams).items()
+    return RunFit(moduleNames, config, independentNames, independentValues, \
+                  dataDirectory, heldParams, plotDirectory)
+
+def main(argv):
+    parser = optparse.OptionParser( \
+        usage="python FitRunner.py fit [options]")
+    parser.add_option("-m", "--modules", \
+                      help="comma separated, e.g. A11,A10 (WS.moduleNames by default)")
+    parser.add_option("-l", "--list", \
+                      help="list of (L,k,W) in WindowScalingInfo (WS.independentValues by default)")
+    parser.add_option("-c", "--config", action="append", default=[], \
+                      help="JSON run configuration (repeatable, see RunConfig.py)")
+    parser.add_option("-q", "--query", \
+                      help='curves of the data directory, e.g. "L == 1024 and W <= 128"')
+    parser.add_option("--hold", action="append", default=[], \
+                      help="name=value of a held parameter (repeatable)")
+    parser.add_option("-d", "--data", help="data directory (WS.dataDirectory by default)")
+    parser.add_option("-k", "--k-string", dest="k_string", \
+                      help='"_k=" or "_k" in the file names (WS.k_string by default)')
+    parser.add_option("-o", "--output", help="JSON file (standard output by default)")
+    parser.add_option("-p", "--plot", help="render the figures in this directory")
+    options, args = parser.parse_args(argv)
+    if not args or args[0] not in commands:
+        parser.error("the command must be one of: " + ", ".join(commands))
+    heldParams = ParseHeld(options.hold)
+    stdout = sys.stdout
+    if not options.output:
+        # Keep the standard output for the JSON results
+        sys.stdout = sys.stderr
+    try:
+        if options.config:
+            import RunConfig
+            results = []
+            for fileName in options.config:
+                config = RunConfig.Load(fileName)
+                plotDirectory = options.plot
+                if plotDirectory and len(options.config) > 1:
+                    plotDirectory = os.path.join(plotDirectory, config.name)
+                result = RunConfigFit(config, options, \
+                                      config.heldParams + heldParams, \
+                                      config.independentNames, \
+                                      config.independentValues, plotDirectory)
+                result['config'] = fileName
+                results.append(result)
+            if len(results) == 1:
+                results = results[0]
+        else:
+            import Utils
+            import WindowScalingInfo as WS
+            if options.query:
+                import DataIndex
+                import Registry
+                moduleNames = options.modules and \
+                              options.modules.split(",") or WS.moduleNames
+                index = DataIndex.GetIndex(options.data or WS.dataDirectory)
+                independentValues = index.IndependentValues( \
+                    Registry.GetEntry(moduleNames[0])[1], options.query, \
+                    WS.simulType)
+                independentNames = "L, k, W"
+                if independentValues and len(independentValues[0]) == 2:
+                    independentNames = "L, k"
+            elif options.list:
+                independentNames, independentValues = Utils.get_independent( \
+                    getattr(WS, options.list), sorting=WS.sortedValues)
+            else:
+                independentNames = WS.independentNames
+                independentValues = WS.independentValues
+            results = RunConfigFit(WS, options, heldParams, independentNames, \
+                                   independentValues, options.plot)
+            results['list'] = options.list or options.query
+    finally:
+        sys.stdout = stdout
+    if options.output:
+        outfile = open(options.output, 'w')
+        json.dump(results, outfile, indent=1, sort_keys=True)
+        outfile.close()
+    else:
+        json.dump(results, sys.stdout, indent=1, sort_keys=True)
+        print
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
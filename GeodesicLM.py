@@ -0,0 +1,216 @@
+"""
+Geodesic-accelerated Levenberg-Marquardt (Transtrum and Sethna), for
+the sloppy fits where the plain LM of leastsq crawls along narrow curved
+valleys of the cost.
+
+Each step adds to the LM velocity v = -(J^T J + lambda D)^-1 J^T r
+half the geodesic acceleration a = -(J^T J + lambda D)^-1 J^T r_vv,
+where r_vv, the second directional derivative of the residuals along
+v, costs one residual evaluation:
+    r_vv = 2/h ((r(p + h v) - r(p))/h - J v).
+Steps whose acceleration is large compared to the velocity
+(2|a|/|v| > alpha) are rejected. The damping is "delayed
+gratification": divided by lambdaDown after an accepted step,
+multiplied by the smaller lambdaUp after a rejected one, and D is the
+largest diagonal of J^T J seen so far.
+
+The Jacobian comes from a pluggable source: FiniteDifferenceJacobian
+(the default, all the shifted parameter vectors in one batch
+evaluation), AnalyticJacobian(function of p), or BroydenJacobian
+(rank-one updates after the accepted steps, recomputed by finite
+differences every refresh steps). From the models:
+    out = model.BestFit(method='geodesic')
+    out = joint.BestFit(method='geodesic', jacobian='broyden')
+"""
+
+import scipy
+import scipy.linalg
+
+class FiniteDifferenceJacobian:
+    """
+    Forward differences with the relative steps of leastsq, backward
+    where a forward step would cross upper; with batch, residual takes
+    the (n, n_params) array of the shifted vectors (as Model.Residual
+    does) and returns the residuals as rows
+    """
+    def __init__(self, residual, relativeStep = 1.49012e-08, batch = True, \
+                 upper = None):
+        self.residual = residual
+        self.relativeStep = relativeStep
+        self.batch = batch
+        self.upper = upper
+        self.nfev = 0
+        self.njev = 0
+
+    def Jacobian(self, p, r):
+        steps = self.relativeStep*abs(p)
+        steps[steps == 0] = self.relativeStep
+        if self.upper is not None:
+            steps = scipy.where(p + steps > self.upper, -steps, steps)
+        shifted = p + scipy.diag(steps)
+        if self.batch:
+            rows = self.residual(shifted)
+        else:
+            rows = scipy.array([self.residual(q) for q in shifted])
+        self.nfev += len(p)
+        self.njev += 1
+        return scipy.transpose((rows - r)/steps[:, scipy.newaxis])
+
+    def Update(self, J, p, r, dp, dr):
+        """
+        Jacobian at p after the accepted step dp (dr the change of r)
+        """
+        return self.Jacobian(p, r)
+
+class AnalyticJacobian(FiniteDifferenceJacobian):
+    """
+    Jacobian given by function(p), an (n_residuals, n_params) array
+    """
+    def __init__(self, function):
+        self.function = function
+        self.nfev = 0
+        self.njev = 0
+
+    def Jacobian(self, p, r):
+        self.njev += 1
+        return scipy.asarray(self.function(p), dtype=float)
+
+class BroydenJacobian(FiniteDifferenceJacobian):
+    """
+    Finite differences at the start and every refresh accepted steps,
+    Broyden rank-one updates in between
+    """
+    def __init__(self, residual, refresh = 10, relativeStep = 1.49012e-08, \
+                 batch = True, upper = None):
+        FiniteDifferenceJacobian.__init__(self, residual, relativeStep, batch, \
+                                          upper)
+        self.refresh = refresh
+        self.updates = 0
+
+    def Update(self, J, p, r, dp, dr):
+        self.updates += 1
+        if self.updates % self.refresh == 0:
+            return self.Jacobian(p, r)
+        return J + scipy.outer(dr - scipy.dot(J, dp), dp)/scipy.dot(dp, dp)
+
+def MakeJacobian(jacobian, residual, batch = True, upper = None):
+    """
+    A Jacobian source for 'fd', 'broyden' (their steps kept below
+    upper), a function of p (analytic), or an object with Jacobian and
+    Update methods
+    """
+    if jacobian in (None, 'fd'):
+        return FiniteDifferenceJacobian(residual, batch=batch, upper=upper)
+    if jacobian == 'broyden':
+        return BroydenJacobian(residual, batch=batch, upper=upper)
+    if hasattr(jacobian, 'Jacobian'):
+        return jacobian
+    if callable(jacobian):
+        return AnalyticJacobian(jacobian)
+    raise ValueError("unknown Jacobian source %r" % (jacobian,))
+
+def Cost(r):
+    cost = scipy.dot(r, r)
+    if not scipy.isfinite(cost):
+        return scipy.inf
+    return cost
+
+def GeodesicFit(residual, initialParameterValues, jacobian = 'fd', \
+                batch = True, acceleration = True, h = 0.1, alpha = 0.75, \
+                damping = 1.e-3, lambdaUp = 2., lambdaDown = 3., \
+                minDamping = 1.e-10, maxIterations = 500, ftol = 1.e-12, \
+                xtol = 1.e-12, gtol = 0., lower = None, upper = None):
+    """
+    Minimizes the sum of the squares of residual(p); without
+    acceleration, the same delayed gratification LM. With bounds (lower
+    and upper arrays, or None), the steps are projected on them, the
+    parameters held on a bound by the gradient are left out of the step,
+    and the finite differences step backward where a forward step would
+    cross upper. Returns a tuple as
+    leastsq with full_output: (p, covariance, infodict, message, ier),
+    infodict with 'nfev', 'njev', 'fvec', 'cost', 'iterations' and
+    'accepted'
+    """
+    source = MakeJacobian(jacobian, residual, batch, upper)
+    p = scipy.array(initialParameterValues, dtype=float)
+    if lower is None:
+        lower = -scipy.inf*scipy.ones(len(p))
+    if upper is None:
+        upper = scipy.inf*scipy.ones(len(p))
+    r = residual(p)
+    cost = Cost(r)
+    nfev = 1
+    J = source.Jacobian(p, r)
+    scale = scipy.zeros(len(p))
+    accepted = 0
+    message, ier = "Maximum number of iterations reached", 5
+    for iteration in range(maxIterations):
+        JtJ = scipy.dot(scipy.transpose(J), J)
+        gradient = scipy.dot(scipy.transpose(J), r)
+        if max(abs(gradient)) <= gtol:
+            message, ier = "Gradient below gtol", 4
+            break
+        scale = scipy.maximum(scale, scipy.diag(JtJ))
+        A = JtJ + damping*scipy.diag(scipy.where(scale > 0, scale, 1.))
+        # Parameters on a bound that the descent would cross: fixed
+        active = ((p >= upper) & (gradient < 0)) | \
+                 ((p <= lower) & (gradient > 0))
+        if active.any():
+            A[active, :] = 0.
+            A[:, active] = 0.
+            A[active, active] = 1.
+            gradient = scipy.where(active, 0., gradient)
+        # dp is None when the step is rejected before it is tried: the
+        # solve failed, rv is not finite or the acceleration is too large
+        try:
+            dp = scipy.linalg.solve(A, -gradient)
+        except (scipy.linalg.LinAlgError, ValueError):
+            dp = None
+        if dp is not None and acceleration:
+            v = dp
+            rv = residual(p + h*v)
+            nfev += 1
+            dp = None
+            if scipy.isfinite(rv).all():
+                rvv = 2./h*((rv - r)/h - scipy.dot(J, v))
+                try:
+                    a = scipy.linalg.solve(A, scipy.where(active, 0., \
+                                -scipy.dot(scipy.transpose(J), rvv)))
+                except (scipy.linalg.LinAlgError, ValueError):
+                    a = None
+                if a is not None and 2.*scipy.sqrt(scipy.dot(a, a)) <= \
+                        alpha*scipy.sqrt(scipy.dot(v, v)):
+                    dp = v + 0.5*a
+        newCost = scipy.inf
+        if dp is not None:
+            dp = scipy.clip(p + dp, lower, upper) - p
+            newR = residual(p + dp)
+            nfev += 1
+            newCost = Cost(newR)
+        if newCost < cost:
+            decrease = cost - newCost
+            p = p + dp
+            J = source.Update(J, p, newR, dp, newR - r)
+            r, cost = newR, newCost
+            accepted += 1
+            damping = max(damping/lambdaDown, minDamping)
+            if decrease <= ftol*cost:
+                message, ier = "Relative decrease of the cost below ftol", 1
+                break
+            if scipy.sqrt(scipy.dot(dp, dp)) <= \
+                    xtol*(scipy.sqrt(scipy.dot(p, p)) + xtol):
+                message, ier = "Relative step below xtol", 2
+                break
+        else:
+            damping *= lambdaUp
+            if damping > 1.e16:
+                message, ier = "No step decreases the cost", 3
+                break
+    try:
+        covariance = scipy.linalg.inv(scipy.dot(scipy.transpose(J), J))
+    except scipy.linalg.LinAlgError:
+        covariance = None
+    return p, covariance, {'nfev': nfev + source.nfev, 'njev': source.njev, \
+                           'fvec': r, 'cost': cost, \
+                           'iterations': iteration + 1, \
+                           'accepted': accepted}, message, ier
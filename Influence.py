@@ -0,0 +1,211 @@
+"""
+Influence of each curve on a fit, without refitting: which (L,k,W)
+curve drives tau or zeta?
+
+At the parameters p of a fit, the Jacobian is computed curve by curve
+(one batch evaluation of the n+1 forward difference vectors, see
+Model.CurveResiduals). With J_c and r_c the block of the curve c,
+removing it downdates the normal equations:
+    J^T J -> J^T J - J_c^T J_c,    J^T r -> J^T r - J_c^T r_c.
+J_c^T J_c = B^T B, B the R factor of J_c (rank k <= n), and the
+covariance without the curve follows from C = (J^T J)^-1 by the
+Woodbury identity,
+    C_c = C + C B^T (I - B C B^T)^-1 B C,
+a k by k solve per curve. The Gauss-Newton step without the curve,
+-C_c (J^T r - J_c^T r_c), approximates the shift of the parameters a
+refit without it would make (see CrossValidation.py for the refits).
+
+The fits are sloppy: J^T J often has directions (eigenvalues below
+rcond times the largest, with the parameters scaled to unit columns)
+that the data do not determine at all, e.g. combinations of tau,
+sigma_k and zeta on curves of a single k. The analysis is done in the
+subspace of the other eigenvectors, where the downdate is exact; the
+steps and covariances have no component along the dropped directions.
+
+    influence = Influence.Influence(model, out[0])
+    for curve in Influence.Rank(influence, 'zeta')[:5]:
+        print curve['curve'], curve['shift'], curve['sigmaRatio']
+    python Influence.py -m A11 -l A11_list -r zeta
+"""
+
+import sys
+import time
+import optparse
+import scipy
+import scipy.linalg
+import CrossValidation
+
+def CurveJacobians(model, parameterValues, relativeStep = 1.49012e-08):
+    """
+    List of (curve id, r_c, J_c) at parameterValues for every curve of a
+    Model or CompositeModel (see CrossValidation.CurveIds); the Jacobian
+    is a forward difference with the relative steps of leastsq
+    """
+    p = scipy.asarray(parameterValues, dtype=float)
+    steps = relativeStep*abs(p)
+    steps[steps == 0] = relativeStep
+    parameterArray = scipy.concatenate(([p], p + scipy.diag(steps)))
+    models = CrossValidation.SubModels(model)
+    blocks = []
+    for name in sorted(models):
+        for independent, res in models[name].CurveResiduals(parameterArray):
+            r = res[0]
+            J = scipy.transpose((res[1:] - r)/steps[:, scipy.newaxis])
+            blocks.append(((name, independent), r, J))
+    return blocks
+
+def Downdate(covariance, J):
+    """
+    (J^T J - J_c^T J_c)^-1 for covariance = (J^T J)^-1 and the block
+    J = J_c of a curve, or None if the parameters are not determined
+    without the curve
+    """
+    if J.shape[0] > J.shape[1]:
+        B = scipy.linalg.qr(J, mode='economic')[1]
+    else:
+        B = J
+    CB = scipy.dot(covariance, scipy.transpose(B))
+    S = scipy.eye(len(B)) - scipy.dot(B, CB)
+    try:
+        downdated = covariance + \
+                    scipy.dot(CB, scipy.linalg.solve(S, scipy.transpose(CB)))
+    except (scipy.linalg.LinAlgError, ValueError):
+        return None
+    if not scipy.isfinite(downdated).all() or \
+            (scipy.diag(downdated) <= 0).any():
+        return None
+    return downdated
+
+def Influence(model, parameterValues = None, relativeStep = 1.49012e-08, \
+              rcond = 1.e-10):
+    """
+    Closed form leave-one-curve-out analysis at parameterValues (the
+    last BestFit of model by default). Returns a dictionary with
+    'parameterNames', 'parameters', 'covariance', 'cost', 'variance'
+    (residual variance s^2 = cost/(N-n), N points and n parameters),
+    'rank' (number of directions kept), 'seconds' and 'curves', a list
+    in the order of the curves of dictionaries with:
+        'curve'         label of the curve, 'id' (model name, independent)
+        'points', 'cost'  its number of points and cost
+        'step'          change of the Gauss-Newton step without it
+        'shift'         the same in standard deviations of the fit
+        'cook'          Cook's distance, step^T J^T J step / (n s^2)
+        'covariance'    covariance without it (None if singular)
+        'sigmaRatio'    ratio of the standard deviations without and
+                        with it (inf if singular)
+        'heldOutCost'   linearized cost of the curve after the step
+    """
+    if parameterValues is None:
+        if model.lastFit is not None:
+            parameterValues = model.lastFit[1]
+        else:
+            parameterValues = model.theory.initialParameterValues
+    start = time.time()
+    p = scipy.array(parameterValues, dtype=float)
+    n = len(p)
+    blocks = CurveJacobians(model, p, relativeStep)
+    JtJ = scipy.zeros((n, n))
+    Jtr = scipy.zeros(n)
+    cost = 0.
+    nPoints = 0
+    for curveId, r, J in blocks:
+        JtJ += scipy.dot(scipy.transpose(J), J)
+        Jtr += scipy.dot(scipy.transpose(J), r)
+        cost += scipy.dot(r, r)
+        nPoints += len(r)
+    variance = cost/max(nPoints - n, 1)
+    # Eigenvectors of the scaled J^T J kept, as the columns of U: the
+    # parameters are p + U/scale q, q the coordinates in the subspace
+    scale = scipy.sqrt(scipy.diag(JtJ))
+    scale[scale == 0] = 1.
+    eigenvalues, eigenvectors = scipy.linalg.eigh(JtJ/scipy.outer(scale, scale))
+    kept = eigenvalues > rcond*max(eigenvalues.max(), 0.)
+    U = eigenvectors[:, kept]/scale[:, scipy.newaxis]
+    toParameters = lambda C: scipy.dot(U, scipy.dot(C, scipy.transpose(U)))
+    subspaceCovariance = scipy.diag(1./eigenvalues[kept])
+    Utr = scipy.dot(scipy.transpose(U), Jtr)
+    covariance = toParameters(subspaceCovariance)
+    step = -scipy.dot(covariance, Jtr)
+    sigma = scipy.sqrt(scipy.diag(covariance))
+    sigma[sigma == 0] = scipy.inf
+    curves = []
+    for curveId, r, J in blocks:
+        JU = scipy.dot(J, U)
+        downdated = Downdate(subspaceCovariance, JU)
+        if downdated is not None:
+            stepWithout = -scipy.dot(U, scipy.dot(downdated, \
+                            Utr - scipy.dot(scipy.transpose(JU), r)))
+            downdated = toParameters(downdated)
+        curve = {'curve': CrossValidation.CurveLabel(curveId), \
+                 'id': curveId, 'points': len(r), \
+                 'cost': float(scipy.dot(r, r)), 'covariance': downdated}
+        if downdated is None:
+            nan = scipy.nan*scipy.ones(n)
+            curve.update({'step': nan, 'shift': nan, 'cook': scipy.inf, \
+                          'sigmaRatio': scipy.inf*scipy.ones(n), \
+                          'heldOutCost': scipy.nan})
+        else:
+            change = stepWithout - step
+            heldOut = r + scipy.dot(J, stepWithout)
+            curve.update({'step': change, 'shift': change/sigma, \
+                          'cook': float(scipy.dot(change, scipy.dot(JtJ, \
+                                                  change))/(n*variance)), \
+                          'sigmaRatio': scipy.sqrt(scipy.diag(downdated))/sigma, \
+                          'heldOutCost': float(scipy.dot(heldOut, heldOut))})
+        curves.append(curve)
+    return {'parameterNames': list(model.theory.parameterNameList), \
+            'parameters': p, 'covariance': covariance, 'cost': cost, \
+            'variance': variance, 'rank': int(kept.sum()), \
+            'seconds': time.time() - start, 'curves': curves}
+
+def Rank(influence, by = 'cook'):
+    """
+    Curves of an Influence result, the most influential first: by
+    Cook's distance, or by the shift (in standard deviations) of the
+    parameter named by
+    """
+    if by == 'cook':
+        key = lambda curve: curve['cook']
+    else:
+        if by not in influence['parameterNames']:
+            raise ValueError("unknown parameter %s (one of %s)" % \
+                             (by, ", ".join(influence['parameterNames'])))
+        n = influence['parameterNames'].index(by)
+        key = lambda curve: scipy.isnan(curve['shift'][n]) and scipy.inf \
+                            or abs(curve['shift'][n])
+    return sorted(influence['curves'], key=key, reverse=True)
+
+def main(argv):
+    parser = optparse.OptionParser(usage="python Influence.py [options]")
+    parser.add_option("-m", "--module", default="A11")
+    parser.add_option("-l", "--list", \
+                      help="list of (L,k,W) in WindowScalingInfo (WS.independentValues by default)")
+    parser.add_option("-d", "--data", help="data directory (WS.dataDirectory by default)")
+    parser.add_option("-r", "--rank", default="cook", \
+                      help="cook or a parameter name")
+    parser.add_option("-n", "--number", type="int", default=10, \
+                      help="number of curves shown")
+    options, args = parser.parse_args(argv)
+    import Utils
+    import Registry
+    import WindowScalingInfo as WS
+    if options.list:
+        independentNames, independentValues = Utils.get_independent( \
+            getattr(WS, options.list), sorting=WS.sortedValues)
+    else:
+        independentNames, independentValues = WS.independentNames, \
+                                               WS.independentValues
+    model = Registry.MakeModel(options.module, WS, independentValues, \
+                               independentNames, options.data)
+    model.BestFit()
+    influence = Influence(model)
+    print "%d curves in %.3f s; shifts in sigma of %s" % \
+            (len(influence['curves']), influence['seconds'], \
+             ", ".join(influence['parameterNames']))
+    for curve in Rank(influence, options.rank)[:options.number]:
+        print "%-28s cook %-10.4g %s" % (curve['curve'], curve['cook'], \
+                " ".join(["%+7.3f" % shift for shift in curve['shift']]))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
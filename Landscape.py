@@ -0,0 +1,241 @@
+"""
+Cost landscapes over pairs of parameters, e.g. (tau, zeta) or
+(sigma_k, zeta), to judge how sloppy a fit is.
+
+The grid is anchored at zero: the points along x are i*dx for integer i,
+and tiles of tileSize x tileSize points are stored on disk as they are
+computed. Zooming into (or extending) a grid with the same spacing only
+computes the tiles which are not in the cache yet, and an interrupted run
+resumes where it stopped.
+
+Example:
+    land = Landscape.CostLandscape(jointModule, 'tau', 'zeta', bestValues)
+    x, y, cost = land.Evaluate((1.1, 1.4), (0.6, 1.0), 0.005, 0.005)
+    land.PlotContours(x, y, cost)
+"""
+
+import os
+import hashlib
+import multiprocessing
+import scipy
+import scipy.optimize
+import Optimizers
+
+# Model used by the worker processes; set once by _InitWorker
+_workerLandscape = None
+
+def _InitWorker(landscape):
+    global _workerLandscape
+    _workerLandscape = landscape
+
+def _ComputeTile(tile):
+    return tile, _workerLandscape.ComputeTile(tile)
+
+
+class CostLandscape:
+    """
+    Evaluates the Cost of a Model (or CompositeModel) on a 2D grid of
+    the parameters xName and yName. The other parameters are either held
+    at parameterValues (mode = 'slice') or re-minimized at each grid point
+    (mode = 'profile'), starting from the optimum of the neighbouring point.
+    """
+    def __init__(self, model, xName, yName, parameterValues=None, \
+                 mode = 'slice', tileSize = 16, \
+                 cacheDirectory = 'landscape_cache', processes = None):
+        if mode not in ('slice', 'profile'):
+            raise ValueError("mode must be 'slice' or 'profile'")
+        self.model = model
+        self.parameterNameList = list(model.theory.parameterNameList)
+        if parameterValues is None:
+            parameterValues = model.theory.initialParameterValues
+        self.parameterValues = scipy.array(parameterValues, dtype=float)
+        self.xName = xName
+        self.yName = yName
+        self.xIndex = self.parameterNameList.index(xName)
+        self.yIndex = self.parameterNameList.index(yName)
+        self.mode = mode
+        self.tileSize = tileSize
+        self.cacheDirectory = cacheDirectory
+        self.processes = processes
+        self.dx = None
+        self.dy = None
+        # (data, independent) -> (revision, hash of the curve arrays)
+        self.curveHashes = {}
+
+    def CurveHash(self, data, independent):
+        """
+        md5 of the X, Y and errorBar arrays of a curve, kept until the
+        curve is installed again
+        """
+        revision = data.revision.get(independent)
+        cached = self.curveHashes.get((data, independent))
+        if cached is not None and cached[0] == revision:
+            return cached[1]
+        md5 = hashlib.md5()
+        for curves in [data.X, data.Y, data.errorBar]:
+            md5.update(scipy.ascontiguousarray(curves[independent], \
+                                               dtype=float).tostring())
+        self.curveHashes[(data, independent)] = (revision, md5.hexdigest())
+        return md5.hexdigest()
+
+    def Key(self):
+        """
+        Identifies the tiles of this landscape in the cache: model,
+        theories, data (contents of the curves and initialSkip), residual
+        mode, parameter values, spacing and mode
+        """
+        models = getattr(self.model, 'Models', {self.model.name: self.model})
+        description = [self.model.name, self.mode, self.tileSize, \
+                       repr(self.dx), repr(self.dy), self.xName, self.yName, \
+                       self.parameterNameList, \
+                       [repr(v) for v in self.parameterValues]]
+        for name in sorted(models):
+            theory = models[name].theory
+            data = models[name].data
+            description.append((name, theory.Ytheory, theory.normalization, \
+                                getattr(theory, 'heldParameterList', None), \
+                                theory.logSpace, models[name].residualMode, \
+                                [(independent, \
+                                  self.CurveHash(data, independent), \
+                                  data.initialSkip[independent]) \
+                                 for independent in sorted(data.experiments)]))
+        return hashlib.md5(repr(description)).hexdigest()
+
+    def TileFileName(self, tile):
+        return os.path.join(self.cacheDirectory, self.Key(), \
+                            "tile_%d_%d.npz" % tile)
+
+    def TileIndices(self, tile):
+        """
+        Integer grid indices (along x and y) covered by a tile
+        """
+        ti, tj = tile
+        i = scipy.arange(ti*self.tileSize, (ti+1)*self.tileSize)
+        j = scipy.arange(tj*self.tileSize, (tj+1)*self.tileSize)
+        return i, j
+
+    def ComputeTile(self, tile):
+        """
+        Returns the (tileSize, tileSize) cost array of a tile, rows along y,
+        and the parameter vectors where it was evaluated
+        """
+        i, j = self.TileIndices(tile)
+        xs, ys = i*self.dx, j*self.dy
+        nPoints = len(xs)*len(ys)
+        parameters = scipy.resize(self.parameterValues, \
+                                  (nPoints, len(self.parameterValues)))
+        gridX, gridY = scipy.meshgrid(xs, ys)
+        if self.mode == 'slice':
+            parameters[:, self.xIndex] = gridX.ravel()
+            parameters[:, self.yIndex] = gridY.ravel()
+            cost = self.model.Cost(parameters)
+        else:
+            cost = scipy.zeros(nPoints)
+            free = [n for n in range(len(self.parameterValues)) \
+                    if n not in (self.xIndex, self.yIndex)]
+            start = self.parameterValues[free]
+            # Serpentine path, so each point starts from a neighbour
+            for row in range(len(ys)):
+                columns = range(len(xs))
+                if row % 2:
+                    columns.reverse()
+                for column in columns:
+                    n = row*len(xs) + column
+                    parameters[n, self.xIndex] = xs[column]
+                    parameters[n, self.yIndex] = ys[row]
+                    start, cost[n] = self.Profile(parameters[n], free, start)
+                    parameters[n, free] = start
+        return cost.reshape(gridX.shape), \
+               parameters.reshape(gridX.shape + (-1,))
+
+    def Profile(self, parameterValues, free, start):
+        """
+        Minimizes the cost over the free parameters with the pair held,
+        within the bounds of the theory and guarded (see Optimizers.py);
+        the cost is nan where the pair is out of bounds or the theory
+        not finite
+        """
+        full = scipy.array(parameterValues, dtype=float)
+        lower, upper = Optimizers.Bounds(self.model)
+        objective = Optimizers.Objective(self.model, None, lower, upper)
+        def residual(values):
+            full[free] = values
+            return objective(full)
+        saved = Optimizers.SetGuarded(self.model)
+        try:
+            values = scipy.optimize.leastsq(residual, \
+                        Optimizers.Inside(start, lower[free], upper[free]), \
+                        ftol=1.e-10)[0]
+        except ValueError:
+            full[free] = start
+            return start, scipy.nan
+        finally:
+            Optimizers.RestoreGuarded(saved)
+        values = scipy.atleast_1d(values)
+        full[free] = values
+        return values, self.model.Cost(full)
+
+    def Evaluate(self, xRange, yRange, dx, dy):
+        """
+        Cost on the grid points i*dx, j*dy lying inside xRange and yRange.
+        Returns x, y and cost[len(y), len(x)] (as for pylab.contour)
+        Missing tiles are computed, in parallel if processes != 1
+        """
+        self.dx, self.dy = float(dx), float(dy)
+        iMin, iMax = int(scipy.ceil(xRange[0]/dx)), int(scipy.floor(xRange[1]/dx))
+        jMin, jMax = int(scipy.ceil(yRange[0]/dy)), int(scipy.floor(yRange[1]/dy))
+        tiles = [(ti, tj) \
+                 for tj in range(jMin//self.tileSize, jMax//self.tileSize+1) \
+                 for ti in range(iMin//self.tileSize, iMax//self.tileSize+1)]
+        missing = [tile for tile in tiles \
+                   if not os.path.exists(self.TileFileName(tile))]
+        if missing:
+            directory = os.path.dirname(self.TileFileName(missing[0]))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            print "Computing %d/%d tiles" % (len(missing), len(tiles))
+            if self.processes == 1 or len(missing) == 1:
+                for tile in missing:
+                    self.SaveTile(tile, self.ComputeTile(tile))
+            else:
+                pool = multiprocessing.Pool(self.processes, _InitWorker, (self,))
+                try:
+                    for tile, result in \
+                            pool.imap_unordered(_ComputeTile, missing):
+                        self.SaveTile(tile, result)
+                finally:
+                    pool.close()
+                    pool.join()
+        x = scipy.arange(iMin, iMax+1)*self.dx
+        y = scipy.arange(jMin, jMax+1)*self.dy
+        cost = scipy.zeros((len(y), len(x)))
+        for tile in tiles:
+            tileCost = scipy.load(self.TileFileName(tile))['cost']
+            i, j = self.TileIndices(tile)
+            iIn = (i >= iMin) & (i <= iMax)
+            jIn = (j >= jMin) & (j <= jMax)
+            cost[scipy.ix_(j[jIn]-jMin, i[iIn]-iMin)] = \
+                    tileCost[scipy.ix_(jIn, iIn)]
+        return x, y, cost
+
+    def SaveTile(self, tile, result):
+        """
+        Written to a temporary file first, so an interrupted run never
+        leaves a truncated tile in the cache
+        """
+        cost, parameters = result
+        fileName = self.TileFileName(tile)
+        tmpName = fileName + ".%d.tmp.npz" % os.getpid()
+        scipy.savez(tmpName, cost=cost, parameters=parameters)
+        os.rename(tmpName, fileName)
+
+    def PlotContours(self, x, y, cost, levels = 20, fontSizeLabels = 18):
+        """
+        Contours of log10(cost - min(cost) + 1)
+        """
+        import pylab
+        pylab.contour(x, y, scipy.log10(cost - cost.min() + 1.), levels)
+        pylab.xlabel(self.xName, fontsize=fontSizeLabels)
+        pylab.ylabel(self.yName, fontsize=fontSizeLabels)
+        pylab.title("Cost landscape (%s)" % self.mode)
+        pylab.show()
@@ -0,0 +1,225 @@
+"""
+Coarse-to-fine fits: most of the iterations of a fit from the initial
+values are spent far from the optimum, where the full resolution of the
+curves is not needed. The model is first fitted on coarse copies of its
+curves (every factor-th point, or factor points rebinned into one), then
+on finer ones, each fit starting from the previous one, and last on the
+full data with BestFit.
+
+Decimated curves keep every factor-th point; rebinned curves average
+factor consecutive bins, weighted by the bin widths (X for the
+log-binned curves). In both, each coarse point stands for factor
+points: its error bar is that of the points (their rms, weighted as in
+the mean, when rebinned) divided by sqrt(factor), so that the coarse
+cost keeps the scale of the full one, whatever the mode, and the
+coarse tolerances stop at the same places. Curves are never made
+shorter than minPoints points.
+
+    out = model.MultiresolutionFit(factors=(8, 4, 2))
+    print out[2]['levels']
+    python Multiresolution.py -l A11_W_1 -l A11_list -o times.json
+compares with the direct fit on the A11 lists of WindowScalingInfo.
+"""
+
+import sys
+import json
+import time
+import optparse
+import scipy
+
+def CoarseCurve(X, Y, errorBar, factor, rebin = False, minPoints = 5):
+    """
+    X, Y, errorBar of a curve at 1/factor of its resolution
+    """
+    factor = min(factor, max(1, len(X)//minPoints))
+    if factor <= 1:
+        return X, Y, errorBar
+    if not rebin:
+        return X[::factor], Y[::factor], errorBar[::factor]/scipy.sqrt(factor)
+    n = (len(X)//factor)*factor
+    shape = (n//factor, factor)
+    X, Y, errorBar = [scipy.reshape(values[:n], shape) \
+                      for values in (X, Y, errorBar)]
+    if (X > 0).all():
+        # Log bins: the widths are proportional to X
+        widths = X
+        Xc = 10**scipy.mean(scipy.log10(X), axis=1)
+    else:
+        widths = scipy.ones(shape)
+        Xc = scipy.mean(X, axis=1)
+    norm = scipy.sum(widths, axis=1)
+    # The rms error bar of the bins (weighted as in the mean), divided
+    # by sqrt(factor) as for the decimated curves
+    errorBar = scipy.sqrt(scipy.sum((widths*errorBar)**2, axis=1) \
+                          /scipy.sum(widths**2, axis=1)/factor)
+    return Xc, scipy.sum(widths*Y, axis=1)/norm, errorBar
+
+def CoarseData(model, factor, rebin = False, minPoints = 5):
+    """
+    Data with the curves of a Model (without their initialSkip points)
+    at 1/factor of their resolution
+    """
+    import SloppyScaling
+    data = SloppyScaling.Data(model.data.linlog)
+    for independent in model.data.experiments:
+        X, Y, errorBar = model.GetCurve(independent)
+        X, Y, errorBar = CoarseCurve(X, Y, errorBar, factor, rebin, \
+                                     minPoints)
+        pointType = model.data.pointType[independent]
+        data.InstallArrays(independent, X, Y, errorBar, \
+                           pointSymbol=pointType[-1:], \
+                           pointColor=pointType[:-1], \
+                           fileName=model.data.fileNames.get(independent))
+    return data
+
+def ModelList(model):
+    """
+    The Models of a CompositeModel, or [model]
+    """
+    if hasattr(model, 'Models'):
+        return model.Models.values()
+    return [model]
+
+def SwapData(models, datas):
+    """
+    Installs datas in models, with empty caches; returns what
+    RestoreData needs to put the previous data back
+    """
+    saved = []
+    for model, data in zip(models, datas):
+        saved.append((model, model.data, model.curveCache, \
+                      model.cachedResidualKey, model.cachedResiduals))
+        model.data = data
+        model.curveCache = {}
+        model.cachedResidualKey = None
+        model.cachedResiduals = {}
+    return saved
+
+def RestoreData(saved):
+    for model, data, curveCache, key, residuals in saved:
+        model.data = data
+        model.curveCache = curveCache
+        model.cachedResidualKey = key
+        model.cachedResiduals = residuals
+
+def MultiresolutionFit(model, initialParameterValues = None, \
+                       factors = (8, 4, 2), rebin = False, \
+                       coarseTolerance = 1.e-6, minPoints = 5, \
+                       verbose = False):
+    """
+    Fits of a Model or CompositeModel at the resolutions 1/factor (in
+    the order given), each warm started from the previous one, with the
+    relative tolerance coarseTolerance, then BestFit on the full data.
+    All the levels are bounded and guarded as in Optimizers.Fit.
+    Returns the output of BestFit, with out[2]['levels'] the list of
+    {'factor', 'points', 'seconds', 'nfev', 'cost'} of every level
+    """
+    import Optimizers
+    if initialParameterValues is None:
+        initialParameterValues = model.theory.initialParameterValues
+    p = scipy.array(initialParameterValues, dtype=float)
+    models = ModelList(model)
+    levels = []
+    for factor in factors:
+        start = time.time()
+        saved = SwapData(models, [CoarseData(m, factor, rebin, minPoints) \
+                                  for m in models])
+        try:
+            points = sum([len(m.data.X[independent]) for m in models \
+                          for independent in m.data.experiments])
+            out = Optimizers.Fit(model, p, 'leastsq', ftol=coarseTolerance, \
+                                 xtol=coarseTolerance)
+        finally:
+            RestoreData(saved)
+        p = out.x
+        levels.append({'factor': factor, 'points': points, \
+                       'seconds': time.time()-start, 'nfev': out.nfev, \
+                       'cost': out.cost})
+        if verbose:
+            print "1/%-3d %6d points %4d evaluations %.3f s cost %g" % \
+                    (factor, points, levels[-1]['nfev'], \
+                     levels[-1]['seconds'], levels[-1]['cost'])
+    start = time.time()
+    out = model.BestFit(p)
+    levels.append({'factor': 1, \
+                   'points': sum([len(m.data.X[independent]) - \
+                                  m.data.initialSkip[independent] \
+                                  for m in models \
+                                  for independent in m.data.experiments]), \
+                   'seconds': time.time()-start, 'nfev': out[2]['nfev'], \
+                   'cost': float(out[2]['cost'])})
+    if verbose:
+        print "full  %6d points %4d evaluations %.3f s cost %g" % \
+                (levels[-1]['points'], levels[-1]['nfev'], \
+                 levels[-1]['seconds'], levels[-1]['cost'])
+    out[2]['levels'] = levels
+    return out
+
+def CompareWithDirect(model, initialParameterValues = None, **options):
+    """
+    Times the direct BestFit and the MultiresolutionFit (options) from
+    the same initial values; returns a dictionary of the results
+    """
+    if initialParameterValues is None:
+        initialParameterValues = model.theory.initialParameterValues
+    start = time.time()
+    direct = model.BestFit(initialParameterValues)
+    directTime = time.time() - start
+    start = time.time()
+    multi = MultiresolutionFit(model, initialParameterValues, **options)
+    multiTime = time.time() - start
+    return {'direct': {'seconds': directTime, 'nfev': direct[2]['nfev'], \
+                       'cost': float(direct[2]['cost'])}, \
+            'multiresolution': {'seconds': multiTime, \
+                                'nfev': sum([level['nfev'] for level in \
+                                             multi[2]['levels']]), \
+                                'cost': float(multi[2]['cost']), \
+                                'levels': multi[2]['levels']}, \
+            'saved': directTime - multiTime, \
+            'speedup': directTime/max(multiTime, 1.e-12)}
+
+def main(argv):
+    parser = optparse.OptionParser( \
+        usage="python Multiresolution.py [-l LIST ...] [options]")
+    parser.add_option("-m", "--module", default="A11")
+    parser.add_option("-l", "--list", action="append", default=[], \
+                      help="list of WindowScalingInfo (all the lists named MODULE* by default)")
+    parser.add_option("-d", "--data", help="data directory (WS.dataDirectory by default)")
+    parser.add_option("-f", "--factors", default="8,4,2")
+    parser.add_option("-r", "--rebin", action="store_true", \
+                      help="rebin instead of decimating")
+    parser.add_option("-o", "--output", help="write results as JSON")
+    options, args = parser.parse_args(argv)
+    import Utils
+    import Registry
+    import WindowScalingInfo as WS
+    lists = options.list or sorted([name for name in dir(WS) \
+                                    if name.startswith(options.module) and \
+                                    isinstance(getattr(WS, name), list)])
+    factors = [int(factor) for factor in options.factors.split(",")]
+    results = {}
+    for listName in lists:
+        independentNames, independentValues = Utils.get_independent( \
+            getattr(WS, listName), sorting=WS.sortedValues)
+        model = Registry.MakeModel(options.module, WS, independentValues, \
+                                   independentNames, options.data)
+        if not model.data.experiments:
+            continue
+        result = CompareWithDirect(model, factors=factors, \
+                                   rebin=options.rebin)
+        results[listName] = result
+        print "%-12s direct %.3f s (%d), coarse-to-fine %.3f s (%d): " \
+              "%.3f s saved, x%.2f, cost %g / %g" % (listName, \
+                result['direct']['seconds'], result['direct']['nfev'], \
+                result['multiresolution']['seconds'], \
+                result['multiresolution']['nfev'], result['saved'], \
+                result['speedup'], result['direct']['cost'], \
+                result['multiresolution']['cost'])
+    if options.output:
+        outfile = open(options.output, 'w')
+        json.dump(results, outfile, indent=1, sort_keys=True)
+        outfile.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,404 @@
+"""
+Optimizer backends of Model.BestFit and CompositeModel.BestFit:
+
+    'leastsq'   MINPACK Levenberg-Marquardt (the default, ftol=1e-16)
+    'trf'       trust region reflective of least_squares, with bounds
+    'dogbox'    dogleg in a box of least_squares, with bounds
+    'lm'        the delayed gratification LM of GeodesicLM.py
+    'geodesic'  the same with geodesic acceleration
+
+    out = model.BestFit(method='trf', bounds={'zeta': (0., 2.)},
+                        callback=Monitor)
+
+All return a FitResult; indexed, it is the tuple of leastsq with
+full_output, so that out[0], out[1] and out[2]['nfev'] work whatever the
+backend. callback(parameterValues, cost) is called after every
+evaluation of the residuals; if it returns True the fit stops, with the
+best parameters met so far. Backends are added with Register.
+
+The bounds of the theory (ScalingTheory.parameterBounds, declared in
+the theory modules), updated by the bounds given to BestFit, are passed
+to the backends that take bounds (trf, dogbox, and lm and geodesic,
+which project their steps on them); for leastsq, a point outside the
+bounds is rejected without evaluating the theory: its residuals are all
+set to penalty, larger than any cost the backend has met. The finite
+differences step backward at an upper bound rather than cross it. The
+fits are also guarded (Model.guarded): the evaluation stops at the
+first curve with non-finite residuals, and the point is rejected the
+same way.
+out[2]['rejected'] counts the rejected points. The chunked and
+reparameterized fits of BestFit, the coarse levels of Multiresolution
+and the profiles of Landscape honour the same bounds and guard.
+
+Compare runs every backend on a model:
+    python Optimizers.py -m A11 -l A11_W_1 -o backends.json
+"""
+
+import sys
+import json
+import time
+import optparse
+import scipy
+import scipy.linalg
+import scipy.optimize
+import SloppyScaling
+
+class FitResult:
+    """
+    Result of a fit: x, covariance (None if singular), fvec, cost (sum
+    of the squares), nfev, njev, message, status, seconds, backend;
+    indexing gives (x, covariance, infodict, message, status)
+    """
+    def __init__(self, x, covariance, fvec, nfev, message, status, \
+                 njev = None, backend = None, cost = None, **extra):
+        self.x = scipy.asarray(x, dtype=float)
+        self.covariance = covariance
+        self.fvec = fvec
+        if cost is None:
+            cost = scipy.dot(fvec, fvec)
+        self.cost = float(cost)
+        self.nfev = nfev
+        self.njev = njev
+        self.message = message
+        self.status = status
+        self.backend = backend
+        self.seconds = None
+        self.infodict = {'nfev': nfev, 'njev': njev, 'fvec': fvec, \
+                         'cost': self.cost}
+        self.infodict.update(extra)
+
+    def __getitem__(self, n):
+        return (self.x, self.covariance, self.infodict, self.message, \
+                self.status)[n]
+
+    def __len__(self):
+        return 5
+
+def FromTuple(out, backend = None):
+    """
+    FitResult of the tuple of leastsq (or of a fit returning the same)
+    """
+    x, covariance, infodict, message, status = out
+    extra = dict([(key, value) for key, value in infodict.items() \
+                  if key not in ('nfev', 'njev', 'fvec', 'cost')])
+    return FitResult(x, covariance, infodict.get('fvec'), \
+                     infodict.get('nfev'), message, status, \
+                     infodict.get('njev'), backend, infodict.get('cost'), \
+                     **extra)
+
+class StopFit(Exception):
+    pass
+
+class Objective:
+    """
+    Residual function of a model seen by the backends: counts the
+    evaluations (the rows of a batch too), keeps the best parameters,
+    rejects the points outside [lower, upper] or with non-finite
+    residuals, and calls callback after each single evaluation
+    """
+    def __init__(self, model, callback = None, lower = None, upper = None, \
+                 penalty = 1.e100):
+        self.model = model
+        self.callback = callback
+        self.lower = lower
+        self.upper = upper
+        self.penalty = penalty
+        self.nfev = 0
+        self.rejected = 0
+        self.size = None
+        self.best = None
+        # Parameters and residuals of the last single evaluation
+        self.last = None
+
+    def Outside(self, parameterValues):
+        """
+        True where (for each row of a batch) a parameter is out of bounds
+        """
+        outside = scipy.zeros(scipy.shape(parameterValues), dtype=bool)
+        if self.lower is not None:
+            outside |= parameterValues < self.lower
+        if self.upper is not None:
+            outside |= parameterValues > self.upper
+        return outside.any(axis=-1)
+
+    def Rejected(self, reason = "outside the bounds"):
+        if self.size is None:
+            raise ValueError("cannot start the fit: %s" % reason)
+        self.rejected += 1
+        return self.penalty*scipy.ones(self.size)
+
+    def __call__(self, parameterValues):
+        parameterValues = scipy.asarray(parameterValues, dtype=float)
+        if parameterValues.ndim == 2:
+            rows = self.model.Residual(parameterValues)
+            self.nfev += len(parameterValues)
+            if self.size is None:
+                self.size = rows.shape[1]
+            bad = self.Outside(parameterValues) | \
+                  ~scipy.isfinite(rows).all(axis=1)
+            if bad.any():
+                self.rejected += bad.sum()
+                rows[bad] = self.penalty
+            return rows
+        self.nfev += 1
+        if self.Outside(parameterValues):
+            r = self.Rejected()
+        else:
+            try:
+                r = self.model.Residual(parameterValues)
+            except SloppyScaling.NonFiniteResidual, error:
+                r = self.Rejected(str(error))
+            else:
+                if not scipy.isfinite(r).all():
+                    r = self.Rejected("non-finite residuals")
+        cost = scipy.dot(r, r)
+        self.last = (scipy.array(parameterValues), r)
+        if self.size is None:
+            self.size = len(r)
+        if self.best is None or cost < self.best[1]:
+            self.best = (scipy.array(parameterValues), cost, r)
+        if self.callback is not None and \
+                self.callback(parameterValues, cost):
+            raise StopFit()
+        return r
+
+    def Jacobian(self, parameterValues, relativeStep = 1.49012e-08):
+        """
+        Finite difference Jacobian (Dfun of leastsq), one batch
+        evaluation; the step is backward where a forward one would cross
+        the upper bound, instead of being rejected with the penalty
+        """
+        import GeodesicLM
+        p = scipy.asarray(parameterValues, dtype=float)
+        if self.last is not None and (self.last[0] == p).all():
+            r = self.last[1]
+        else:
+            r = self(p)
+        source = GeodesicLM.FiniteDifferenceJacobian(self, relativeStep, \
+                                                     upper=self.upper)
+        return source.Jacobian(p, r)
+
+def Covariance(J):
+    """
+    (J^T J)^-1, or None if singular
+    """
+    try:
+        return scipy.linalg.inv(scipy.dot(scipy.transpose(J), J))
+    except (scipy.linalg.LinAlgError, ValueError):
+        return None
+
+#
+# Backends: backend(objective, p0, lower, upper, **options) -> FitResult
+#
+def LeastSq(objective, p0, lower, upper, ftol = 1.e-16, **options):
+    if upper is not None and scipy.isfinite(upper).any():
+        # The differences of MINPACK would step over the upper bounds
+        options.setdefault('Dfun', objective.Jacobian)
+    out = scipy.optimize.leastsq(objective, p0, full_output=1, ftol=ftol, \
+                                 **options)
+    return FromTuple(out)
+
+def LeastSquares(method):
+    def backend(objective, p0, lower, upper, ftol = 1.e-12, xtol = 1.e-12, \
+                gtol = 1.e-12, **options):
+        out = scipy.optimize.least_squares(objective, p0, \
+                                           bounds=(lower, upper), \
+                                           method=method, ftol=ftol, \
+                                           xtol=xtol, gtol=gtol, **options)
+        return FitResult(out.x, Covariance(out.jac), out.fun, out.nfev, \
+                         out.message, out.status, out.njev)
+    return backend
+
+def GeodesicBackend(acceleration):
+    def backend(objective, p0, lower, upper, **options):
+        import GeodesicLM
+        options.setdefault('acceleration', acceleration)
+        options.setdefault('lower', lower)
+        options.setdefault('upper', upper)
+        return FromTuple(GeodesicLM.GeodesicFit(objective, p0, **options))
+    return backend
+
+backends = {}
+backendNames = []
+
+def Register(name, backend):
+    """
+    backend(objective, p0, lower, upper, **options) returns a FitResult
+    """
+    if name not in backends:
+        backendNames.append(name)
+    backends[name] = backend
+
+Register('leastsq', LeastSq)
+Register('trf', LeastSquares('trf'))
+Register('dogbox', LeastSquares('dogbox'))
+Register('lm', GeodesicBackend(False))
+Register('geodesic', GeodesicBackend(True))
+
+def BoundArrays(names, bounds):
+    """
+    lower and upper arrays of the parameters names for a dictionary
+    {name: (lo, hi)}, unbounded by default
+    """
+    lower = -scipy.inf*scipy.ones(len(names))
+    upper = scipy.inf*scipy.ones(len(names))
+    for name, (lo, hi) in (bounds or {}).items():
+        if name not in names:
+            continue
+        n = names.index(name)
+        if lo is not None:
+            lower[n] = lo
+        if hi is not None:
+            upper[n] = hi
+    return lower, upper
+
+def Bounds(model, bounds = None):
+    """
+    lower and upper arrays of the free parameters of a Model or
+    CompositeModel: the bounds of its theory, updated by bounds
+    """
+    allBounds = dict(getattr(model.theory, 'parameterBounds', {}))
+    allBounds.update(bounds or {})
+    return BoundArrays(list(model.theory.parameterNameList), allBounds)
+
+def SetGuarded(model, guarded = True):
+    """
+    Sets guarded on a Model or the Models of a CompositeModel; returns
+    what RestoreGuarded needs to put the previous flags back
+    """
+    models = hasattr(model, 'Models') and model.Models.values() or [model]
+    saved = [(m, m.guarded) for m in models]
+    for m in models:
+        m.guarded = guarded
+    return saved
+
+def RestoreGuarded(saved):
+    for m, guarded in saved:
+        m.guarded = guarded
+
+def CheckOwnFit(kind, method, options):
+    """
+    The chunked and reparameterized fits run their own Levenberg-Marquardt
+    and take no option but bounds: ValueError for another method or
+    option, rather than ignoring it
+    """
+    unsupported = sorted([name for name in options if name != 'bounds'])
+    if method != 'leastsq':
+        unsupported.insert(0, "method=%s" % method)
+    if unsupported:
+        raise ValueError("%s fits do not support %s" % \
+                         (kind, ", ".join(unsupported)))
+
+def Inside(parameterValues, lower, upper, relativeStep = 1.e-6):
+    """
+    parameterValues with the values outside [lower, upper], or on a
+    bound, moved a small relative step inside it (least_squares needs a
+    strictly feasible start, and the theories are often not finite on
+    the bounds, e.g. zeta = 0)
+    """
+    p = scipy.array(parameterValues, dtype=float)
+    low = p <= lower
+    high = p >= upper
+    for n in scipy.nonzero(low | high)[0]:
+        half = 0.5*(upper[n] - lower[n])
+        if low[n]:
+            p[n] = lower[n] + min(relativeStep*max(abs(lower[n]), 1.), half)
+        else:
+            p[n] = upper[n] - min(relativeStep*max(abs(upper[n]), 1.), half)
+    return p
+
+def Fit(model, initialParameterValues, method = 'leastsq', bounds = None, \
+        callback = None, guarded = True, **options):
+    """
+    Fit of a Model or CompositeModel by the backend method; bounds is a
+    dictionary {name: (lo, hi)} (None for no bound on a side) updating
+    those of the theory, options are passed to the backend. Initial
+    values out of bounds, or on a bound, are moved just inside (Inside)
+    """
+    if method not in backends:
+        raise ValueError("unknown optimizer %s (one of %s)" % \
+                         (method, ", ".join(backendNames)))
+    lower, upper = Bounds(model, bounds)
+    objective = Objective(model, callback, lower, upper)
+    p0 = Inside(initialParameterValues, lower, upper)
+    saved = SetGuarded(model, guarded)
+    start = time.time()
+    try:
+        result = backends[method](objective, p0, lower, upper, **options)
+    except StopFit:
+        if objective.best is None:
+            x, r = p0, model.Residual(p0)
+        else:
+            x, cost, r = objective.best
+        result = FitResult(x, None, r, objective.nfev, \
+                           "Stopped by the callback", -1)
+    finally:
+        RestoreGuarded(saved)
+    result.seconds = time.time() - start
+    result.backend = method
+    # Every evaluation counted, whatever the backend reports
+    result.nfev = result.infodict['nfev'] = objective.nfev
+    result.infodict['rejected'] = objective.rejected
+    return result
+
+def Compare(model, initialParameterValues = None, methods = None, \
+            bounds = None, verbose = True):
+    """
+    Runs every backend (or those of methods) on model from the same
+    initial values; returns a list of {'method', 'seconds', 'nfev',
+    'cost', 'status', 'message'} (or 'error')
+    """
+    if initialParameterValues is None:
+        initialParameterValues = model.theory.initialParameterValues
+    results = []
+    for method in methods or backendNames:
+        try:
+            out = model.BestFit(initialParameterValues, method=method, \
+                                bounds=bounds)
+            result = {'method': method, 'seconds': out.seconds, \
+                      'nfev': out.nfev, 'cost': out.cost, \
+                      'status': out.status, 'message': str(out.message)}
+        except ValueError, error:
+            result = {'method': method, 'error': str(error)}
+        results.append(result)
+        if verbose:
+            if 'error' in result:
+                print "%-10s %s" % (method, result['error'])
+            else:
+                print "%-10s %8.3f s %6d evaluations cost %.6g" % \
+                        (method, result['seconds'], result['nfev'], \
+                         result['cost'])
+    return results
+
+def main(argv):
+    parser = optparse.OptionParser(usage="python Optimizers.py [options]")
+    parser.add_option("-m", "--module", default="A11")
+    parser.add_option("-l", "--list", \
+                      help="list of (L,k,W) in WindowScalingInfo (WS.independentValues by default)")
+    parser.add_option("-d", "--data", help="data directory (WS.dataDirectory by default)")
+    parser.add_option("-b", "--backends", \
+                      help="comma separated (all by default: %s)" % \
+                           ",".join(backendNames))
+    parser.add_option("-o", "--output", help="write results as JSON")
+    options, args = parser.parse_args(argv)
+    import Utils
+    import Registry
+    import WindowScalingInfo as WS
+    if options.list:
+        independentNames, independentValues = Utils.get_independent( \
+            getattr(WS, options.list), sorting=WS.sortedValues)
+    else:
+        independentNames, independentValues = WS.independentNames, \
+                                               WS.independentValues
+    model = Registry.MakeModel(options.module, WS, independentValues, \
+                               independentNames, options.data)
+    results = Compare(model, methods=options.backends and \
+                                     options.backends.split(","))
+    if options.output:
+        outfile = open(options.output, 'w')
+        json.dump(results, outfile, indent=1, sort_keys=True)
+        outfile.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
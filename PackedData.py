@@ -0,0 +1,125 @@
+"""
+Packed, memory mapped store of the curves of a Data, for data sets
+larger than memory.
+
+A store is a directory with three contiguous float64 columns, X.f8,
+Y.f8 and errorBar.f8 (all the curves one after the other), and
+index.json, the table of the curves: their independent values, offset
+and length in the columns, initialSkip, point type and original file.
+The columns are opened with memmap: the curves of a PackedData are
+views, read from the disk only when used, so that a fit goes through the
+data curve by curve with the chunked mode of Model (Model.NormalEquations,
+Model.Cost(chunked=True), Model.BestFit(chunked=True)).
+
+    PackedData.Pack(model.data, "A11.pack")
+    data = PackedData.Open("A11.pack")
+    model = SloppyScaling.Model(theory, data, 'A11', False)
+    out = model.BestFit(chunked=True)
+
+Curves too many to load at once are written one at a time:
+    writer = PackedData.PackedWriter("A11.pack")
+    for independent, X, Y, errorBar in curves:
+        writer.Append(independent, X, Y, errorBar, initialSkip=4)
+    writer.Close()
+"""
+
+import os
+import json
+import scipy
+import SloppyScaling
+
+columnNames = ['X', 'Y', 'errorBar']
+
+class PackedWriter:
+    """
+    Appends curves to the columns of a new store in directory; the
+    index is written by Close
+    """
+    def __init__(self, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.files = dict([(column, open(os.path.join(directory, \
+                                                      column + '.f8'), 'wb')) \
+                           for column in columnNames])
+        self.curves = []
+        self.nPoints = 0
+
+    def Append(self, independent, X, Y, errorBar, initialSkip = 0, \
+               pointType = "bo", fileName = None):
+        n = len(X)
+        for column, values in zip(columnNames, [X, Y, errorBar]):
+            values = scipy.asarray(values, dtype='float64')
+            if len(values) != n:
+                raise ValueError("curve %s: X, Y and errorBar differ in length" \
+                                 % (tuple(independent),))
+            values.tofile(self.files[column])
+        self.curves.append({'independent': list(independent), \
+                            'offset': self.nPoints, 'length': n, \
+                            'initialSkip': initialSkip, \
+                            'pointType': pointType, 'fileName': fileName})
+        self.nPoints += n
+
+    def Close(self):
+        for outfile in self.files.values():
+            outfile.close()
+        # Written last, and atomically: a store without its index is
+        # never opened half written
+        fileName = os.path.join(self.directory, 'index.json')
+        outfile = open(fileName + '.tmp', 'w')
+        json.dump({'nPoints': self.nPoints, 'curves': self.curves}, outfile)
+        outfile.close()
+        os.rename(fileName + '.tmp', fileName)
+
+def Pack(data, directory):
+    """
+    Writes the curves of data (a Data) in a store in directory
+    """
+    writer = PackedWriter(directory)
+    for independent in data.experiments:
+        writer.Append(independent, data.X[independent], data.Y[independent], \
+                      data.errorBar[independent], \
+                      data.initialSkip[independent], \
+                      data.pointType[independent], \
+                      data.fileNames.get(independent))
+    writer.Close()
+
+class PackedData(SloppyScaling.Data):
+    """
+    Data whose curves are views of the memory mapped columns of a store;
+    curves installed afterwards (InstallCurve, InstallArrays) are in
+    memory, as in a Data
+    """
+    def __init__(self, directory, linlog = 'log'):
+        SloppyScaling.Data.__init__(self, linlog)
+        self.directory = directory
+        infile = open(os.path.join(directory, 'index.json'))
+        try:
+            index = json.load(infile)
+        finally:
+            infile.close()
+        self.nPoints = index['nPoints']
+        self.columns = {}
+        for column in columnNames:
+            if self.nPoints:
+                self.columns[column] = scipy.memmap( \
+                    os.path.join(directory, column + '.f8'), \
+                    dtype='float64', mode='r', shape=(self.nPoints,))
+            else:
+                self.columns[column] = scipy.zeros(0)
+        for curve in index['curves']:
+            independent = tuple(curve['independent'])
+            start = curve['offset']
+            stop = start + curve['length']
+            self.experiments.append(independent)
+            self.revision[independent] = 1
+            self.X[independent] = self.columns['X'][start:stop]
+            self.Y[independent] = self.columns['Y'][start:stop]
+            self.errorBar[independent] = self.columns['errorBar'][start:stop]
+            self.initialSkip[independent] = curve['initialSkip']
+            self.pointType[independent] = str(curve['pointType'])
+            self.fileNames[independent] = curve['fileName']
+            self.defaultFractionalError[independent] = None
+
+def Open(directory, linlog = 'log'):
+    return PackedData(directory, linlog)
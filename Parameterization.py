@@ -0,0 +1,161 @@
+"""
+Reparameterized fits: the parameters of the theories span orders of
+magnitude (Ixs ~ 7, Ixw_0 ~ 2e-2, the exponents ~ 1), some are positive
+by nature, and leastsq takes many poorly conditioned steps on them.
+Each free parameter is declared
+    'linear'    fitted as it is (the default),
+    'log'       positive: log(p) is fitted,
+    (lo, hi)    bounded: log((p-lo)/(hi-p)) is fitted,
+and the internal variables are then scaled by the norms of the columns
+of the Jacobian at the initial values, so that all the columns have
+unit norm. The results and covariances are mapped back to the
+parameters of the theory; the theory strings are unchanged.
+
+    out = model.BestFit(parameterization={'Ixh': 'log', 'nh': 'log',
+                                          'zeta': (0., 2.)})
+"""
+
+import scipy
+import scipy.optimize
+
+class Parameterization:
+    """
+    Map between the parameters of a theory (external) and the variables
+    seen by the optimizer (internal); kinds is a dictionary
+    {name: 'linear' | 'log' | (lo, hi)}, the parameters not in it being
+    linear
+    """
+    def __init__(self, names, kinds = None, rescale = True):
+        self.names = list(names)
+        kinds = kinds or {}
+        unknown = [name for name in kinds if name not in self.names]
+        if unknown:
+            print "Warning: parameters ", ", ".join(unknown), \
+                  " NOT included in the list"
+        self.kinds = [kinds.get(name, 'linear') for name in self.names]
+        for name, kind in zip(self.names, self.kinds):
+            if kind not in ('linear', 'log') and \
+                    not (isinstance(kind, tuple) and len(kind) == 2):
+                raise ValueError("parameter %s: unknown kind %r" % \
+                                 (name, kind))
+        self.rescale = rescale
+        self.scales = scipy.ones(len(self.names))
+
+    def Unscaled(self, p):
+        """
+        Internal variables before scaling
+        """
+        u = scipy.array(p, dtype=float)
+        for n, kind in enumerate(self.kinds):
+            if kind == 'log':
+                if u[n] <= 0:
+                    raise ValueError("log parameter %s must be positive, " \
+                                     "not %g" % (self.names[n], u[n]))
+                u[n] = scipy.log(u[n])
+            elif kind != 'linear':
+                lo, hi = kind
+                if not lo < u[n] < hi:
+                    raise ValueError("parameter %s = %g outside (%g, %g)" % \
+                                     (self.names[n], u[n], lo, hi))
+                u[n] = scipy.log((u[n]-lo)/(hi-u[n]))
+        return u
+
+    def ToInternal(self, p):
+        return self.Unscaled(p)/self.scales
+
+    def ToExternal(self, v):
+        p = scipy.array(v, dtype=float)*self.scales
+        for n, kind in enumerate(self.kinds):
+            if kind == 'log':
+                p[n] = scipy.exp(p[n])
+            elif kind != 'linear':
+                lo, hi = kind
+                p[n] = lo + (hi-lo)/(1.+scipy.exp(-p[n]))
+        return p
+
+    def Derivatives(self, v):
+        """
+        dp/dv, the diagonal of the Jacobian of ToExternal at v
+        """
+        u = scipy.array(v, dtype=float)*self.scales
+        d = scipy.ones(len(u))
+        for n, kind in enumerate(self.kinds):
+            if kind == 'log':
+                d[n] = scipy.exp(u[n])
+            elif kind != 'linear':
+                lo, hi = kind
+                e = scipy.exp(-u[n])
+                d[n] = (hi-lo)*e/(1.+e)**2
+        return d*self.scales
+
+    def SetScales(self, model, p, relativeStep = 1.e-6):
+        """
+        Scales making the columns of the Jacobian (in the unscaled
+        internal variables) of unit norm at p; the n+1 residual vectors
+        are evaluated as one batch
+        """
+        self.scales = scipy.ones(len(self.names))
+        if not self.rescale:
+            return 0
+        u = self.Unscaled(p)
+        steps = relativeStep*scipy.maximum(abs(u), 1.)
+        shifted = u + scipy.diag(steps)
+        rows = model.Residual(scipy.array([self.ToExternal(w) for w in \
+                                           scipy.concatenate(([u], shifted))]))
+        norms = scipy.sqrt(scipy.sum(((rows[1:] - rows[0]) / \
+                                      steps[:, scipy.newaxis])**2, axis=1))
+        good = scipy.isfinite(norms) & (norms > 0)
+        self.scales[good] = 1./norms[good]
+        return len(u) + 1
+
+    def Covariance(self, v, internalCovariance):
+        """
+        Covariance of the external parameters, to first order
+        """
+        if internalCovariance is None:
+            return None
+        d = self.Derivatives(v)
+        return internalCovariance * d[:, scipy.newaxis] * d[scipy.newaxis, :]
+
+def MakeParameterization(model, parameterization):
+    """
+    parameterization as is, or a Parameterization of the free parameters
+    of model for a dictionary of kinds
+    """
+    if isinstance(parameterization, Parameterization):
+        return parameterization
+    return Parameterization(model.theory.parameterNameList, parameterization)
+
+def ReparameterizedFit(model, initialParameterValues, parameterization, \
+                       ftol = 1.e-16, bounds = None):
+    """
+    leastsq fit of a Model or CompositeModel in the internal variables
+    of parameterization (a Parameterization or a dictionary of kinds);
+    returns the tuple of leastsq, mapped back to the parameters of the
+    theory, with out[2]['cost'], out[2]['rejected'] and
+    out[2]['internal'] (the variables at the optimum). As in
+    Optimizers.Fit, the bounds of the theory (updated by bounds) are
+    enforced and the fit is guarded
+    """
+    import Optimizers
+    parameterization = MakeParameterization(model, parameterization)
+    lower, upper = Optimizers.Bounds(model, bounds)
+    p0 = Optimizers.Inside(initialParameterValues, lower, upper)
+    objective = Optimizers.Objective(model, None, lower, upper)
+    saved = Optimizers.SetGuarded(model)
+    try:
+        nScale = parameterization.SetScales(model, p0)
+        residual = lambda v: objective(parameterization.ToExternal(v))
+        out = scipy.optimize.leastsq(residual, \
+                                     parameterization.ToInternal(p0), \
+                                     full_output=1, ftol=ftol)
+    finally:
+        Optimizers.RestoreGuarded(saved)
+    v, internalCovariance, infodict, message, ier = out
+    infodict['internal'] = v
+    infodict['nfev'] = objective.nfev + nScale
+    infodict['rejected'] = objective.rejected
+    infodict['cost'] = sum(infodict['fvec']**2)
+    return parameterization.ToExternal(v), \
+           parameterization.Covariance(v, internalCovariance), \
+           infodict, message, ier
@@ -0,0 +1,106 @@
+"""
+Counters and timers for the hot paths of a fit.
+
+Switch them on per model with model.EnableProfiling(); when off, each
+instrumented call only pays an 'is not None' test. After a fit:
+    print model.profiler.Table()
+    model.profiler.ToJSON('profile.json')
+Keys are of the form 'A11/Y/exec' (assignments of parameters and
+variables), 'A11/Y/eval' (the theory expression, i.e. NumPy work),
+'A11/Y/normalization', 'A11/Residual/L=1024,k=0.01,W=16' (one curve),
+'A11/Residual' (whole model) and 'A11/CompositeResidual' (all the
+models of a CompositeModel).
+"""
+
+import time
+import json
+import scipy
+
+clock = time.time
+
+
+class Profiler:
+    """
+    Collects the durations of the instrumented calls by key,
+    and the function/Jacobian evaluation counts of each fit
+    """
+    def __init__(self):
+        self.timings = {}
+        self.fits = []
+
+    def Reset(self):
+        self.timings = {}
+        self.fits = []
+
+    def Add(self, key, seconds):
+        try:
+            self.timings[key].append(seconds)
+        except KeyError:
+            self.timings[key] = [seconds]
+
+    def Calls(self, key):
+        return len(self.timings.get(key, []))
+
+    def RecordFit(self, name, seconds, residualCalls, nfev = None, \
+                  njev = None, cost = None):
+        """
+        nfev as reported by the optimizer: for MINPACK leastsq it includes
+        the calls made to build the finite-difference Jacobian
+        """
+        self.fits.append({'name': name, 'seconds': seconds, \
+                          'residualCalls': residualCalls, \
+                          'nfev': nfev, 'njev': njev, 'cost': cost})
+
+    def Summary(self):
+        """
+        List of dicts with calls, total, mean and percentile times by key
+        """
+        out = []
+        for key in sorted(self.timings):
+            t = scipy.array(self.timings[key])
+            p50, p90, p99 = scipy.percentile(t, [50, 90, 99])
+            out.append({'key': key, 'calls': len(t), 'total': t.sum(), \
+                        'mean': t.mean(), 'p50': p50, 'p90': p90, 'p99': p99})
+        return out
+
+    def Table(self):
+        """
+        Summary as text (times in milliseconds, total in seconds)
+        """
+        summary = self.Summary()
+        width = max([len(line['key']) for line in summary] + [3])
+        lines = ["%-*s %8s %9s %9s %9s %9s %9s" % \
+                 (width, "key", "calls", "total(s)", "mean", "p50", "p90", "p99")]
+        for line in summary:
+            lines.append("%-*s %8d %9.4f %9.4f %9.4f %9.4f %9.4f" % \
+                (width, line['key'], line['calls'], line['total'], \
+                 1.e3*line['mean'], 1.e3*line['p50'], \
+                 1.e3*line['p90'], 1.e3*line['p99']))
+        for fit in self.fits:
+            lines.append("Fit %s: %.3f s, %d residual calls, nfev = %s, "
+                         "njev = %s, cost = %s" % \
+                         (fit['name'], fit['seconds'], fit['residualCalls'], \
+                          fit['nfev'], fit['njev'], fit['cost']))
+        return "\n".join(lines)
+
+    def ToJSON(self, fileName = None):
+        """
+        Returns the summary and fits as a JSON string, also written
+        to fileName if given
+        """
+        out = json.dumps({'timings': self.Summary(), 'fits': self.fits}, \
+                         indent=1, default=float)
+        if fileName is not None:
+            outfile = open(fileName, 'w')
+            outfile.write(out)
+            outfile.close()
+        return out
+
+
+def CurveKey(name, independentNames, independentValues):
+    """
+    Key of the timings of a single curve, e.g. 'A11/Residual/L=1024,k=0.01'
+    """
+    names = [n.strip() for n in independentNames.split(",")]
+    return name + "/Residual/" + ",".join(["%s=%s" % (n, v) \
+                                for n, v in zip(names, independentValues)])
@@ -0,0 +1,215 @@
+"""
+Registry of the scaling theories (A00, A11, Ahk, ...).
+
+Each theory module (A11Module.py, ...) defines its strings and a
+MakeTheory(config) factory, and registers it here when imported; the
+modules are only imported when a theory is first requested, and they no
+longer load data or reload SloppyScaling, WindowScalingInfo and Utils.
+The shared settings (independent values, normalization, data directory,
+symbols and colours, ...) come from a config object, evaluated once:
+WindowScalingInfo by default, or a RunConfig read from a JSON file.
+
+The modules keep their Model, for the interactive sessions: A11Module.A11
+is the Model of A11 for WindowScalingInfo (DefaultModel('A11')), and
+A11Module.theory and A11Module.data its theory and data; they are made
+and loaded when first used rather than when the module is imported.
+
+Example:
+    joint = Registry.MakeComposite(['A10', 'A11'])
+    model = Registry.MakeModel('A11', independentValues=[(1024,0.01,16)])
+    import A11Module
+    A11Module.A11.BestFit()
+"""
+
+import os
+import sys
+import types
+import SloppyScaling
+import Utils
+import DataIndex
+
+# Registered theories: name -> (factory, file name prefix, uses W)
+factories = {}
+# Models of DefaultModel: name -> Model
+defaultModels = {}
+
+class TheoryModule(types.ModuleType):
+    """
+    Module of a theory (A11Module, ...) whose attribute named as the
+    theory is DefaultModel(name), made on first use, and whose theory
+    and data attributes are those of that Model
+    """
+    def __getattr__(self, attribute):
+        name = self.__dict__.get('theoryName')
+        if attribute == name:
+            return DefaultModel(name)
+        if name is not None and attribute in ('theory', 'data'):
+            return getattr(DefaultModel(name), attribute)
+        raise AttributeError("'module' object has no attribute '%s'" \
+                             % attribute)
+
+def InstallModelAttribute(name):
+    """
+    Replaces the module nameModule, when it is being imported, by a
+    TheoryModule with the same contents
+    """
+    moduleName = name + "Module"
+    module = sys.modules.get(moduleName)
+    if module is None:
+        return
+    defaultModels.pop(name, None)
+    if isinstance(module, TheoryModule):
+        return
+    theoryModule = TheoryModule(moduleName, module.__doc__)
+    theoryModule.__dict__.update(module.__dict__)
+    theoryModule.theoryName = name
+    # The functions of the module look up their globals in the original
+    # module, which must not be freed
+    theoryModule.originalModule = module
+    sys.modules[moduleName] = theoryModule
+
+def Register(name, factory, fileName = None, usesW = True):
+    """
+    Called by the theory modules: factory(config) returns a new
+    ScalingTheory, fileName is the prefix of the data files (name by
+    default) and usesW is False for the curves stored without "_W="
+    """
+    factories[name] = (factory, fileName or name, usesW)
+    InstallModelAttribute(name)
+
+def GetEntry(name):
+    if name not in factories:
+        __import__(name + "Module")
+    if name not in factories:
+        raise KeyError("no theory registered as %s" % name)
+    return factories[name]
+
+def FileUsesW(fileName, default = None):
+    """
+    usesW of the theory registered with the data file prefix fileName,
+    or default if there is none
+    """
+    for factory, prefix, usesW in factories.values():
+        if prefix == fileName:
+            return usesW
+    return default
+
+def DefaultConfig():
+    """
+    WindowScalingInfo, imported (thus evaluated) once
+    """
+    import WindowScalingInfo
+    return WindowScalingInfo
+
+def MakeTheory(name, config = None):
+    """
+    New ScalingTheory; a new one is made each time, since models change
+    the parameter lists of their theory (see CompositeModel.InstallModel)
+    """
+    if config is None:
+        config = DefaultConfig()
+    factory, fileName, usesW = GetEntry(name)
+    return factory(config)
+
+def LoadData(name, config = None, independentValues = None, \
+             dataDirectory = None, verbose = True):
+    """
+    Data of the theory name for independentValues (those of config by
+    default); returns the Data and the list of missing files.
+    Empty files (of interrupted runs) count as missing
+    """
+    if config is None:
+        config = DefaultConfig()
+    factory, fileName, usesW = GetEntry(name)
+    if independentValues is None:
+        independentValues = config.independentValues
+        Symbol, Color = config.Symbol, config.Color
+    else:
+        Symbol, Color = Utils.MakeSymbolsAndColors(independentValues)
+    if dataDirectory is None:
+        dataDirectory = config.dataDirectory
+    k_string = getattr(config, 'k_string', "_k=")
+    if usesW:
+        template = getattr(config, 'fileNameTemplate', None)
+    else:
+        template = getattr(config, 'fileNameTemplateLk', None)
+    # The files are found in the index of the directory, whatever the
+    # spelling of k; with a template, the names are built from it
+    index = None
+    if template is None and os.path.isdir(dataDirectory or os.curdir):
+        index = DataIndex.GetIndex(dataDirectory or os.curdir)
+    data = SloppyScaling.Data()
+    missing = []
+    loaded = set()
+    for independent in independentValues:
+        # The (L,k,W) lists are also accepted by the (L,k) theories: the
+        # curve of an (L,k) file is installed once, under the first
+        # (L,k,W) naming it
+        fileIndependent = usesW and independent or independent[:2]
+        if fileIndependent in loaded:
+            continue
+        loaded.add(fileIndependent)
+        curveFile = Utils.get_fileName(dataDirectory, fileName, \
+                                       fileIndependent, config.simulType, \
+                                       k_string, template=template)
+        if index is not None:
+            indexed = index.FileName(fileName, fileIndependent, \
+                                     config.simulType)
+            if indexed is None:
+                missing.append(curveFile)
+                continue
+            curveFile = indexed
+        success = data.InstallCurve(independent, curveFile, \
+                                    pointSymbol=Symbol[independent], \
+                                    pointColor=Color[independent], \
+                                    initialSkip=config.rows_to_skip)
+        if not success or len(data.X[independent]) <= config.rows_to_skip + 1:
+            data.RemoveCurve(independent)
+            missing.append(curveFile)
+    if verbose:
+        nFiles = len(loaded)
+        if not missing:
+            print "Loaded %2d/%2d files (%s)" % (nFiles, nFiles, fileName)
+        else:
+            print "====================="
+            print "Attention! %2d/%2d files are missing (%s)" % \
+                    (len(missing), nFiles, fileName)
+            print "====================="
+    return data, missing
+
+def MakeModel(name, config = None, independentValues = None, \
+              independentNames = None, dataDirectory = None, verbose = True):
+    """
+    Model of the theory name with its data; independentNames must be
+    given with independentValues if they differ from those of config
+    """
+    if config is None:
+        config = DefaultConfig()
+    theory = MakeTheory(name, config)
+    if independentNames is not None:
+        theory.independentNames = independentNames
+    data, missing = LoadData(name, config, independentValues, dataDirectory, \
+                             verbose)
+    factory, fileName, usesW = GetEntry(name)
+    return SloppyScaling.Model(theory, data, fileName, config.sortedValues)
+
+def DefaultModel(name):
+    """
+    Model of name with the data of DefaultConfig, made on the first call
+    (the module attribute, e.g. A11Module.A11)
+    """
+    if name not in defaultModels:
+        defaultModels[name] = MakeModel(name)
+    return defaultModels[name]
+
+def MakeComposite(names, config = None, compositeName = None, **options):
+    """
+    CompositeModel of the theories in names, sharing one config;
+    options are passed to MakeModel
+    """
+    if config is None:
+        config = DefaultConfig()
+    composite = SloppyScaling.CompositeModel(compositeName or "".join(names))
+    for name in names:
+        composite.InstallModel(name, MakeModel(name, config, **options))
+    return composite
@@ -0,0 +1,81 @@
+"""
+Headless rendering of the fit, collapse and residual figures.
+
+Each figure is drawn on its own matplotlib Figure with the Agg canvas
+(no pylab state, no display) by Model.PlotFunctions / PlotResiduals,
+and the figures are rendered in a process pool. Files are named
+<prefix>_fit.png, <prefix>_collapse.png and <prefix>_residuals.png
+(prefix is the model name by default).
+
+Example, for a batch of fits:
+    jobs = [(model, bestValues, "A11_run%d" % n) for ...]
+    Rendering.RenderModels(jobs, "plots/", formats=('png', 'pdf'))
+"""
+
+import os
+import multiprocessing
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+figureKinds = ['fit', 'collapse', 'residuals']
+
+# Jobs of the worker processes; set once by _InitWorker
+_workerJobs = None
+
+def _InitWorker(jobs):
+    global _workerJobs
+    _workerJobs = jobs
+
+def _RenderTask(task):
+    n, kind, outputDirectory, formats, options = task
+    model, parameterValues, prefix = _workerJobs[n]
+    return RenderFigure(model, parameterValues, kind, outputDirectory, \
+                        formats, prefix, **options)
+
+
+def RenderFigure(model, parameterValues, kind, outputDirectory, \
+                 formats = ('png',), prefix = None, figSize = (8, 6), dpi = 100):
+    """
+    Draws one figure ('fit', 'collapse' or 'residuals') of model and
+    saves it once per format; returns the list of file names
+    """
+    figure = Figure(figsize=figSize)
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot(111)
+    if kind == 'residuals':
+        model.PlotResiduals(parameterValues, axes=axes)
+    else:
+        model.PlotFunctions(parameterValues, plotCollapse=(kind == 'collapse'), \
+                            axes=axes)
+    if prefix is None:
+        prefix = model.name
+    fileNames = []
+    for fmt in formats:
+        fileName = os.path.join(outputDirectory, \
+                                "%s_%s.%s" % (prefix, kind, fmt))
+        figure.savefig(fileName, dpi=dpi)
+        fileNames.append(fileName)
+    return fileNames
+
+def RenderModels(jobs, outputDirectory, formats = ('png',), \
+                 kinds = figureKinds, processes = None, **options):
+    """
+    jobs is a list of (model, parameterValues, prefix); every kind of
+    figure of every job is rendered in parallel over processes workers
+    (serially if processes == 1). Returns the list of file names
+    """
+    if not os.path.isdir(outputDirectory):
+        os.makedirs(outputDirectory)
+    tasks = [(n, kind, outputDirectory, formats, options) \
+             for n in range(len(jobs)) for kind in kinds]
+    if processes == 1 or len(tasks) < 2:
+        _InitWorker(jobs)
+        results = map(_RenderTask, tasks)
+    else:
+        pool = multiprocessing.Pool(processes, _InitWorker, (jobs,))
+        try:
+            results = pool.map(_RenderTask, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return [fileName for fileNames in results for fileName in fileNames]
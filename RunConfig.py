@@ -0,0 +1,163 @@
+"""
+Declarative run configurations, as JSON files, in place of editing
+WindowScalingInfo. A RunConfig has the attribute names of
+WindowScalingInfo (moduleNames, independentNames, independentValues,
+dataDirectory, rows_to_skip, ...), so it can be given to Registry and
+FitRunner wherever WindowScalingInfo is used. Example:
+
+{
+ "modules": ["A10", "A11"],
+ "independentValues": [[1024, [0.005, 0.01], {"from": 1, "to": 256}],
+                       [2048, 0.001, [8, 256]]],
+ "dataDirectory": "data02_18/",
+ "fileNameTemplate": "{name}_W={W:04d}_k{k}_System_Size={L2}x{L}_{simulType}.bnd",
+ "rowsToSkip": 4,
+ "normalization": "NormBasic",
+ "hold": {"zeta": 0.85}
+}
+
+independentValues is the short form of Utils.get_independent, with the
+range of windows (Wmin,Wmax) (powers of 2) written {"from": Wmin, "to": Wmax},
+or a query on the files in the data directory, such as
+ "independentValues": "L == 1024 and W <= 128"
+(see DataIndex.py).
+A relative dataDirectory is relative to the directory of the file.
+The file name templates are those of Utils.get_fileName
+(fileNameTemplateLk for the theories without W); without them the files
+are named as usual, with k_string.
+
+Each file is parsed once: Load returns the cached RunConfig as long as
+the file is not modified; it is shared, and the settings of a run are
+changed on an Override of it. A batch of configurations is fitted with
+    python FitRunner.py fit --config run1.json --config run2.json -o out.json
+"""
+
+import os
+import json
+import Utils
+
+defaults = {
+    'modules': ['A11'],
+    'independentValues': None,
+    'sorted': False,
+    'simulType': "NonLinear",
+    'rowsToSkip': 4,
+    'normalization': "NormBasic",
+    'corrections': False,
+    'dataDirectory': "data/",
+    'k_string': "_k=",
+    'fileNameTemplate': None,
+    'fileNameTemplateLk': None,
+    'hold': {},
+    'name': None,
+}
+
+# Parsed files: absolute file name -> (mtime, RunConfig)
+cache = {}
+
+def ShortList(values):
+    """
+    JSON short form -> list of Utils.get_independent, where (Wmin,Wmax)
+    ranges are tuples
+    """
+    out = []
+    for line in values:
+        line = list(line)
+        if len(line) == 3 and isinstance(line[2], dict):
+            line[2] = (line[2]['from'], line[2]['to'])
+        out.append(line)
+    return out
+
+class RunConfig:
+    """
+    Settings of a run (see the module documentation for the keys);
+    settings is the dictionary read from fileName
+    """
+    def __init__(self, settings, fileName = None):
+        unknown = [key for key in settings if key not in defaults]
+        if unknown:
+            raise ValueError("unknown settings in %s: %s" % \
+                             (fileName or "config", ", ".join(sorted(unknown))))
+        values = dict(defaults)
+        values.update(settings)
+        if values['independentValues'] is None:
+            raise ValueError("independentValues missing in %s" % \
+                             (fileName or "config"))
+        self.fileName = fileName
+        self.name = values['name']
+        if self.name is None and fileName is not None:
+            self.name = os.path.splitext(os.path.basename(fileName))[0]
+        self.moduleNames = [str(name) for name in values['modules']]
+        self.sortedValues = values['sorted']
+        self.simulType = str(values['simulType'])
+        self.rows_to_skip = values['rowsToSkip']
+        self.normalization = values['normalization'] and \
+                             str(values['normalization'])
+        self.corrections_to_scaling = values['corrections']
+        dataDirectory = values['dataDirectory']
+        if fileName is not None and not os.path.isabs(dataDirectory):
+            dataDirectory = os.path.join(os.path.dirname(fileName), \
+                                         dataDirectory)
+        if dataDirectory and not dataDirectory.endswith(os.sep):
+            dataDirectory = dataDirectory + os.sep
+        self.dataDirectory = dataDirectory
+        independentValues = values['independentValues']
+        if isinstance(independentValues, basestring):
+            self.independentNames, self.independentValues = \
+                self.QueryIndependent(independentValues)
+        else:
+            self.independentNames, self.independentValues = \
+                Utils.get_independent(ShortList(independentValues), \
+                                      sorting=self.sortedValues)
+        self.Symbol, self.Color = \
+            Utils.MakeSymbolsAndColors(self.independentValues)
+        self.k_string = str(values['k_string'])
+        self.fileNameTemplate = values['fileNameTemplate']
+        self.fileNameTemplateLk = values['fileNameTemplateLk']
+        self.heldParams = sorted([(str(pName), float(pValue)) for \
+                                  pName, pValue in values['hold'].items()])
+
+    def QueryIndependent(self, condition):
+        """
+        independentNames and the (L,k,W) of the files of the first module
+        in the data directory for which condition is true (see DataIndex)
+        """
+        import DataIndex
+        import Registry
+        fileName = Registry.GetEntry(self.moduleNames[0])[1]
+        index = DataIndex.GetIndex(self.dataDirectory or os.curdir)
+        values = index.IndependentValues(fileName, condition, self.simulType)
+        if values and len(values[0]) == 2:
+            return "L, k", values
+        return "L, k, W", values
+
+class Override:
+    """
+    A config (WindowScalingInfo or a RunConfig) with some settings
+    replaced, leaving the config itself, shared through the cache of
+    Load or the module, unchanged
+    """
+    def __init__(self, config, **settings):
+        self.config = config
+        self.__dict__.update(settings)
+
+    def __getattr__(self, name):
+        return getattr(self.config, name)
+
+def Load(fileName):
+    """
+    RunConfig of a JSON file, parsed again only if the file changed
+    """
+    fileName = os.path.abspath(fileName)
+    mtime = os.stat(fileName).st_mtime
+    cached = cache.get(fileName)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    infile = open(fileName)
+    try:
+        settings = json.load(infile)
+    finally:
+        infile.close()
+    config = RunConfig(settings, fileName)
+    cache[fileName] = (mtime, config)
+    return config
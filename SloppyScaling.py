@@ -1,13 +1,63 @@
 import scipy
-import pylab
 import copy
+import ast
 from scipy import exp
 import scipy.optimize
 import scipy.special
-import WindowScalingInfo as WS
-reload(WS)
+import scipy.linalg
+import Profiling
+import Utils
 
 
+class NonFiniteResidual(ArithmeticError):
+    """
+    Raised by Model.Residual in guarded mode at the first curve whose
+    residuals are not all finite; the remaining curves are not evaluated
+    """
+    def __init__(self, modelName, independentValues):
+        ArithmeticError.__init__(self, "non-finite residuals in %s for %s" \
+                                 % (modelName, independentValues,))
+        self.modelName = modelName
+        self.independentValues = independentValues
+
+def IsExp(node):
+    """
+    True for a call of exp or scipy.exp (numpy.exp) on one argument
+    """
+    if not isinstance(node, ast.Call) or len(node.args) != 1 or node.keywords:
+        return False
+    func = node.func
+    if isinstance(func, ast.Name):
+        return func.id == 'exp'
+    return isinstance(func, ast.Attribute) and func.attr == 'exp' and \
+           isinstance(func.value, ast.Name) and \
+           func.value.id in ('scipy', 'numpy')
+
+def LogNode(node):
+    """
+    Expression tree of the log of the expression node, as sums of logs:
+    log(a*b) = log(a)+log(b), log(a/b) = log(a)-log(b),
+    log(a**b) = b*log(a), log(exp(a)) = a, and scipy.log(a) otherwise
+    """
+    if isinstance(node, ast.BinOp):
+        if isinstance(node.op, ast.Mult):
+            return ast.BinOp(LogNode(node.left), ast.Add(), LogNode(node.right))
+        if isinstance(node.op, ast.Div):
+            return ast.BinOp(LogNode(node.left), ast.Sub(), LogNode(node.right))
+        if isinstance(node.op, ast.Pow):
+            return ast.BinOp(node.right, ast.Mult(), LogNode(node.left))
+    if IsExp(node):
+        return node.args[0]
+    return ast.Call(ast.Attribute(ast.Name('scipy', ast.Load()), 'log', \
+                                  ast.Load()), [node], [], None, None)
+
+def LogCode(expression):
+    """
+    Compiled log of a theory string (see LogNode)
+    """
+    tree = ast.parse(expression.strip(), mode='eval')
+    tree = ast.fix_missing_locations(ast.Expression(LogNode(tree.body)))
+    return compile(tree, '<log of %s>' % expression.strip(), 'eval')
 
 class ScalingTheory:
     """
@@ -33,16 +83,24 @@ class ScalingTheory:
                 title= 'Avalanche histo$'
                 scalingTitle= 'Avalanche histo scaling plot'
                 Xname = 'S', XscaledName='Ss', Yname = 'D', normalization = True)
+    parameterBounds, e.g. {'Ixs': (0., None)}, are the (lower, upper)
+    bounds of the parameters (None for no bound), enforced by the fits
+    (see Optimizers.py)
+    #
+    With logSpace = True, Y is exp(LogY): log(Y) is evaluated directly
+    from Ytheory rewritten as a sum of logs (see LogNode), and normalized
+    with a log-sum-exp, so that curves spanning many decades neither
+    underflow nor overflow
     """
     def __init__(self, Ytheory, parameterNames, initialParameterValues, \
                  independentNames, \
                  scalingX = 'X', scalingY = 'Y', scalingW = None, \
-                 scalingXTeX = r'${\cal{X}}$', \
-                 scalingYTeX = r'${\cal{Y}}$', \
+                 scalingXTeX = r'${\mathcal{X}}$', \
+                 scalingYTeX = r'${\mathcal{Y}}$', \
                  title = 'Fit', scalingTitle = 'Scaling Collapse',
                  Xname='X', XscaledName = 'Xs', Yname='Y', WscaledName = 'Ws',\
                  heldParameterBool = False, heldParameterList = "", heldParameterPass = False,
-                 normalization = None):
+                 normalization = None, parameterBounds = None):
         #YJC: added WscaledName = 'Ws' and scalingW =None to theory
         # to make the scaling function easier to read, need to keep default none for scalingW,
         #because some theories don't have this second variable
@@ -67,35 +125,117 @@ class ScalingTheory:
         self.title = title
         self.scalingTitle = scalingTitle
         self.normalization = normalization
+        self.parameterBounds = dict(parameterBounds or {})
         self.heldParameterBool = heldParameterBool
         self.heldParameterPass = heldParameterPass
+        # Set by Model.EnableProfiling
+        self.profiler = None
+        self.logSpace = False
+        # (Ytheory, code of its log), see LogY
+        self.logCode = (None, None)
+        # Compiled statements of Y, LogY, ScaleX and ScaleY, see Code
+        self.codeCache = {}
+
+    def __getstate__(self):
+        # Code objects cannot be pickled; they are compiled again
+        state = self.__dict__.copy()
+        state['logCode'] = (None, None)
+        state['codeCache'] = {}
+        return state
+
+    def Code(self, statement):
+        """
+        Compiled statement, cached: compiling the strings of the theory
+        at each evaluation costs more than running them on short curves
+        """
+        code = self.codeCache.get(statement)
+        if code is None:
+            code = compile(statement, '<%s>' % self.Yname, 'exec')
+            self.codeCache[statement] = code
+        return code
 
     def Y(self, X, parameterValues, independentValues):
         """
         Predicts Y as a function of X
         """
+        if self.logSpace:
+            return exp(self.LogY(X, parameterValues, independentValues))
         # Set values of parameters based on vector of current guess
         # Set values of independent variables based on which curve is being fit
         # Set up vector of independent variable from X
         # Warning: local variables in subroutine must be named
         # 'parameterValues', 'independentValues', and 'X'
-        exec(self.parameterNames + " = parameterValues")
-        exec(self.independentNames + " = independentValues")
+        profiler = self.profiler
+        if profiler is not None:
+            t0 = Profiling.clock()
+        exec(self.Code(self.parameterNames + " = parameterValues"))
+        exec(self.Code(self.independentNames + " = independentValues"))
         if self.heldParameterBool:
             for par, val in self.heldParameterList:
-                exec(par + " = " + str(val))
-        exec(self.Xname + ' = X')
+                exec(self.Code(par + " = " + str(val)))
+        exec(self.Code(self.Xname + ' = X'))
         if self.XscaledName:
-            exec(self.XscaledName +'='+ self.scalingX)
+            exec(self.Code(self.XscaledName +'='+ self.scalingX))
         #YJC: added scalingW here
         if self.scalingW:
-            exec(self.WscaledName +"="+ self.scalingW)
-        exec("Y = " + self.Ytheory)
+            exec(self.Code(self.WscaledName +"="+ self.scalingW))
+        if profiler is not None:
+            t1 = Profiling.clock()
+        exec(self.Code("Y = " + self.Ytheory))
+        if profiler is not None:
+            t2 = Profiling.clock()
+            profiler.Add(self.Yname + "/Y/exec", t1-t0)
+            profiler.Add(self.Yname + "/Y/eval", t2-t1)
         if self.normalization:
             fn = getattr(self, self.normalization)
             Y = fn(X, Y, parameterValues, independentValues)
+            if profiler is not None:
+                profiler.Add(self.Yname + "/Y/normalization", \
+                             Profiling.clock()-t2)
         return Y
 
+    def LogY(self, X, parameterValues, independentValues):
+        """
+        Predicts log(Y) as a function of X, evaluated as a sum of logs
+        and normalized in log space
+        """
+        # Warning: local variables in subroutine must be named
+        # 'parameterValues', 'independentValues', and 'X'
+        profiler = self.profiler
+        if profiler is not None:
+            t0 = Profiling.clock()
+        if self.logCode[0] != self.Ytheory:
+            self.logCode = (self.Ytheory, LogCode(self.Ytheory))
+        exec(self.Code(self.parameterNames + " = parameterValues"))
+        exec(self.Code(self.independentNames + " = independentValues"))
+        if self.heldParameterBool:
+            for par, val in self.heldParameterList:
+                exec(self.Code(par + " = " + str(val)))
+        exec(self.Code(self.Xname + ' = X'))
+        if self.XscaledName:
+            exec(self.Code(self.XscaledName +'='+ self.scalingX))
+        if self.scalingW:
+            exec(self.Code(self.WscaledName +"="+ self.scalingW))
+        if profiler is not None:
+            t1 = Profiling.clock()
+        logY = eval(self.logCode[1])
+        if profiler is not None:
+            t2 = Profiling.clock()
+            profiler.Add(self.Yname + "/LogY/exec", t1-t0)
+            profiler.Add(self.Yname + "/LogY/eval", t2-t1)
+        if self.normalization:
+            fn = getattr(self, "Log" + self.normalization, None)
+            if fn is not None:
+                logY = fn(X, logY, parameterValues, independentValues)
+            else:
+                fn = getattr(self, self.normalization)
+                logY = scipy.log(fn(X, exp(logY), parameterValues, \
+                                    independentValues))
+            if profiler is not None:
+                profiler.Add(self.Yname + "/LogY/normalization", \
+                             Profiling.clock()-t2)
+        return logY
+
     def ScaleX(self, X, parameterValues, independentValues):
         """
         Rescales X according to scaling form
@@ -103,16 +243,16 @@ class ScalingTheory:
         # Set values of parameters, independent variables, and X vector
         # Warning: local variables in subroutine must be named
         # 'parameterValues', 'independentValues', and 'X'
-        exec(self.parameterNames + " = parameterValues")
-        exec(self.independentNames + " = independentValues")
+        exec(self.Code(self.parameterNames + " = parameterValues"))
+        exec(self.Code(self.independentNames + " = independentValues"))
         if self.heldParameterBool:
             for par, val in self.heldParameterList:
-                exec(par + " = " + str(val))
-        exec(self.Xname + " = X")
+                exec(self.Code(par + " = " + str(val)))
+        exec(self.Code(self.Xname + " = X"))
         #YJC: added scalingW here too
         if self.scalingW is not None:
-            exec(self.WscaledName + '=' +self.scalingW)
-        exec("XScale = " + self.scalingX)
+            exec(self.Code(self.WscaledName + '=' +self.scalingW))
+        exec(self.Code("XScale = " + self.scalingX))
         return XScale
 
     def ScaleY(self, X, Y, parameterValues, independentValues):
@@ -122,19 +262,19 @@ class ScalingTheory:
         # Set values of parameters, independent variables, and X vector
         # Warning: local variables in subroutine must be named
         # 'parameterValues', 'independentValues', and 'X'
-        exec(self.parameterNames + " = parameterValues")
-        exec(self.independentNames + " = independentValues")
+        exec(self.Code(self.parameterNames + " = parameterValues"))
+        exec(self.Code(self.independentNames + " = independentValues"))
         if self.heldParameterBool:
             for par, val in self.heldParameterList:
-                exec(par + " = " + str(val))
-        exec(self.Xname + " = X")
+                exec(self.Code(par + " = " + str(val)))
+        exec(self.Code(self.Xname + " = X"))
         #YJC: added scalingW here too
         if self.scalingW is not None:
-            exec(self.WscaledName + '=' +self.scalingW)
+            exec(self.Code(self.WscaledName + '=' +self.scalingW))
         if self.XscaledName:
-            exec(self.XscaledName + "="+self.scalingX)
-        exec(self.Yname + " = Y")
-        exec("YScale = " + self.scalingY)
+            exec(self.Code(self.XscaledName + "="+self.scalingX))
+        exec(self.Code(self.Yname + " = Y"))
+        exec(self.Code("YScale = " + self.scalingY))
         return YScale
 
     def reduceParameters(self,pNames,pValues,heldParams):
@@ -184,12 +324,29 @@ class ScalingTheory:
         """
         Must guess at bin sizes for first and last bins
         """
-        norm = Y[0]*(X[1]-X[0])
-        norm += sum(Y[1:-1] * (X[2:]-X[:-2])/2.0)
+        # Sums run over the last axis, so that a batch of theory curves
+        # (one row per parameter vector) is normalized row by row
+        norm = Y[...,0]*(X[1]-X[0])
+        norm += scipy.sum(Y[...,1:-1] * (X[2:]-X[:-2])/2.0, axis=-1)
         # GF: Why not this below?
         #norm += sum(Y[1:-2] * (X[2:-1]-X[:-3])/2.0)
-        norm += Y[-1]*(X[-1]-X[-2])
-        return Y/norm
+        norm += Y[...,-1]*(X[-1]-X[-2])
+        return Y/scipy.expand_dims(norm, -1)
+    
+    def BasicWeights(self, X):
+        """
+        Bin widths of NormBasic
+        """
+        return scipy.concatenate(([X[1]-X[0]], (X[2:]-X[:-2])/2.0, \
+                                  [X[-1]-X[-2]]))
+
+    def LogNormBasic(self, X, logY, parameterValues, independentValues):
+        """
+        NormBasic of log(Y), with a log-sum-exp
+        """
+        logNorm = scipy.special.logsumexp(logY + scipy.log(self.BasicWeights(X)), \
+                                          axis=-1)
+        return logY - scipy.expand_dims(logNorm, -1)
     
     def NormIntegerSum(self, X, Y, parameterValues, independentValues, \
                 xStart=1., xEnd=1024.):
@@ -198,7 +355,8 @@ class ScalingTheory:
         up to xEnd
         """
         x = scipy.arange(xStart, xEnd)
-        return Y/sum(self.Y(x, parameterValues, independentValues))
+        norm = scipy.sum(self.Y(x, parameterValues, independentValues), axis=-1)
+        return Y/scipy.expand_dims(norm, -1)
         
     def NormLog(self,X,Y,parameterValues, independentValues):
         """
@@ -209,7 +367,17 @@ class ScalingTheory:
         lgX = scipy.log10(X)
         D = scipy.around(lgX[1] - lgX[0],2)
         bins = 10**(lgX+D/2.) - 10**(lgX-D/2.)
-        return Y/sum(Y*bins)
+        return Y/scipy.expand_dims(scipy.sum(Y*bins, axis=-1), -1)
+
+    def LogNormLog(self, X, logY, parameterValues, independentValues):
+        """
+        NormLog of log(Y), with a log-sum-exp
+        """
+        lgX = scipy.log10(X)
+        D = scipy.around(lgX[1] - lgX[0],2)
+        bins = 10**(lgX+D/2.) - 10**(lgX-D/2.)
+        logNorm = scipy.special.logsumexp(logY + scipy.log(bins), axis=-1)
+        return logY - scipy.expand_dims(logNorm, -1)
 
 class Data:
     """
@@ -232,6 +400,9 @@ class Data:
         self.fileNames = {}
         self.defaultFractionalError = {}
         self.initialSkip = {}
+        # Incremented each time a curve is installed or removed, so that
+        # the Models can tell which of their cached curves are stale
+        self.revision = {}
         
     def InstallCurve(self, independent, fileName, defaultFractionalError = 0.1,\
                      pointSymbol="o", pointColor="b", \
@@ -251,31 +422,67 @@ class Data:
             print "Warning: the independent variable is not a tuple"
             independent = tuple(independent)
         #
-        self.experiments.append(independent)
-        self.fileNames[independent] = fileName
-        self.initialSkip[independent] = initialSkip
-        self.pointType[independent] = pointColor + pointSymbol
-        self.defaultFractionalError[independent] = defaultFractionalError
+        # The curve is registered only once its file is read
         try:
             infile = open(fileName, 'r')
             lines = infile.readlines()
             infile.close()
-            success = 1
-            numbers = [line.split() for line in lines]
-            self.X[independent] = scipy.array( \
-                        [float(line[xCol]) for line in numbers])
-            self.Y[independent] = scipy.array( \
-                        [float(line[yCol]) for line in numbers])
-            if not errorCol:
-                self.errorBar[independent] =  \
-                        scipy.array([float(line[errorCol])*factorError for line in numbers])
-            else:
-                self.errorBar[independent] = \
-                    self.Y[independent] * defaultFractionalError
         except IOError:
             print "File %s not found"%fileName
-            success = 0
-        return success
+            return 0
+        numbers = [line.split() for line in lines]
+        X = scipy.array([float(line[xCol]) for line in numbers])
+        Y = scipy.array([float(line[yCol]) for line in numbers])
+        if not errorCol:
+            errorBar = scipy.array([float(line[errorCol])*factorError \
+                                    for line in numbers])
+        else:
+            errorBar = Y * defaultFractionalError
+        if independent not in self.experiments:
+            self.experiments.append(independent)
+        self.revision[independent] = self.revision.get(independent, 0) + 1
+        self.fileNames[independent] = fileName
+        self.initialSkip[independent] = initialSkip
+        self.pointType[independent] = pointColor + pointSymbol
+        self.defaultFractionalError[independent] = defaultFractionalError
+        self.X[independent] = X
+        self.Y[independent] = Y
+        self.errorBar[independent] = errorBar
+        return 1
+
+    def InstallArrays(self, independent, X, Y, errorBar, \
+                      pointSymbol="o", pointColor="b", initialSkip = 0, \
+                      fileName = None):
+        """
+        Installs a curve from arrays already in memory
+        (synthetic data, or curves binned on the fly)
+        """
+        independent = tuple(independent)
+        if independent not in self.experiments:
+            self.experiments.append(independent)
+        self.revision[independent] = self.revision.get(independent, 0) + 1
+        self.fileNames[independent] = fileName
+        self.initialSkip[independent] = initialSkip
+        self.pointType[independent] = pointColor + pointSymbol
+        self.defaultFractionalError[independent] = None
+        self.X[independent] = scipy.asarray(X, dtype=float)
+        self.Y[independent] = scipy.asarray(Y, dtype=float)
+        self.errorBar[independent] = scipy.asarray(errorBar, dtype=float)
+
+    def RemoveCurve(self, independent):
+        """
+        Removes the curve of independent; returns False if there is none
+        """
+        independent = tuple(independent)
+        if independent not in self.experiments:
+            return False
+        self.experiments.remove(independent)
+        for curves in [self.X, self.Y, self.errorBar, self.pointType, \
+                       self.fileNames, self.defaultFractionalError, \
+                       self.initialSkip]:
+            curves.pop(independent, None)
+        self.revision[independent] = self.revision.get(independent, 0) + 1
+        return True
 
 class Model:
     """
@@ -283,45 +490,309 @@ class Model:
     calculate the residuals (the difference between theory and data)
     and the cost.
     """
-    def __init__(self, theory, data, name, sorting):
+    def __init__(self, theory, data, name, sorting, memoryBudget = 2**26):
         self.theory = theory
         self.data = data
         self.name = name
         self.sorting = sorting
+        # Bytes of temporaries allowed when evaluating a batch of
+        # parameter vectors (see BatchResidual)
+        self.memoryBudget = memoryBudget
+        self.profiler = None
+        # Per curve: (revision, X, Y, errorBar) after initialSkip, and
+        # (revision, residuals) at the parameters of cachedResidualKey,
+        # revision being given by CurveRevision; only the curves
+        # installed, removed or changed since are recomputed
+        self.curveCache = {}
+        self.cachedResidualKey = None
+        self.cachedResiduals = {}
+        # (parameter names, values, covariance) of the last BestFit
+        self.lastFit = None
+        # If True, Residual raises NonFiniteResidual at the first curve
+        # with non-finite residuals (set during the fits, see Optimizers)
+        self.guarded = False
+        # 'linear': residuals (Y_theory - Y)/errorBar; 'log': residuals
+        # (log Y_theory - log Y)/(errorBar/Y), on the points with Y > 0
+        # (see FitCurve and ScalingTheory.LogY)
+        self.residualMode = 'linear'
+
+    def EnableProfiling(self, profiler=None):
+        """
+        Switch on counters and timers for this model (see Profiling.py);
+        a profiler may be shared between several models
+        """
+        if profiler is None:
+            profiler = Profiling.Profiler()
+        self.profiler = profiler
+        self.theory.profiler = profiler
+        return profiler
+
+    def DisableProfiling(self):
+        self.profiler = None
+        self.theory.profiler = None
+
+    def CurveRevision(self, independentValues):
+        """
+        Identifies the state of a curve for the caches: the Data it
+        belongs to (so that assigning model.data invalidates them), its
+        revision and its initialSkip
+        """
+        data = self.data
+        return (data, data.revision.get(independentValues), \
+                data.initialSkip.get(independentValues))
+
+    def GetCurve(self, independentValues):
+        """
+        X, Y and errorBar of a curve, without the initialSkip points
+        """
+        revision = self.CurveRevision(independentValues)
+        cached = self.curveCache.get(independentValues)
+        if cached is None or cached[0] != revision:
+            initialSkip = self.data.initialSkip[independentValues]
+            cached = (revision, \
+                      self.data.X[independentValues][initialSkip:], \
+                      self.data.Y[independentValues][initialSkip:], \
+                      self.data.errorBar[independentValues][initialSkip:])
+            self.curveCache[independentValues] = cached
+        return cached[1:]
+
+    def FitCurve(self, independentValues):
+        """
+        X, Y and errorBar of a curve as fitted: those of GetCurve, or in
+        'log' residualMode the points with Y > 0, with log(Y) and the
+        propagated error bars errorBar/Y
+        """
+        if self.residualMode == 'linear':
+            return self.GetCurve(independentValues)
+        if self.residualMode != 'log':
+            raise ValueError("unknown residualMode %r" % (self.residualMode,))
+        revision = self.CurveRevision(independentValues)
+        key = ('log', independentValues)
+        cached = self.curveCache.get(key)
+        if cached is None or cached[0] != revision:
+            X, Y, errorBar = self.GetCurve(independentValues)
+            positive = Y > 0
+            cached = (revision, X[positive], scipy.log(Y[positive]), \
+                      errorBar[positive]/Y[positive])
+            self.curveCache[key] = cached
+        return cached[1:]
+
+    def CurveResidual(self, X, Y, errorBar, parameterValues, \
+                      independentValues):
+        """
+        Residuals of a curve given by FitCurve
+        """
+        if self.residualMode == 'log':
+            return (self.theory.LogY(X, parameterValues, independentValues) \
+                    - Y)/errorBar
+        return (self.theory.Y(X, parameterValues, independentValues) - Y) \
+               / errorBar
+
+    def ResidualKey(self, parameterValues):
+        """
+        Identifies the full set of parameter values, held ones included,
+        and the theory they are evaluated with
+        """
+        theory = self.theory
+        held = theory.heldParameterBool and theory.heldParameterList or None
+        return (theory.Ytheory, theory.independentNames, \
+                theory.normalization, theory.parameterNames, repr(held), \
+                self.residualMode, theory.logSpace, \
+                tuple(scipy.ravel(parameterValues)))
         
     def Residual(self, parameterValues, dictResidual=False):
         """
         Calculate the weighted residuals,
         with the weights = 1 / errorbar
+        If parameterValues is a (n_vectors, n_params) array, the residuals
+        of all the vectors are returned as rows (see BatchResidual)
         """
+        if scipy.ndim(parameterValues) == 2:
+            return self.BatchResidual(parameterValues, dictResidual)
         if dictResidual:
             residuals = {}
         else:
             residuals = scipy.array([])
+        profiler = self.profiler
+        if profiler is not None:
+            tStart = Profiling.clock()
+        key = self.ResidualKey(parameterValues)
+        if key != self.cachedResidualKey:
+            self.cachedResidualKey = key
+            self.cachedResiduals = {}
             
         for independentValues in self.data.experiments:
-            initialSkip = self.data.initialSkip[independentValues]
-            X = self.data.X[independentValues][initialSkip:]
-            Y = self.data.Y[independentValues][initialSkip:]
-            errorBar = self.data.errorBar[independentValues][initialSkip:]
-            Ytheory = self.theory.Y(X, parameterValues, independentValues)
-            # XXX Likely a better way to merge scipy arrays into big one
-            # Yes: there is
-            res = (Ytheory-Y)/errorBar
+            revision = self.CurveRevision(independentValues)
+            cached = self.cachedResiduals.get(independentValues)
+            if cached is not None and cached[0] == revision:
+                # Unchanged curve at the same parameters, e.g. the first
+                # evaluation of a refit after adding a curve
+                res = cached[1]
+                if dictResidual:
+                    residuals[independentValues] = res
+                else:
+                    residuals = scipy.concatenate((residuals,res))
+                continue
+            if profiler is not None:
+                t0 = Profiling.clock()
+            X, Y, errorBar = self.FitCurve(independentValues)
+            res = self.CurveResidual(X, Y, errorBar, parameterValues, \
+                                     independentValues)
+            if self.guarded and not scipy.isfinite(res).all():
+                raise NonFiniteResidual(self.name, independentValues)
+            self.cachedResiduals[independentValues] = (revision, res)
             if dictResidual:
                 residuals[independentValues] = res
             else:
                 residuals = scipy.concatenate((residuals,res))
+            if profiler is not None:
+                profiler.Add(Profiling.CurveKey(self.name, \
+                                self.theory.independentNames, independentValues), \
+                             Profiling.clock()-t0)
+        if profiler is not None:
+            profiler.Add(self.name + "/Residual", Profiling.clock()-tStart)
         return residuals
         
-    def Cost(self, parameterValues=None):
+    def Cost(self, parameterValues=None, chunked=False):
         """
-        Sum of the squares of the residuals
+        Sum of the squares of the residuals; if chunked, the residuals
+        are summed curve by curve and never held together (nor cached)
         """
         if parameterValues is None:
             parameterValues = self.theory.initialParameterValues
+        if scipy.ndim(parameterValues) == 2:
+            return self.BatchCost(parameterValues)
+        if chunked:
+            cost = 0.
+            for independentValues, res in \
+                    self.CurveResiduals([parameterValues]):
+                cost += scipy.sum(res*res)
+            return cost
         residuals = self.Residual(parameterValues)
         return sum(residuals*residuals)
+
+    def CurveResiduals(self, parameterArray):
+        """
+        Chunked mode of Residual: generator over the curves, yielding
+        (independentValues, residuals) with residuals of shape
+        (n_vectors, nPointsInCurve) for the rows of parameterArray.
+        Only one curve is in memory at a time, so that the data may be
+        larger than memory (see PackedData.py)
+        """
+        parameterArray = scipy.atleast_2d(scipy.asarray(parameterArray, \
+                                                        dtype=float))
+        columns = scipy.transpose(parameterArray)[:, :, scipy.newaxis]
+        for independentValues in self.data.experiments:
+            X, Y, errorBar = self.FitCurve(independentValues)
+            res = self.CurveResidual(X, Y, errorBar, columns, \
+                                     independentValues)
+            yield independentValues, \
+                  res.reshape((-1, len(X))) * scipy.ones((len(parameterArray), 1))
+
+    def NormalEquations(self, parameterValues, relativeStep=1.49012e-08, \
+                        upper=None):
+        """
+        J^T J, J^T r and the cost at parameterValues, accumulated curve
+        by curve (see CurveResiduals). The Jacobian is a forward
+        difference (backward where it would cross upper), the steps
+        relative as in leastsq: each curve is evaluated once for the n+1
+        parameter vectors
+        """
+        p = scipy.asarray(parameterValues, dtype=float)
+        n = len(p)
+        steps = relativeStep*abs(p)
+        steps[steps == 0] = relativeStep
+        if upper is not None:
+            steps = scipy.where(p + steps > upper, -steps, steps)
+        parameterArray = scipy.concatenate(([p], p + scipy.diag(steps)))
+        JtJ = scipy.zeros((n, n))
+        Jtr = scipy.zeros(n)
+        cost = 0.
+        for independentValues, res in self.CurveResiduals(parameterArray):
+            r = res[0]
+            J = (res[1:] - r)/steps[:, scipy.newaxis]
+            JtJ += scipy.dot(J, scipy.transpose(J))
+            Jtr += scipy.dot(J, r)
+            cost += scipy.dot(r, r)
+        return JtJ, Jtr, cost
+
+    def BatchChunkSize(self, nPoints, memoryBudget=None):
+        """
+        Number of parameter vectors evaluated together so that
+        the (chunk, nPoints) float temporaries fit in memoryBudget bytes
+        """
+        if memoryBudget is None:
+            memoryBudget = self.memoryBudget
+        return max(1, int(memoryBudget // (8 * max(nPoints, 1))))
+
+    def BatchResiduals(self, parameterArray, memoryBudget=None):
+        """
+        Generator over the chunks of a (n_vectors, n_params) array:
+        yields (start, stop, {independentValues: residuals}) with
+        residual blocks of shape (stop-start, nPointsInCurve).
+        The parameters are passed to the theory as columns of shape
+        (chunk, 1), so that the theory strings broadcast against X
+        """
+        parameterArray = scipy.atleast_2d(scipy.asarray(parameterArray, \
+                                                        dtype=float))
+        nVectors = parameterArray.shape[0]
+        curves = []
+        for independentValues in self.data.experiments:
+            X, Y, errorBar = self.FitCurve(independentValues)
+            curves.append((independentValues, X, Y, errorBar))
+        nPoints = sum([len(X) for ind, X, Y, errorBar in curves])
+        chunk = self.BatchChunkSize(nPoints, memoryBudget)
+        for start in range(0, nVectors, chunk):
+            stop = min(start + chunk, nVectors)
+            columns = scipy.transpose(parameterArray[start:stop])
+            columns = columns[:, :, scipy.newaxis]
+            residuals = {}
+            for independentValues, X, Y, errorBar in curves:
+                res = self.CurveResidual(X, Y, errorBar, columns, \
+                                         independentValues)
+                residuals[independentValues] = \
+                    res.reshape((-1, len(X))) * scipy.ones((stop-start, 1))
+            yield start, stop, residuals
+
+    def BatchResidual(self, parameterArray, dictResidual=False, \
+                      memoryBudget=None):
+        """
+        Weighted residuals for each row of a (n_vectors, n_params) array,
+        returned as a (n_vectors, n_points) array with the curves in the
+        same order as Residual (or a dict of row blocks per curve)
+        """
+        parameterArray = scipy.atleast_2d(scipy.asarray(parameterArray, \
+                                                        dtype=float))
+        blocks = []
+        for start, stop, residuals in \
+                self.BatchResiduals(parameterArray, memoryBudget):
+            blocks.append(residuals)
+        if dictResidual:
+            out = {}
+            for independentValues in self.data.experiments:
+                out[independentValues] = scipy.concatenate( \
+                    [res[independentValues] for res in blocks], axis=0)
+            return out
+        if not self.data.experiments:
+            return scipy.zeros((parameterArray.shape[0], 0))
+        rows = [scipy.concatenate([res[independentValues] \
+                    for independentValues in self.data.experiments], axis=1) \
+                for res in blocks]
+        return scipy.concatenate(rows, axis=0)
+
+    def BatchCost(self, parameterArray, memoryBudget=None):
+        """
+        Cost for each row of a (n_vectors, n_params) array.
+        Only one chunk of residuals is held in memory at a time
+        """
+        parameterArray = scipy.atleast_2d(scipy.asarray(parameterArray, \
+                                                        dtype=float))
+        costs = scipy.zeros(parameterArray.shape[0])
+        for start, stop, residuals in \
+                self.BatchResiduals(parameterArray, memoryBudget):
+            for res in residuals.values():
+                costs[start:stop] += scipy.sum(res*res, axis=1)
+        return costs
     
     def SST(self, parameterValues=None):
         """
@@ -331,9 +802,7 @@ class Model:
         if parameterValues is None:
             parameterValues = self.theory.initialParameterValues
         for independentValues in self.data.experiments:
-            initialSkip = self.data.initialSkip[independentValues]
-            Y = self.data.Y[independentValues][initialSkip:]
-            errorBar = self.data.errorBar[independentValues][initialSkip:]
+            X, Y, errorBar = self.FitCurve(independentValues)
             sst_partial = (Y-scipy.mean(Y))/errorBar
             sst += sum(sst_partial*sst_partial)
         return sst
@@ -393,12 +862,25 @@ class Model:
         return tuple(out)
         
     def PlotFunctions(self, parameterValues=None, plotCollapse = False, 
-                fontSizeLabels = 18, fontSizeLegend=12, pylabLegendLoc=(0.,0.)):
+                fontSizeLabels = 18, fontSizeLegend=12, pylabLegendLoc=(0.,0.),
+                axes = None, decimate = True):
+        """
+        Plots data and theory (or their collapse) in the current pylab
+        figure, or in axes (a matplotlib Axes) if given, e.g. for headless
+        rendering (see Rendering.py)
+        With decimate, long curves are reduced to about one point per
+        pixel column, keeping their envelope (see Utils.decimate_indices)
+        """
         if parameterValues is None:
             parameterValues = self.theory.initialParameterValues
-        # XXX Having problems with pylab.ioff()
-        pylab.ioff()
-        pylab.clf()
+        if axes is None:
+            import pylab
+            # XXX Having problems with pylab.ioff()
+            pylab.ioff()
+            pylab.clf()
+            ax = pylab.gca()
+        else:
+            ax = axes
         ax0 = [1.e99,0,1.e99,0]
         if self.data.linlog == 'log':
             minY = 1.e99
@@ -419,6 +901,7 @@ class Model:
         else:
             # set sorted 
             data_experiments = sorted(self.data.experiments)
+        nBins = int(ax.bbox.width)
             
         for independentValues in data_experiments:
             X = self.data.X[independentValues]
@@ -426,6 +909,13 @@ class Model:
             Ytheory = self.theory.Y(X, parameterValues, independentValues)
             pointType = self.data.pointType[independentValues]
             errorBar = self.data.errorBar[independentValues]
+            if decimate:
+                # The theory is computed on all the points (normalizations
+                # depend on them), but only the kept ones are drawn
+                keep = Utils.decimate_indices(X, Y, errorBar, errorBar, \
+                                              nBins, self.data.linlog)
+                X, Y, Ytheory, errorBar = \
+                        X[keep], Y[keep], Ytheory[keep], errorBar[keep]
             if plotCollapse:
                 # Scaled error bars and Y need not-rescaled X
                 errorBar = self.theory.ScaleY(X, errorBar, parameterValues, \
@@ -445,16 +935,15 @@ class Model:
                 
             # Prepare the labels
             lb = self.getLabel(self.theory.independentNames, independentValues)
-            pylab.rcParams.update({'legend.fontsize':fontSizeLabels})
             #####################
             if self.data.linlog == 'log' or self.data.linlog == 'lin':
                 if self.data.linlog == 'log':
-                    plot_fn = getattr(pylab,'loglog')
+                    plot_fn = getattr(ax,'loglog')
                 elif self.data.linlog == 'lin':
-                    plot_fn = getattr(pylab,'plot')
+                    plot_fn = getattr(ax,'plot')
                 # Plot first data with their error
                 plot_fn(X,Y,pointType[1])
-                pylab.errorbar(X,Y, yerr=y_error, fmt=pointType,label=lb)
+                ax.errorbar(X,Y, yerr=y_error, fmt=pointType,label=lb)
                 axis_dep = self.getAxis(X,Y)
                 # Get the current values of the axis
                 # YJC: some values of binned data are negative, modified getAxis to check, and return 0 if negative values encountered 
@@ -469,52 +958,123 @@ class Model:
                 print "Format " + self.data.linlog + \
                         " not supported yet in PlotFits"
                 
-        pylab.axis(tuple(ax0))
+        ax.axis(tuple(ax0))
         #pylab.legend(loc=pylabLegendLoc, col=2)
-        pylab.legend(loc=pylabLegendLoc)
+        ax.legend(loc=pylabLegendLoc, prop={'size': fontSizeLabels})
         if plotCollapse:
-            pylab.xlabel(self.theory.scalingXTeX, fontsize=fontSizeLabels)
-            pylab.ylabel(self.theory.scalingYTeX, fontsize=fontSizeLabels)
-            pylab.title(self.theory.scalingTitle)
+            ax.set_xlabel(self.theory.scalingXTeX, fontsize=fontSizeLabels)
+            ax.set_ylabel(self.theory.scalingYTeX, fontsize=fontSizeLabels)
+            ax.set_title(self.theory.scalingTitle)
         else:
-            pylab.xlabel(self.theory.Xname, fontsize=fontSizeLabels)
-            pylab.ylabel(self.theory.Yname, fontsize=fontSizeLabels)
-            pylab.title(self.theory.title, fontsize=fontSizeLabels)
-        # XXX Turn on if ioff used pylab.ion()
-        pylab.ion()
-        pylab.show()
+            ax.set_xlabel(self.theory.Xname, fontsize=fontSizeLabels)
+            ax.set_ylabel(self.theory.Yname, fontsize=fontSizeLabels)
+            ax.set_title(self.theory.title, fontsize=fontSizeLabels)
+        if axes is None:
+            # XXX Turn on if ioff used pylab.ion()
+            pylab.ion()
+            pylab.show()
         
     def PlotResiduals(self, parameterValues=None, \
-                      fontSizeLabels = 18, pylabLegendLoc=(0.2,0.)):
+                      fontSizeLabels = 18, pylabLegendLoc=(0.2,0.), \
+                      axes = None, decimate = True):
         if parameterValues is None:
             parameterValues = self.theory.initialParameterValues
-        pylab.ioff()
-        pylab.clf()
+        if axes is None:
+            import pylab
+            pylab.ioff()
+            pylab.clf()
+            ax = pylab.gca()
+        else:
+            ax = axes
         residuals = self.Residual(parameterValues, dictResidual=True)
         x0 = 0
         for independentValues in sorted(residuals):
             res = residuals[independentValues]
             xStep = len(res)
-            x = range(x0,x0+xStep)
+            x = scipy.arange(x0,x0+xStep)
             x0 += xStep
+            if decimate:
+                keep = Utils.decimate_indices(x, res, nBins=int(ax.bbox.width), \
+                                              linlog='lin')
+                x, res = x[keep], res[keep]
             pointType = self.data.pointType[independentValues]
             lb = self.getLabel(self.theory.independentNames, independentValues)
-            pylab.plot(x,res,pointType, label=lb)
-        pylab.ylabel("Weighted residuals")
-        pylab.axhline(y=0,color='k')
-        pylab.legend(loc=pylabLegendLoc)
-        pylab.ion()
-        pylab.show()
+            ax.plot(x,res,pointType, label=lb)
+        ax.set_ylabel("Weighted residuals")
+        ax.axhline(y=0,color='k')
+        ax.legend(loc=pylabLegendLoc)
+        if axes is None:
+            pylab.ion()
+            pylab.show()
         
-    def BestFit(self,initialParameterValues = None):
+    def BestFit(self,initialParameterValues = None, chunked = False, \
+                parameterization = None, method = 'leastsq', **options):
+        """
+        Fit by the optimizer method ('leastsq', 'trf', 'dogbox', 'lm',
+        'geodesic', see Optimizers.py), options (bounds, callback, ...)
+        being passed to Optimizers.Fit. If chunked, a Levenberg-Marquardt
+        fit on the normal equations accumulated curve by curve (see
+        NormalEquationsFit), for data larger than memory. With a
+        parameterization, e.g. {'Ixh': 'log'}, the fit runs on rescaled
+        log, bounded or linear variables (see Parameterization.py).
+        These two take bounds but no other method nor option.
+        Returns a FitResult, indexed as the tuple of leastsq;
+        out[2]['cost'] is the final cost
+        """
         if initialParameterValues is None:
             initialParameterValues = self.theory.initialParameterValues
-        out = scipy.optimize.minpack.leastsq(self.Residual, \
-                initialParameterValues, full_output=1, ftol=1.e-16) 
+        if self.profiler is not None:
+            calls = self.profiler.Calls(self.name + "/Residual")
+            start = Profiling.clock()
+        import Optimizers
+        if chunked:
+            Optimizers.CheckOwnFit('chunked', method, options)
+            out = Optimizers.FromTuple(NormalEquationsFit(self, \
+                    initialParameterValues, bounds=options.get('bounds')), \
+                    'chunked')
+        elif parameterization is not None:
+            Optimizers.CheckOwnFit('reparameterized', method, options)
+            import Parameterization
+            out = Optimizers.FromTuple(Parameterization.ReparameterizedFit( \
+                    self, initialParameterValues, parameterization, \
+                    bounds=options.get('bounds')), 'parameterization')
+        else:
+            out = Optimizers.Fit(self, initialParameterValues, method, \
+                                 **options)
+        if self.profiler is not None:
+            self.profiler.RecordFit(self.name, Profiling.clock()-start, \
+                    self.profiler.Calls(self.name + "/Residual")-calls, \
+                    nfev=out[2].get('nfev'), njev=out[2].get('njev'), \
+                    cost=out[2]['cost'])
+        self.lastFit = (list(self.theory.parameterNameList), out[0], out[1])
+        if not chunked:
+            # The residuals cached at the optimum, rather than at the last
+            # point tried, so that a refit only computes the new curves
+            self.Residual(out[0])
         return out
+
+    def Refit(self, verbose = True):
+        """
+        Fits again after curves were installed in or removed from the
+        data, starting from the previous best fit (see ParameterShifts)
+        """
+        return RefitModel(self, verbose)
+
+    def MultiresolutionFit(self, initialParameterValues = None, **options):
+        """
+        Coarse-to-fine BestFit (see Multiresolution.py)
+        """
+        import Multiresolution
+        return Multiresolution.MultiresolutionFit(self, \
+                                initialParameterValues, **options)
     
     def PlotBestFit(self, initialParameterValues = None, \
-                    figFit = 1, figCollapse=2, fontSizeLabels=18, heldParams = None):
+                    figFit = 1, figCollapse=2, fontSizeLabels=18, heldParams = None, \
+                    outputDirectory = None, formats = ('png',)):
+        """
+        If outputDirectory is given, the fit, collapse and residual figures
+        are rendered there as files instead of pylab windows
+        """
         
         #YJC: added abilitiy to set fixedParams for this, and also modified output to match what is done in composite theory
 
@@ -558,6 +1118,12 @@ class Model:
             print name + "= %2.4f +/- %2.4f" %(val, error)
         print "======================================================"
 
+        if outputDirectory is not None:
+            import Rendering
+            Rendering.RenderModels([(self, optimizedParameterValues, None)], \
+                                   outputDirectory, formats)
+            return optimizedParameterValues
+        import pylab
         pylab.figure(figFit)
         self.PlotFunctions(optimizedParameterValues)
         pylab.figure(figCollapse)
@@ -580,12 +1146,15 @@ class CompositeModel:
             self.parameterNames = ""
             self.initialParameterValues = []
             self.parameterNameList = []
+            self.parameterBounds = {}
             
     def __init__(self, name):
         self.Models = {}
         self.theory = self.CompositeTheory()
         self.name = name
         self.heldParamsPass = False
+        self.profiler = None
+        self.lastFit = None
         
     def InstallModel(self,modelName, model):
         self.Models[modelName] = model
@@ -609,6 +1178,14 @@ class CompositeModel:
                      + " CompositeTheory.\n Ignoring new value."
                     
         th.parameterNames = ",".join(th.parameterNameList)
+        # Shared parameters: the intersection of the bounds of the theories
+        for param, (lower, upper) in model.theory.parameterBounds.items():
+            oldLower, oldUpper = th.parameterBounds.get(param, (None, None))
+            if oldLower is not None and (lower is None or oldLower > lower):
+                lower = oldLower
+            if oldUpper is not None and (upper is None or oldUpper < upper):
+                upper = oldUpper
+            th.parameterBounds[param] = (lower, upper)
         #th.initialParameterValues = tuple(th.initialParameterValues)
         #
         # Update list of parameter names and values for all attached models
@@ -625,6 +1202,8 @@ class CompositeModel:
         th.initialParameterValues0 = copy.copy(th.initialParameterValues)
         th.parameterNames0 = copy.copy(th.parameterNames)
         th.parameterNameList0 = copy.copy(th.parameterNameList)
+        if self.profiler is not None:
+            model.EnableProfiling(self.profiler)
         
     def reduceParameters(self,pNames,pValues,heldParams):
         list_params = pNames.split(",")
@@ -668,19 +1247,87 @@ class CompositeModel:
                     currentModel.theory.heldParameterBool = False
                     currentModel.theory.heldParameterList = None
             
+    def EnableProfiling(self, profiler=None):
+        """
+        Switch on counters and timers for all the installed models,
+        sharing one profiler (see Profiling.py)
+        """
+        if profiler is None:
+            profiler = Profiling.Profiler()
+        self.profiler = profiler
+        for model in self.Models.values():
+            model.EnableProfiling(profiler)
+        return profiler
+
+    def DisableProfiling(self):
+        self.profiler = None
+        for model in self.Models.values():
+            model.DisableProfiling()
+
     def Residual(self, parameterValues):
+        if scipy.ndim(parameterValues) == 2:
+            return self.BatchResidual(parameterValues)
+        profiler = self.profiler
+        if profiler is not None:
+            tStart = Profiling.clock()
         residuals = scipy.array([])
         for model in self.Models.values():
             modelResidual = model.Residual(parameterValues)
             residuals = scipy.concatenate((residuals,modelResidual))
+        if profiler is not None:
+            profiler.Add(self.name + "/CompositeResidual", Profiling.clock()-tStart)
         return residuals
+
+    def BatchResidual(self, parameterArray, memoryBudget=None):
+        """
+        Residual rows of all the models for a (n_vectors, n_params) array
+        """
+        parameterArray = scipy.atleast_2d(scipy.asarray(parameterArray, \
+                                                        dtype=float))
+        blocks = [scipy.zeros((parameterArray.shape[0], 0))]
+        for model in self.Models.values():
+            blocks.append(model.BatchResidual(parameterArray, \
+                                              memoryBudget=memoryBudget))
+        return scipy.concatenate(blocks, axis=1)
+
+    def BatchCost(self, parameterArray, memoryBudget=None):
+        """
+        Cost for each row of a (n_vectors, n_params) array
+        """
+        parameterArray = scipy.atleast_2d(scipy.asarray(parameterArray, \
+                                                        dtype=float))
+        costs = scipy.zeros(parameterArray.shape[0])
+        for model in self.Models.values():
+            costs += model.BatchCost(parameterArray, memoryBudget)
+        return costs
         
-    def Cost(self, parameterValues=None):
+    def Cost(self, parameterValues=None, chunked=False):
         if parameterValues is None:
             parameterValues = self.theory.initialParameterValues
+        if scipy.ndim(parameterValues) == 2:
+            return self.BatchCost(parameterValues)
+        if chunked:
+            return sum([model.Cost(parameterValues, chunked=True) \
+                        for model in self.Models.values()])
         residuals = self.Residual(parameterValues)
         return sum(residuals*residuals)
         #return sum(scipy.absolute(residuals))
+
+    def NormalEquations(self, parameterValues, relativeStep=1.49012e-08, \
+                        upper=None):
+        """
+        J^T J, J^T r and cost, summed over the models (see
+        Model.NormalEquations)
+        """
+        n = len(parameterValues)
+        JtJ, Jtr, cost = scipy.zeros((n, n)), scipy.zeros(n), 0.
+        for model in self.Models.values():
+            modelJtJ, modelJtr, modelCost = \
+                model.NormalEquations(parameterValues, relativeStep, upper)
+            JtJ += modelJtJ
+            Jtr += modelJtr
+            cost += modelCost
+        return JtJ, Jtr, cost
     
     def SST(self, parameterValues=None):
         sst = 0.
@@ -701,6 +1348,7 @@ class CompositeModel:
                  fontSizeLabels = 18, pylabLegendLoc=(0.2,0.), figNumStart=1):
         if parameterValues is None:
             parameterValues = self.theory.initialParameterValues
+        import pylab
         figNum = figNumStart-1
         for model in self.Models.values():
             figNum+=1
@@ -713,6 +1361,7 @@ class CompositeModel:
                  fontSizeLabels = 18, pylabLegendLoc=(0.2,0.), figNumStart=1):
         if parameterValues is None:
             parameterValues = self.theory.initialParameterValues
+        import pylab
         figNum = figNumStart-1
         for model in self.Models.values():
             figNum+=1
@@ -721,15 +1370,63 @@ class CompositeModel:
                                 pylabLegendLoc, plotCollapse = True)
             pylab.figure(figNum)
             
-    def BestFit(self,initialParameterValues=None):
+    def BestFit(self,initialParameterValues=None, chunked=False, \
+                parameterization=None, method='leastsq', **options):
         if initialParameterValues is None:
             initialParameterValues = self.theory.initialParameterValues
-        out = scipy.optimize.minpack.leastsq(self.Residual, \
-                initialParameterValues, full_output=1, ftol = 1e-16) 
+        if self.profiler is not None:
+            calls = self.profiler.Calls(self.name + "/CompositeResidual")
+            start = Profiling.clock()
+        import Optimizers
+        if chunked:
+            Optimizers.CheckOwnFit('chunked', method, options)
+            out = Optimizers.FromTuple(NormalEquationsFit(self, \
+                    initialParameterValues, bounds=options.get('bounds')), \
+                    'chunked')
+        elif parameterization is not None:
+            Optimizers.CheckOwnFit('reparameterized', method, options)
+            import Parameterization
+            out = Optimizers.FromTuple(Parameterization.ReparameterizedFit( \
+                    self, initialParameterValues, parameterization, \
+                    bounds=options.get('bounds')), 'parameterization')
+        else:
+            out = Optimizers.Fit(self, initialParameterValues, method, \
+                                 **options)
+        if self.profiler is not None:
+            self.profiler.RecordFit(self.name, Profiling.clock()-start, \
+                    self.profiler.Calls(self.name + "/CompositeResidual")-calls, \
+                    nfev=out[2].get('nfev'), njev=out[2].get('njev'), \
+                    cost=out[2]['cost'])
+        self.lastFit = (list(self.theory.parameterNameList), out[0], out[1])
+        if not chunked:
+            # The residuals cached at the optimum, rather than at the last
+            # point tried, so that a refit only computes the new curves
+            self.Residual(out[0])
         return out
+
+    def Refit(self, verbose = True):
+        """
+        Fits again after curves were installed in or removed from the
+        data of any model, starting from the previous best fit
+        """
+        return RefitModel(self, verbose)
+
+    def MultiresolutionFit(self, initialParameterValues = None, **options):
+        """
+        Coarse-to-fine BestFit of all the models (see Multiresolution.py)
+        """
+        import Multiresolution
+        return Multiresolution.MultiresolutionFit(self, \
+                                initialParameterValues, **options)
         
     def PlotBestFit(self, initialParameterValues=None, \
-                    figNumStart = 1, heldParams = None):
+                    figNumStart = 1, heldParams = None, \
+                    outputDirectory = None, formats = ('png',)):
+        """
+        Fits and plots data, collapse and residuals of each model.
+        If outputDirectory is given, the figures are rendered there
+        as files (one per format) instead of pylab windows
+        """
         # Unicode characters
         uniSymbol = {'tau': unichr(964), 'sigma_k': unichr(963)+"_k",\
                          'zeta': unichr(950)}
@@ -785,6 +1482,14 @@ class CompositeModel:
         #
         # Print plots
         #
+        if outputDirectory is not None:
+            # Headless: files written in parallel, no display needed
+            import Rendering
+            Rendering.RenderModels([(model, optimizedParameterValues, None) \
+                                    for model in self.Models.values()], \
+                                   outputDirectory, formats)
+            return out
+        import pylab
         figNum = figNumStart-1
         for model in self.Models.values():
             for FT in [False,True]:
@@ -799,3 +1504,113 @@ class CompositeModel:
             pylab.figure(figNum)
         #return optimizedParameterValues
         return out
+
+
+def ParameterShifts(names, oldValues, newValues, covariance = None):
+    """
+    List of (name, old value, new value, shift in units of the new one
+    sigma error, or None without covariance)
+    """
+    shifts = []
+    for n, name in enumerate(names):
+        old, new = oldValues[n], newValues[n]
+        sigma = None
+        if covariance is not None and covariance[n, n] > 0:
+            sigma = (new - old)/covariance[n, n]**0.5
+        shifts.append((name, old, new, sigma))
+    return shifts
+
+def RefitModel(model, verbose = True):
+    """
+    Warm-started BestFit of a Model or CompositeModel whose data changed:
+    the fit starts from model.lastFit if the free parameters are the same
+    (from the initial values otherwise), and only the residuals of the
+    new curves are computed at the starting point.
+    Returns the output of BestFit and the ParameterShifts
+    """
+    names = list(model.theory.parameterNameList)
+    previous = model.lastFit
+    if previous is not None and previous[0] == names:
+        start = previous[1]
+    else:
+        start = model.theory.initialParameterValues
+    out = model.BestFit(start)
+    shifts = ParameterShifts(names, start, out[0], out[1])
+    if verbose:
+        print "=== Refit of %s: parameter shifts ===" % model.name
+        for name, old, new, sigma in shifts:
+            if sigma is None:
+                print "%8s %10.4f -> %10.4f" % (name, old, new)
+            else:
+                print "%8s %10.4f -> %10.4f (%+.2f sigma)" % \
+                        (name, old, new, sigma)
+    return out, shifts
+
+def NormalEquationsFit(model, initialParameterValues, maxIterations = 200, \
+                       ftol = 1.e-12, xtol = 1.e-10, damping = 1.e-3, \
+                       bounds = None):
+    """
+    Levenberg-Marquardt on the normal equations of a Model or
+    CompositeModel (model.NormalEquations and model.Cost(chunked=True)),
+    so that no residual vector of the whole data is ever formed.
+    As in Optimizers.Fit, the bounds of the theory (updated by bounds)
+    are enforced, the steps being projected on them, and the steps to
+    non-finite costs are rejected.
+    Returns a tuple as leastsq with full_output: (p, covariance,
+    {'nfev', 'njev', 'cost', 'rejected'}, message, ier)
+    """
+    import Optimizers
+    lower, upper = Optimizers.Bounds(model, bounds)
+    p = Optimizers.Inside(initialParameterValues, lower, upper)
+    JtJ, Jtr, cost = model.NormalEquations(p, upper=upper)
+    if not scipy.isfinite(cost):
+        raise ValueError("cannot start the fit: non-finite cost")
+    nfev, njev = len(p) + 1, 1
+    rejected = 0
+    message, ier = "Maximum number of iterations reached", 5
+    for iteration in range(maxIterations):
+        scale = scipy.diag(JtJ).copy()
+        scale[scale == 0] = 1.
+        A = JtJ + damping*scipy.diag(scale)
+        # Parameters on a bound that the descent would cross are fixed,
+        # and the step is projected on the bounds (as in GeodesicFit)
+        active = ((p >= upper) & (Jtr < 0)) | ((p <= lower) & (Jtr > 0))
+        if active.any():
+            A[active, :] = 0.
+            A[:, active] = 0.
+            A[active, active] = 1.
+        try:
+            step = scipy.linalg.solve(A, scipy.where(active, 0., -Jtr))
+        except scipy.linalg.LinAlgError:
+            damping *= 10.
+            continue
+        step = scipy.clip(p + step, lower, upper) - p
+        newCost = model.Cost(p + step, chunked=True)
+        nfev += 1
+        if not scipy.isfinite(newCost):
+            rejected += 1
+        if newCost < cost:
+            p = p + step
+            converged = cost - newCost <= ftol*cost
+            cost = newCost
+            damping = max(damping/10., 1.e-12)
+            JtJ, Jtr, cost = model.NormalEquations(p, upper=upper)
+            nfev, njev = nfev + len(p) + 1, njev + 1
+            if converged:
+                message, ier = "Relative decrease of the cost below ftol", 1
+                break
+        else:
+            damping *= 10.
+        if scipy.sqrt(scipy.dot(step, step)) <= \
+                xtol*(scipy.sqrt(scipy.dot(p, p)) + xtol):
+            message, ier = "Relative step below xtol", 2
+            break
+        if damping > 1.e16:
+            message, ier = "No step decreases the cost", 4
+            break
+    try:
+        covariance = scipy.linalg.inv(JtJ)
+    except scipy.linalg.LinAlgError:
+        covariance = None
+    return p, covariance, {'nfev': nfev, 'njev': njev, 'cost': cost, \
+                           'rejected': rejected}, message, ier
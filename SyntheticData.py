@@ -0,0 +1,152 @@
+"""
+Synthetic .bnd data sets generated from a ScalingTheory with known
+parameter values, to benchmark and stress-test the fits.
+
+Each curve is log-binned as done by toBinDistributions.py (uniform bins
+in log10(X), centered on X) and the counts in each bin are drawn from a
+Poisson distribution, so the noise grows in the tails as in the
+simulations; empty bins are dropped. The files are named as the modules
+expect, e.g. A11_W=0016_k=0.001_System_Size=2048x1024_NonLinear.bnd
+
+Example:
+    names, values = Utils.get_independent(WS.A11_list)
+    SyntheticData.GenerateDataset(Registry.MakeTheory('A11'),
+                                  (1.2,0.38,0.85,3.,2.), values,
+                                  "synthetic/", "A11")
+or from the shell, for the theory of A11Module:
+    python SyntheticData.py A11 synthetic/ --list A11_list --events 1e8
+"""
+
+import os
+import sys
+import optparse
+import multiprocessing
+import scipy
+import Utils
+
+# Settings of the worker processes; set once by _InitWorker
+_workerSettings = None
+
+def _InitWorker(settings):
+    global _workerSettings
+    _workerSettings = settings
+
+def _WriteCurve(task):
+    n, independent = task
+    return WriteSyntheticCurve(independent, n, **_workerSettings)
+
+
+def SyntheticCurve(theory, parameterValues, independent, \
+                   nEvents = 1.e7, binsPerDecade = 10, maxDecades = 7, \
+                   randomState = None):
+    """
+    Returns X, Y, errorBar of a log-binned curve: nEvents events
+    distributed as the theory (taken as a density in X)
+    """
+    if randomState is None:
+        randomState = scipy.random.RandomState()
+    D = 1./binsPerDecade
+    lgX = scipy.arange(0., maxDecades + D/2., D)
+    X = 10**lgX
+    bins = 10**(lgX+D/2.) - 10**(lgX-D/2.)
+    Y = theory.Y(X, parameterValues, independent)
+    Y = scipy.where(scipy.isfinite(Y) & (Y > 0), Y, 0.)
+    expected = nEvents * Y * bins
+    counts = randomState.poisson(scipy.minimum(expected, 1.e18))
+    good = counts > 0
+    norm = nEvents * bins[good]
+    return X[good], counts[good]/norm, scipy.sqrt(counts[good])/norm
+
+def WriteBnd(fileName, X, Y, errorBar):
+    """
+    Three columns: X, Y and the error bar
+    """
+    outfile = open(fileName, 'w')
+    for x, y, e in zip(X, Y, errorBar):
+        outfile.write("%.10e %.10e %.10e\n" % (x, y, e))
+    outfile.close()
+
+def WriteSyntheticCurve(independent, n, theory, parameterValues, \
+                        dataDirectory, name, simulType, k_string, \
+                        seed, **curveOptions):
+    """
+    Generates and writes the n-th curve; the seed of each curve only
+    depends on n, so the data set does not depend on the number of workers
+    """
+    randomState = scipy.random.RandomState(seed + n)
+    X, Y, errorBar = SyntheticCurve(theory, parameterValues, independent, \
+                                    randomState=randomState, **curveOptions)
+    fileName = Utils.get_fileName(dataDirectory, name, independent, \
+                                  simulType, k_string)
+    WriteBnd(fileName, X, Y, errorBar)
+    return fileName
+
+def GenerateDataset(theory, parameterValues, independentValues, \
+                    dataDirectory, name, simulType = "NonLinear", \
+                    k_string = "_k=", seed = 0, processes = None, \
+                    nEvents = 1.e7, binsPerDecade = 10, maxDecades = 7):
+    """
+    Writes one .bnd file per (L,k,W) (or (L,k)) in independentValues,
+    in parallel over processes workers (all the cpus by default).
+    Returns the list of file names, in the order of independentValues
+    """
+    if dataDirectory and not dataDirectory.endswith(os.sep):
+        dataDirectory = dataDirectory + os.sep
+    if dataDirectory and not os.path.isdir(dataDirectory):
+        os.makedirs(dataDirectory)
+    settings = {'theory': theory, 'parameterValues': parameterValues, \
+                'dataDirectory': dataDirectory, 'name': name, \
+                'simulType': simulType, 'k_string': k_string, 'seed': seed, \
+                'nEvents': nEvents, 'binsPerDecade': binsPerDecade, \
+                'maxDecades': maxDecades}
+    tasks = list(enumerate(independentValues))
+    if processes == 1 or len(tasks) < 2:
+        return [WriteSyntheticCurve(independent, n, **settings) \
+                for n, independent in tasks]
+    nWorkers = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(nWorkers, _InitWorker, (settings,))
+    try:
+        fileNames = pool.map(_WriteCurve, tasks, \
+                             chunksize=max(1, len(tasks)//(8*nWorkers)))
+    finally:
+        pool.close()
+        pool.join()
+    return fileNames
+
+def main(argv):
+    parser = optparse.OptionParser( \
+        usage="python SyntheticData.py MODULE DIRECTORY [options]")
+    parser.add_option("-l", "--list", default="A11_list", \
+                      help="list of (L,k,W) in WindowScalingInfo")
+    parser.add_option("-p", "--parameters", \
+                      help="comma separated values (initial values by default)")
+    parser.add_option("-e", "--events", type="float", default=1.e7)
+    parser.add_option("-s", "--seed", type="int", default=0)
+    parser.add_option("-j", "--processes", type="int")
+    options, args = parser.parse_args(argv)
+    if len(args) != 2:
+        parser.error("MODULE and DIRECTORY are required")
+    moduleName, dataDirectory = args
+    import WindowScalingInfo as WS
+    import Registry
+    theory = Registry.MakeTheory(moduleName, WS)
+    parameterValues = theory.initialParameterValues
+    if options.parameters:
+        parameterValues = tuple([float(v) for v in \
+                                 options.parameters.split(",")])
+    names, values = Utils.get_independent(getattr(WS, options.list))
+    factory, fileName, usesW = Registry.GetEntry(moduleName)
+    if not usesW:
+        # One curve per (L,k)
+        values = sorted(set([independent[:2] for independent in values]))
+        theory.independentNames = "L, k"
+    fileNames = GenerateDataset(theory, parameterValues, values, \
+                                dataDirectory, fileName, \
+                                WS.simulType, WS.k_string, seed=options.seed, \
+                                processes=options.processes, \
+                                nEvents=options.events)
+    print "Written %d files in %s" % (len(fileNames), dataDirectory)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,5 +1,50 @@
+import os
+import re
 import scipy
 
+def independent_grid(MyList):
+    """
+    Expands a list in the short form of get_independent into a structured
+    array with fields 'L', 'k' and 'W' (or 'L' and 'k'), one row per
+    point, in the order of the list (k slowest within a line).
+    Repeated points are kept once; distinct points are never merged
+    """
+    numIndependentNames = len(MyList[0])
+    dtype = [('L', int), ('k', float)]
+    if numIndependentNames == 3:
+        dtype.append(('W', int))
+    blocks = []
+    for line in MyList:
+        L, ks = line[:2]
+        ks = scipy.atleast_1d(scipy.asarray(ks, dtype=float))
+        if numIndependentNames == 3:
+            Ws = line[2]
+            if isinstance(Ws, tuple):
+                lower_e, upper_e = scipy.log2(Ws[0]), scipy.log2(Ws[1])
+                Ws = 2**scipy.arange(int(lower_e), int(upper_e)+1)
+            Ws = scipy.atleast_1d(scipy.asarray(Ws, dtype=int))
+        else:
+            Ws = scipy.zeros(1, dtype=int)
+        block = scipy.empty(len(ks)*len(Ws), dtype=dtype)
+        block['L'] = L
+        block['k'] = scipy.repeat(ks, len(Ws))
+        if numIndependentNames == 3:
+            block['W'] = scipy.tile(Ws, len(ks))
+        blocks.append(block)
+    grid = scipy.concatenate(blocks)
+    unique, first = scipy.unique(grid, return_index=True)
+    return grid[scipy.sort(first)]
+
+def wincorr(grid, sigma = 0.387):
+    """
+    Sort key of the rows of an independent_grid: W (k/L)^sigma,
+    or k/L without W
+    """
+    kL = grid['k']/grid['L']
+    if 'W' in grid.dtype.names:
+        return grid['W']*kL**sigma
+    return kL
+
 def get_independent(MyList, sorting = False, sigma = 0.387):
     """
     Calculate the tuple of (L,k) or (L,k,W)
@@ -11,43 +56,111 @@ def get_independent(MyList, sorting = False, sigma = 0.387):
     ]
     The Windows W of Case 2 are calculated as powers of 2,
     from Wmin to Wmax included
+    With sorting, the values are sorted by W (k/L)^sigma (by k/L for
+    (L,k)), ties broken by L, k and W; otherwise they are in the order
+    of the list (see independent_grid)
     Output:
     independentNames (as "L,k", or "L,k,W")
     independentValues
     """
-    out = {}
-    numIndependentNames = len(MyList[0])
+    grid = independent_grid(MyList)
     independentNames = "L, k"
-    if numIndependentNames == 3:
+    if 'W' in grid.dtype.names:
         independentNames = independentNames + ", W"
-    #
-    for line in MyList:
-        if numIndependentNames == 2:
-            L, ks = line
-        elif numIndependentNames == 3:
-            L, ks, Ws = line
-            if isinstance(Ws,int):
-                Ws = [Ws]
-            elif isinstance(Ws,tuple):
-                lower_e, upper_e = scipy.log2(Ws[0]), scipy.log2(Ws[1])
-                e2 = scipy.array(range(lower_e, upper_e+1))
-                Ws = 2**e2
-        if not isinstance(ks,list):
-            ks = [ks]
-        
-        for k in ks:
-            if numIndependentNames == 2:
-                wincorr = 1.0*k/L
-                out[wincorr] = L, k
-            elif numIndependentNames == 3:
-                for W in Ws:
-                    wincorr = 1.0*W*(1.0*k/L)**sigma
-                    out[wincorr] = L, k, W
-
     if sorting:
-        return independentNames, map(out.get,sorted(out))
+        keys = [grid[name] for name in reversed(grid.dtype.names)]
+        grid = grid[scipy.lexsort(keys + [wincorr(grid, sigma)])]
+    independentValues = []
+    for row in grid.tolist():
+        # Integer k as in the file names (k=1, not k=1.0)
+        k = row[1]
+        if k == int(k):
+            k = int(k)
+        independentValues.append(row[:1] + (k,) + row[2:])
+    return independentNames, independentValues
+
+def get_fileName(dataDirectory, name, independent, simulType = "NonLinear", \
+                 k_string = "_k=", ext = ".bnd", template = None):
+    """
+    Name of the data file of a curve, as
+    A11_W=0016_k=0.001_System_Size=2048x1024_NonLinear.bnd
+    for independent = (L,k,W), and without the "_W=" part for (L,k).
+    A template such as "{name}_W={W:04d}_k{k}_L={L}_{simulType}.bnd"
+    may be given instead, with the fields name, L, k, W, L2 (= 2L),
+    simulType and k_string
+    """
+    L, k = independent[:2]
+    if template is not None:
+        W = len(independent) == 3 and independent[2] or None
+        return dataDirectory + template.format(name=name, L=L, k=k, W=W, \
+                                               L2=2*L, simulType=simulType, \
+                                               k_string=k_string)
+    parts = [dataDirectory, name]
+    if len(independent) == 3:
+        parts += ["_W=", str(independent[2]).rjust(4, str(0))]
+    parts += [k_string, str(k), "_System_Size=", str(2*L), "x", str(L), \
+              "_", simulType, ext]
+    return "".join(parts)
+
+fileNamePattern = re.compile(r"^(?P<name>\w+?)(_W=(?P<W>\d+))?"
+                             r"_k=?(?P<k>[-+.\deE]+)"
+                             r"_System_Size=\d+x(?P<L>\d+)"
+                             r"_(?P<simulType>\w+)\.bnd$")
+
+def parse_fileName(fileName):
+    """
+    Inverse of get_fileName, accepting both the "_k=" and "_k" spellings:
+    returns (name, independent, simulType), with independent = (L,k,W)
+    or (L,k), or None if fileName is not the name of a data file
+    """
+    match = fileNamePattern.match(os.path.basename(fileName))
+    if match is None:
+        return None
+    k = match.group('k')
+    if k.isdigit():
+        k = int(k)
+    else:
+        k = float(k)
+    independent = (int(match.group('L')), k)
+    if match.group('W') is not None:
+        independent += (int(match.group('W')),)
+    return match.group('name'), independent, match.group('simulType')
+
+def decimate_indices(X, Y, errorDown = None, errorUp = None, nBins = 1000, \
+                     linlog = 'log'):
+    """
+    Indices of the points to plot for a curve with many more points than
+    pixels: X is divided into nBins equal bins (in log10(X) if linlog is
+    'log'), and in each bin the points with the smallest and largest Y,
+    Y-errorDown and Y+errorUp are kept, so that the envelope of the data
+    and the extremes of the error bars are preserved.
+    Returns sorted indices (all of them if there are few points)
+    """
+    X = scipy.asarray(X)
+    nPoints = len(X)
+    if nPoints <= 4*nBins:
+        return scipy.arange(nPoints)
+    if linlog == 'log':
+        t = scipy.log10(scipy.where(X > 0, X, scipy.nan))
+        t = scipy.where(scipy.isnan(t), scipy.nanmin(t), t)
     else:
-        return independentNames, out.values()
+        t = scipy.asarray(X, dtype=float)
+    span = t.max() - t.min() or 1.
+    bins = scipy.clip(((t - t.min())/span*nBins).astype(int), 0, nBins-1)
+    values = [scipy.asarray(Y)]
+    if errorDown is not None:
+        values.append(values[0] - errorDown)
+    if errorUp is not None:
+        values.append(values[0] + errorUp)
+    keep = []
+    for v in values:
+        # Sorted by bin, then by value: first and last of each bin
+        order = scipy.lexsort((v, bins))
+        b = bins[order]
+        change = b[1:] != b[:-1]
+        keep.append(order[scipy.concatenate(([True], change))])
+        keep.append(order[scipy.concatenate((change, [True]))])
+    return scipy.unique(scipy.concatenate(keep))
 
 def reduceParameters(pNames,pValues,fixedParams):
     list_params = pNames.split(",")
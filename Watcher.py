@@ -0,0 +1,325 @@
+"""
+Long-running ingest mode: watches a data directory, installs each new
+.bnd file into the Data of the model named in the file name, and refits
+in the background.
+
+The directory is polled (its mtime is checked first, so an idle poll is
+a single stat); a file is installed once its size and mtime did not
+change between two polls, so files still being written are left alone.
+(L,k,W) are read from the file name (see Utils.parse_fileName). After the
+last new file, the watcher waits debounce seconds for more before the
+worker thread refits, warm-started from the previous best fit (see
+SloppyScaling.RefitModel), and writes the results as JSON to outputFile.
+
+Example:
+    watcher = Watcher.DirectoryWatcher(WS.dataDirectory, jointModule,
+                                       "fit_results.json")
+    watcher.Run()
+or from the shell:
+    python Watcher.py data/ -m A10,A11 -o fit_results.json --hold zeta=0.85
+"""
+
+import os
+import sys
+import json
+import time
+import optparse
+import threading
+import Utils
+import SloppyScaling
+import Registry
+
+def FileStamp(fileName):
+    info = os.stat(fileName)
+    return info.st_mtime, info.st_size
+
+
+class DirectoryWatcher:
+    """
+    fitModel is a Model or a CompositeModel; files are installed in the
+    model (or the model of the composite) whose name starts the file name.
+    The files already installed in the models are not installed again
+    """
+    def __init__(self, directory, fitModel, outputFile = "fit_results.json", \
+                 pollInterval = 5., debounce = 30., initialSkip = 0, \
+                 simulType = None, verbose = True):
+        self.directory = directory
+        self.fitModel = fitModel
+        if isinstance(fitModel, SloppyScaling.CompositeModel):
+            models = fitModel.Models.values()
+        else:
+            models = [fitModel]
+        self.models = dict([(model.name, model) for model in models])
+        self.outputFile = outputFile
+        self.pollInterval = pollInterval
+        self.debounce = debounce
+        self.initialSkip = initialSkip
+        self.simulType = simulType
+        self.verbose = verbose
+        # (mtime, size) of the files already installed (or ignored),
+        # and of the new files seen at the previous poll
+        self.seen = {}
+        for model in models:
+            for fileName in model.data.fileNames.values():
+                if fileName and os.path.exists(fileName):
+                    self.seen[os.path.abspath(fileName)] = FileStamp(fileName)
+        self.pending = {}
+        self.directoryTime = None
+        self.newFiles = []
+        # Held while the data are changed; fitting is True during a fit,
+        # and the files ready meanwhile are queued
+        self.lock = threading.Lock()
+        self.fitting = False
+        self.queued = []
+        self.condition = threading.Condition()
+        self.lastChange = None
+        self.dirty = False
+        self.stopping = False
+        self.worker = None
+        self.nFits = 0
+
+    def Poll(self):
+        """
+        Installs the new files that are complete; returns their names
+        """
+        directoryTime = os.stat(self.directory).st_mtime
+        if directoryTime != self.directoryTime:
+            self.directoryTime = directoryTime
+            candidates = [os.path.abspath(os.path.join(self.directory, f)) \
+                          for f in os.listdir(self.directory) \
+                          if f.endswith(".bnd")]
+        else:
+            candidates = self.pending.keys()
+        ready = []
+        for fileName in candidates:
+            try:
+                stamp = FileStamp(fileName)
+            except OSError:
+                self.pending.pop(fileName, None)
+                continue
+            if self.seen.get(fileName) == stamp:
+                continue
+            if self.pending.get(fileName) == stamp:
+                del self.pending[fileName]
+                ready.append(fileName)
+            else:
+                self.pending[fileName] = stamp
+        # The files are not installed while a fit is running: they are
+        # queued, and installed at the first poll after it
+        self.lock.acquire()
+        try:
+            if self.fitting:
+                self.queued += sorted(ready)
+                ready = []
+            else:
+                ready, self.queued = self.queued + sorted(ready), []
+            installed = [fileName for fileName in ready \
+                         if self.Ingest(fileName)]
+        finally:
+            self.lock.release()
+        if installed:
+            self.condition.acquire()
+            self.newFiles += installed
+            self.lastChange = time.time()
+            self.dirty = True
+            self.condition.notify()
+            self.condition.release()
+        return installed
+
+    def Ingest(self, fileName):
+        """
+        Installs fileName in its model; returns False if the file is not
+        a data file of one of the models, or if it is empty, truncated or
+        not readable (as Registry.LoadData, the curve is then removed).
+        Called with self.lock held, while no fit is running
+        """
+        self.seen[fileName] = FileStamp(fileName)
+        parsed = Utils.parse_fileName(fileName)
+        if parsed is None:
+            return False
+        name, independent, simulType = parsed
+        model = self.models.get(name)
+        if model is None or (self.simulType and simulType != self.simulType):
+            return False
+        nNames = len(model.theory.independentNames.split(","))
+        usesW = Registry.FileUsesW(name, nNames == 3)
+        if len(independent) != (usesW and 3 or 2):
+            return False
+        data = model.data
+        if len(independent) < nNames:
+            # (L,k) file of a model with (L,k,W) names (see
+            # Registry.LoadData): it replaces the curve of the same
+            # (L,k), or is installed with no W
+            matching = [ind for ind in data.experiments \
+                        if ind[:2] == independent]
+            if matching:
+                independent = matching[0]
+            else:
+                independent += (None,)*(nNames - len(independent))
+        Symbol, Color = Utils.MakeSymbolsAndColors( \
+            [ind for ind in data.experiments if ind != independent] + \
+            [independent])
+        try:
+            success = data.InstallCurve(independent, fileName, \
+                                        pointSymbol=Symbol[independent], \
+                                        pointColor=Color[independent], \
+                                        initialSkip=self.initialSkip)
+        except (ValueError, IndexError), error:
+            print "Cannot read %s: %s" % (fileName, error)
+            success = False
+        if not success or \
+                len(data.X[independent]) <= self.initialSkip + 1:
+            data.RemoveCurve(independent)
+            success = False
+        if success and self.verbose:
+            print "Installed %s %s" % (name, independent)
+        return success
+
+    def FitLoop(self):
+        """
+        Worker thread: refits once no file arrived for debounce seconds
+        """
+        while True:
+            self.condition.acquire()
+            try:
+                while not self.stopping and not self.dirty:
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                wait = self.lastChange + self.debounce - time.time()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                self.dirty = False
+                newFiles, self.newFiles = self.newFiles, []
+            finally:
+                self.condition.release()
+            self.Fit(newFiles)
+
+    def Fit(self, newFiles = ()):
+        """
+        Warm-started refit of fitModel; the results are published
+        """
+        self.lock.acquire()
+        self.fitting = True
+        curves = dict([(name, len(model.data.experiments)) \
+                       for name, model in self.models.items()])
+        self.lock.release()
+        try:
+            start = time.time()
+            try:
+                out, shifts = SloppyScaling.RefitModel(self.fitModel, \
+                                                       verbose=self.verbose)
+            except Exception, error:
+                print "Refit of %s failed: %s" % (self.fitModel.name, error)
+                self.Publish({'error': str(error), 'newFiles': list(newFiles)})
+                return None
+            seconds = time.time() - start
+        finally:
+            self.lock.acquire()
+            self.fitting = False
+            self.lock.release()
+        self.nFits += 1
+        covariance = out[1]
+        parameters = {}
+        for n, (name, old, new, sigma) in enumerate(shifts):
+            error = None
+            if covariance is not None and covariance[n, n] > 0:
+                error = float(covariance[n, n]**0.5)
+            parameters[name] = {'value': float(new), 'error': error, \
+                                'shift': float(new - old), 'shiftSigma': sigma}
+        results = {'model': self.fitModel.name, 'fit': self.nFits, \
+                   'seconds': seconds, 'nfev': out[2]['nfev'], \
+                   'cost': float(sum(out[2]['fvec']**2)), \
+                   'curves': curves, 'newFiles': list(newFiles), \
+                   'parameters': parameters}
+        self.Publish(results)
+        return results
+
+    def Publish(self, results):
+        """
+        Writes results as JSON to outputFile, replacing it atomically
+        so that readers never see a partial file
+        """
+        results = dict(results)
+        results['time'] = time.strftime("%Y-%m-%d %H:%M:%S")
+        temporary = self.outputFile + ".tmp"
+        outfile = open(temporary, 'w')
+        json.dump(results, outfile, indent=1, sort_keys=True)
+        outfile.close()
+        os.rename(temporary, self.outputFile)
+
+    def Start(self):
+        self.stopping = False
+        self.worker = threading.Thread(target=self.FitLoop)
+        self.worker.setDaemon(True)
+        self.worker.start()
+
+    def Stop(self):
+        self.condition.acquire()
+        self.stopping = True
+        self.condition.notify()
+        self.condition.release()
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+
+    def Run(self, duration = None):
+        """
+        Polls until interrupted (or for duration seconds)
+        """
+        self.Start()
+        start = time.time()
+        try:
+            while duration is None or time.time() - start < duration:
+                self.Poll()
+                time.sleep(self.pollInterval)
+        except KeyboardInterrupt:
+            pass
+        self.Stop()
+
+
+def main(argv):
+    parser = optparse.OptionParser( \
+        usage="python Watcher.py [DIRECTORY] [options]")
+    parser.add_option("-m", "--modules", \
+                      help="comma separated, e.g. A10,A11 (WS.moduleNames by default)")
+    parser.add_option("-o", "--output", default="fit_results.json")
+    parser.add_option("-i", "--interval", type="float", default=5., \
+                      help="seconds between polls")
+    parser.add_option("-d", "--debounce", type="float", default=30., \
+                      help="seconds without new files before refitting")
+    parser.add_option("--hold", action="append", default=[], \
+                      help="name=value of a held parameter (repeatable)")
+    options, args = parser.parse_args(argv)
+    import WindowScalingInfo as WS
+    directory = args and args[0] or WS.dataDirectory
+    moduleNames = options.modules and options.modules.split(",") or \
+                  WS.moduleNames
+    import Registry
+    models = [Registry.MakeModel(moduleName, WS, dataDirectory=directory) \
+              for moduleName in moduleNames]
+    heldParams = []
+    for hold in options.hold:
+        pName, pValue = hold.split("=")
+        heldParams.append((pName.strip(), float(pValue)))
+    if len(models) == 1:
+        fitModel = models[0]
+        fitModel.theory.HoldFixedParams(heldParams)
+    else:
+        fitModel = SloppyScaling.CompositeModel("".join(moduleNames))
+        for moduleName, model in zip(moduleNames, models):
+            fitModel.InstallModel(moduleName, model)
+        fitModel.HoldFixedParams(heldParams)
+    watcher = DirectoryWatcher(directory, fitModel, options.output, \
+                               options.interval, options.debounce, \
+                               WS.rows_to_skip, WS.simulType)
+    print "Watching %s (%s), results in %s" % (directory, \
+            ", ".join(moduleNames), options.output)
+    # Fit what is already loaded, then follow the new files
+    watcher.Fit()
+    watcher.Run()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
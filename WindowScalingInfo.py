@@ -1,7 +1,6 @@
-import os
+import getpass
 import scipy
 import Utils
-reload(Utils)
 
 """
 Useful information about the WindowScaling data sets
@@ -139,12 +138,17 @@ independentNames, independentValues = Utils.get_independent(A11_W, sorting = sor
 moduleNames = ['A11']
 
 
-# Directory where data to be fit is stored
+# Directory where data to be fit is stored, and spelling of k in the
+# file names ("_k=" or "_k"), per user.
+# getpass also works without a login terminal (cron, containers), where
+# os.getlogin fails. For runs without editing this file, see RunConfig.py
 # XXX We put all the different files into the same directory???
-if os.getlogin() == 'yj':
-    dataDirectory = "data/" #old data with problematic A10, and A01, but A11 are okay
-    dataDirectory = "data02_18/" #fixed A10 and A01 files, and only A10 are binned
-elif os.getlogin() == 'gf':
-    dataDirectory = "/home/meas/WinSim/NonLinear/data/"
+userSettings = {
+    # "data/": old data with problematic A10, and A01, but A11 are okay
+    # "data02_18/": fixed A10 and A01 files, and only A10 are binned
+    'yj': ("data02_18/", "_k"),
+    'gf': ("/home/meas/WinSim/NonLinear/data/", "_k="),
+}
+dataDirectory, k_string = userSettings.get(getpass.getuser(), ("data/", "_k="))
 
 Symbol, Color = Utils.MakeSymbolsAndColors(independentValues)
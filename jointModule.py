@@ -1,19 +1,9 @@
-import SloppyScaling
-reload(SloppyScaling)
+import Registry
 import WindowScalingInfo as WS
-reload(WS)
-
-# Import the modules chosen in WindowScalingInfo
-for moduleName in WS.moduleNames:
-    mod_name = moduleName + "Module"
-    exec("import "+ mod_name+" as "+moduleName)
-    exec("reload ("+moduleName+")")
 
+# The theory modules chosen in WindowScalingInfo are imported by the
+# registry, and share the settings of WindowScalingInfo
 jointModuleName = "".join(WS.moduleNames)
 
 print jointModuleName
-jointModule = SloppyScaling.CompositeModel(jointModuleName)
-for moduleName in WS.moduleNames:
-    exec("obj_mod = "+moduleName)
-    m = getattr(obj_mod,moduleName)
-    jointModule.InstallModel(moduleName, m)
\ No newline at end of file
+jointModule = Registry.MakeComposite(WS.moduleNames, WS, jointModuleName)